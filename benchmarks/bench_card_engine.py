@@ -0,0 +1,85 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Measures the client CPU time of one card decision (building the view, then
+# picking leveling and evolving arguments, as mimus_client.play does) with the
+# dict and NumPy card engines, for collections of several sizes.  No database
+# or network access.
+#
+# Usage: python benchmarks/bench_card_engine.py [--iterations N]
+#
+# pylint: disable=invalid-name,line-too-long
+"""Benchmark the client card decision engines."""
+from __future__ import with_statement
+import optparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+# Custom modules
+from mimus_cfg import cfg
+from timer import Timer
+import mimus_client
+
+
+def make_cards(num):
+    """Return a random collection of num cards, about a tenth evolvable."""
+    cards = {}
+    for card_id in range(1, num + 1):
+        cards[card_id] = {
+            'id': card_id,
+            'type': random.randint(cfg['loot_tables']['std']['min'],
+                                   cfg['loot_tables']['std']['max']),
+            'xp01': (cfg['card']['xp_limit'] if random.random() < 0.1 else
+                     100 * random.randint(0, 20)),
+        }
+    return cards
+
+
+def decide(engine, cards):
+    """One client card decision with the given engine."""
+    view = engine(cards, cfg['card']['xp_limit'])
+    return view.leveling_args(cfg['level']) or view.evolving_args(cfg['level'])
+
+
+def main():
+    """Time both engines and print a comparison."""
+    parser = optparse.OptionParser()
+    parser.add_option('-i', '--iterations', dest='iterations', default=200,
+                      type='int', help='decisions per engine and size (default: %default)')
+    (options, args) = parser.parse_args()  # pylint: disable=unused-variable
+
+    engines = [('dict', mimus_client.DictCardView)]
+    if mimus_client.NumpyCardView:
+        engines.append(('numpy', mimus_client.NumpyCardView))
+    else:
+        print "NumPy not installed, only timing the dict engine."
+
+    print "%6s  %s" % ('cards', '  '.join('%12s' % name for name, e in engines))
+    for num in (50, 200, 1000, 5000):
+        cards = make_cards(num)
+        times = []
+        for name, engine in engines:  # pylint: disable=unused-variable
+            with Timer() as t:
+                for i in range(options.iterations):  # pylint: disable=unused-variable
+                    decide(engine, cards)
+            times.append(t.elapsed / options.iterations)
+        print "%6d  %s" % (num, '  '.join('%9.03f ms' % (1000 * s) for s in times))
+
+
+if __name__ == "__main__":
+    main()
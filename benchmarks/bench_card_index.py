@@ -0,0 +1,123 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Measures the client CPU time of a card decision followed by applying its
+# outcome, for a player with 50, 500 and 5000 cards:
+#  - dict: the current functions, mimus_client.get_leveling_args and
+#    get_evolving_args on the cards dictionary (sorted from scratch each time)
+#  - index: card_index.CardIndex, updated with only the consumed and changed
+#    cards after each decision, as the server session does
+# Each decision's consumed cards are replaced by new ones, so the collection
+# size stays the same.  No database or network access.
+#
+# Usage: python benchmarks/bench_card_index.py [--iterations N]
+#
+# pylint: disable=invalid-name,line-too-long
+"""Benchmark incremental card indexes against the dict card functions."""
+from __future__ import with_statement
+import optparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+# Custom modules
+from card_index import CardIndex
+from mimus_cfg import cfg
+from timer import Timer
+import mimus_client
+
+
+def make_card(card_id):
+    """Return a random card, about a tenth of them evolvable."""
+    return {
+        'id': card_id,
+        'type': random.randint(cfg['loot_tables']['std']['min'],
+                               cfg['loot_tables']['std']['max']),
+        'xp01': (cfg['card']['xp_limit'] if random.random() < 0.1 else
+                 100 * random.randint(0, 20)),
+    }
+
+
+def apply_outcome(cards, args, next_id):
+    """Apply a decision to the cards like the server would: consume the
+    cards, add XP to the destination, and replace the consumed cards with
+    new ones.
+
+    Returns:
+        (ids of the removed cards, changed/added card dictionaries)
+    """
+    if not args:
+        return [], []
+    dest_id, consumed = args
+    for card_id in consumed:
+        del cards[card_id]
+    dest = dict(cards[dest_id])
+    dest['xp01'] = min(dest['xp01'] + 100 * len(consumed),
+                       cfg['card']['xp_limit'])
+    cards[dest_id] = dest
+    changed = [dest]
+    for i in range(len(consumed)):
+        new_card = make_card(next_id + i)
+        cards[new_card['id']] = new_card
+        changed.append(new_card)
+    return consumed, changed
+
+
+def run_dict(cards, iterations):
+    """Decisions with the current functions."""
+    next_id = max(cards) + 1
+    for i in range(iterations):  # pylint: disable=unused-variable
+        view = mimus_client.DictCardView(cards, cfg['card']['xp_limit'])
+        args = view.leveling_args(cfg['level']) or view.evolving_args(cfg['level'])
+        apply_outcome(cards, args, next_id)
+        next_id += cfg['level']['max_cards']
+
+
+def run_index(cards, iterations):
+    """Decisions on incrementally updated indexes."""
+    next_id = max(cards) + 1
+    index = CardIndex(cfg['card']['xp_limit'], cards)
+    for i in range(iterations):  # pylint: disable=unused-variable
+        args = index.leveling_args(cfg['level']) or index.evolving_args(cfg['level'])
+        removed, changed = apply_outcome(cards, args, next_id)
+        index.update(removed, changed)
+        next_id += cfg['level']['max_cards']
+
+
+def main():
+    """Time both and print a comparison."""
+    parser = optparse.OptionParser()
+    parser.add_option('-i', '--iterations', dest='iterations', default=200,
+                      type='int', help='decisions per size (default: %default)')
+    (options, args) = parser.parse_args()  # pylint: disable=unused-variable
+
+    print "%6s  %12s  %12s  %8s" % ('cards', 'dict', 'index', 'speedup')
+    for num in (50, 500, 5000):
+        times = []
+        for run in (run_dict, run_index):
+            random.seed(num)
+            cards = dict((card_id, make_card(card_id))
+                         for card_id in range(1, num + 1))
+            with Timer() as t:
+                run(cards, options.iterations)
+            times.append(t.elapsed / options.iterations)
+        print "%6d  %9.03f ms  %9.03f ms  %7.1fx" % (
+            num, 1000 * times[0], 1000 * times[1], times[0] / times[1])
+
+
+if __name__ == "__main__":
+    main()
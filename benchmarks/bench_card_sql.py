@@ -0,0 +1,104 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Measures the worker-side SQL time of consuming cards (the UPDATEs generated
+# by card.combine) one UPDATE per consumed card versus a single set-based
+# 'UPDATE ... WHERE id IN (...)'.  Runs against the database configured in
+# db_config.py, under a throwaway owner id, and cleans up after itself.
+#
+# Usage: python benchmarks/bench_card_sql.py [--iterations N] [--consume N]
+#
+# pylint: disable=invalid-name,line-too-long
+"""Benchmark per-row versus set-based card consumption SQL."""
+from __future__ import with_statement
+import optparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+# Custom modules
+from db_config import backend, db_connect, dbc
+from timer import Timer
+import db_api.objects.card as card
+import db_api.statement_generator as db_api_query
+
+# Owner id used for the benchmark's cards; not a valid CRC32 of any name the
+# client generates in practice, and removed afterwards.
+BENCH_OWNER = 4294967295
+
+
+def per_row_consume(dest, card_ids):
+    """The card.combine consumption queries as they were generated before
+    set-based updates: one UPDATE per consumed card."""
+    return [db_api_query.update_template(card.table_schema, key,
+                                         {'ownerid': 0, 'levels': dest['id']})
+            for key in card_ids]
+
+
+def set_based_consume(dest, card_ids):
+    """The card.combine consumption query: one UPDATE for all cards."""
+    return [query for query, return_type in card.combine(dest, card_ids)[:-1]]  # pylint: disable=unused-variable
+
+
+def run_one(con, cursor, consume, num_cards):
+    """Create cards, then time consuming all but one of them."""
+    for query, return_type in card.create_many(BENCH_OWNER, [1] * num_cards):  # pylint: disable=unused-variable
+        cursor.execute(*db_api_query.statement(query))
+    cursor.execute(*db_api_query.statement(card.get_all(BENCH_OWNER)[0][0]))
+    ids = [row[0] for row in cursor.fetchall()]
+    con.commit()
+
+    dest = {'id': ids[0], 'xp01': 0}
+    with Timer() as t:
+        for query in consume(dest, ids[1:]):
+            cursor.execute(*db_api_query.statement(query))
+        con.commit()
+    return t.elapsed
+
+
+def main():
+    """Run both variants and print a comparison."""
+    parser = optparse.OptionParser()
+    parser.add_option('-i', '--iterations', dest='iterations', default=200,
+                      type='int', help='consume actions per variant (default: %default)')
+    parser.add_option('-c', '--consume', dest='consume', default=5,
+                      type='int', help='cards consumed per action (default: %default)')
+    (options, args) = parser.parse_args()  # pylint: disable=unused-variable
+
+    con = db_connect()
+    backend.setup_connection(con, dbc['name'])
+    cursor = con.cursor()
+
+    print "%d actions consuming %d cards each:" % (options.iterations,
+                                                   options.consume)
+    try:
+        for name, consume in (('per-row', per_row_consume),
+                              ('set-based', set_based_consume)):
+            total = 0.0
+            for i in range(options.iterations):  # pylint: disable=unused-variable
+                total += run_one(con, cursor, consume, options.consume + 1)
+            print "  %-10s %8.03f ms/action  (%d statements/action)" % (
+                name, 1000 * total / options.iterations,
+                len(consume({'id': 0, 'xp01': 0}, range(options.consume))))
+    finally:
+        cursor.execute("DELETE FROM card WHERE ownerid=%d OR levels IN "
+                       "(SELECT id FROM (SELECT id FROM card WHERE ownerid=%d) AS c)" %
+                       (BENCH_OWNER, BENCH_OWNER))
+        con.commit()
+
+
+if __name__ == "__main__":
+    main()
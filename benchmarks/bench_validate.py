@@ -0,0 +1,90 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Measures the client CPU time of generating the statements the server sends
+# most often, with data validation done:
+#  - before: by walking the whole table schema for every statement, as
+#    statement_generator._validate_data used to
+#  - after: by the per-table validators from
+#    statement_generator.compile_validator, which only look at the fields
+#    present in the data
+# No database or network access.
+#
+# Usage: python benchmarks/bench_validate.py [--iterations N]
+#
+# pylint: disable=invalid-name,line-too-long
+"""Benchmark statement generation with compiled validators."""
+from __future__ import with_statement
+import optparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+# Custom modules
+from db_api.datatypes.SQL import types
+from timer import Timer
+import db_api.objects.card as card
+import db_api.objects.player as player
+import db_api.statement_generator as db_api_query
+
+
+def schema_walk_validate(table, data):
+    """statement_generator._validate_data as it was before compiled
+    validators (without the overflow logging, which none of these
+    statements trigger)."""
+    for field, data_type in table['schema'].iteritems():
+        if not field == table['primary_key'] and field in data:
+            if int(data[field]) < 0:
+                data[field] = 0
+            elif int(data[field]) > types[data_type]['max_value']:
+                data[field] = types[data_type]['max_value']
+    return data
+
+
+STATEMENTS = [
+    ('player update', lambda: player.update(
+        {'id': 1234567, 'slots': 50, 'points': 1000, 'stones': 5, 'stamina': 4})),
+    ('card xp update', lambda: card.combine({'id': 42, 'xp01': 300}, [])),
+    ('card create', lambda: card.create(1234567, 17)),
+    ('card consume', lambda: card.combine({'id': 42, 'xp01': 300}, [1, 2, 3, 4])),
+]
+
+
+def main():
+    """Time statement generation before and after, and print a
+    comparison."""
+    parser = optparse.OptionParser()
+    parser.add_option('-i', '--iterations', dest='iterations', default=100000,
+                      type='int', help='statements per variant (default: %default)')
+    (options, args) = parser.parse_args()  # pylint: disable=unused-variable
+
+    compiled = db_api_query._validate_data  # pylint: disable=protected-access
+    print "%-16s  %10s  %10s  %8s" % ('statement', 'before', 'after', 'speedup')
+    for name, generate in STATEMENTS:
+        times = []
+        for validate in (schema_walk_validate, compiled):
+            db_api_query._validate_data = validate  # pylint: disable=protected-access
+            with Timer() as t:
+                for i in xrange(options.iterations):  # pylint: disable=unused-variable
+                    generate()
+            times.append(t.elapsed / options.iterations)
+        db_api_query._validate_data = compiled  # pylint: disable=protected-access
+        print "%-16s  %7.02f us  %7.02f us  %7.1fx" % (
+            name, 1e6 * times[0], 1e6 * times[1], times[0] / times[1])
+
+
+if __name__ == "__main__":
+    main()
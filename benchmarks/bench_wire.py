@@ -0,0 +1,163 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compares the JSON and binary (db_api/wire.py) encodings of the batches the
+# server sends and the results the db worker returns, for a few typical
+# transactions: bytes per transaction (batch + results), and the CPU time to
+# encode and decode both.  Logins are also measured with columnar results
+# (db_api.columnar_results), and the other transactions as intents
+# (db_api.intents, always JSON encoded).  The results are made up to look like the
+# worker's, including its timers.  No database or network access.
+#
+# Usage: python benchmarks/bench_wire.py [--iterations N]
+#
+# pylint: disable=invalid-name,line-too-long
+"""Benchmark the binary wire format against JSON."""
+from __future__ import with_statement
+import json
+import optparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+# Custom modules
+from timer import Timer
+import db_api.intents as intents
+import db_api.objects.card as card
+import db_api.objects.player as player
+import db_api.wire as wire
+
+PLAYER_ID = 2788244105
+PLAYER = {'id': PLAYER_ID, 'slots': 50, 'points': 1000, 'stones': 5,
+          'stamina': 4}
+
+
+def make_card(card_id):
+    """Return a card row."""
+    return {'id': card_id, 'ownerid': PLAYER_ID,
+            'type': random.randint(1, 600), 'stones': 0, 'points': 0,
+            'evolves': 0, 'levels': 0, 'xp01': 100 * random.randint(0, 20),
+            'xp02': 0}
+
+
+def columnar(rows):
+    """Return rows in the columnar results format."""
+    columns = list(rows[0])
+    return {'columns': columns,
+            'rows': [tuple(row[column] for column in columns) for row in rows]}
+
+
+def worker_results(queries, results):
+    """Add the 'affected' count and timers the worker would to results."""
+    timers = {'010 q wait': 0.002, '020 (pull wait)': 0.0001,
+              '050 json_load': 0.00005, '800 commit': 0.003, '801 ack': 0.001,
+              '802 redis ack': 1476000000.1, '900 ===TOTAL===': 1476000000.0,
+              '910 (===WORKER PROCESSING===)': 0.008}
+    for num, (query, return_type) in enumerate(queries):  # pylint: disable=unused-variable
+        timers['%d %s %d %s:%s' % (100 + num, 'UPDATE', random.getrandbits(32),
+                                   PLAYER_ID, '3c9a4f0e-8f61-4d8b-9b53-0f1f2b7a6c55')] = 0.0004
+    results['affected'] = len(queries)
+    results['timers'] = timers
+    return results
+
+
+def transactions(num_cards):
+    """Return (name, queries, results) for typical transactions."""
+    cards = [make_card(card_id) for card_id in range(1000, 1000 + num_cards)]
+    login = card.get_all(PLAYER_ID) + player.get(PLAYER_ID)
+    level = (card.combine(cards[0], [c['id'] for c in cards[1:6]]) +
+             card.get([cards[0]['id']]) + player.update(PLAYER) +
+             player.get(PLAYER_ID))
+    stage = (card.create_many(PLAYER_ID, [17, 230]) + player.update(PLAYER) +
+             player.get(PLAYER_ID))
+    level_results = {'consumed': [{'first_id': 0, 'rowcount': 5}],
+                     'cardchanges': [cards[0]], 'player': [PLAYER]}
+    stage_results = {'inserted': [{'first_id': 5000, 'rowcount': 2}],
+                     'player': [PLAYER]}
+    return [
+        ('login, %d cards' % num_cards, login,
+         worker_results(login, {'cardlist': cards, 'player': [PLAYER]})),
+        ('  (columns)', login,
+         worker_results(login, {'cardlist': columnar(cards),
+                                'player': columnar([PLAYER])})),
+        ('level', level, worker_results(level, dict(level_results))),
+        ('  (intent)',
+         intents.level_card(PLAYER_ID, cards[0], [c['id'] for c in cards[1:6]]),
+         worker_results(level, dict(level_results))),
+        ('play stage', stage, worker_results(stage, dict(stage_results))),
+        ('  (intent)', intents.play_stage(PLAYER_ID, [17, 230], 1010),
+         worker_results(stage, dict(stage_results))),
+    ]
+
+
+def encode_batch(queries, encode):
+    """Encode a batch with encode, or as JSON if it's an intent."""
+    if isinstance(queries, dict):
+        return json.dumps(queries)
+    return encode(queries)
+
+
+def json_round_trip(queries, results):
+    """Encode and decode a transaction as JSON; return the bytes sent."""
+    batch = encode_batch(queries, lambda q: json.dumps({'queries': q}))
+    json.loads(batch)
+    stored = json.dumps(results)
+    json.loads(stored)
+    return len(batch) + len(stored)
+
+
+def binary_round_trip(queries, results):
+    """Encode and decode a transaction in the binary format; return the
+    bytes sent."""
+    batch = encode_batch(queries, wire.encode_queries)
+    if isinstance(queries, dict):
+        json.loads(batch)
+    else:
+        wire.decode_queries(batch)
+    stored = wire.encode_results(results)
+    wire.decode_results(stored)
+    return len(batch) + len(stored)
+
+
+def main():
+    """Time both encodings and print a comparison."""
+    parser = optparse.OptionParser()
+    parser.add_option('-i', '--iterations', dest='iterations', default=2000,
+                      type='int', help='round trips per transaction and encoding (default: %default)')
+    (options, args) = parser.parse_args()  # pylint: disable=unused-variable
+
+    random.seed(1)
+    print "%-18s  %8s  %8s  %11s  %11s" % ('transaction', 'json', 'binary',
+                                           'json cpu', 'binary cpu')
+    for num_cards in (50, 500):
+        for name, queries, results in transactions(num_cards):
+            if num_cards != 50 and not name.startswith(('login', '  (columns)')):
+                continue
+            sizes = []
+            times = []
+            for round_trip in (json_round_trip, binary_round_trip):
+                with Timer() as t:
+                    for i in range(options.iterations):  # pylint: disable=unused-variable
+                        size = round_trip(queries, results)
+                sizes.append(size)
+                times.append(t.elapsed / options.iterations)
+            print "%-18s  %6d B  %6d B  %8.01f us  %8.01f us" % (
+                name, sizes[0], sizes[1], 1e6 * times[0], 1e6 * times[1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Persistent sorted indexes of a player's cards, for the client's card
+# decisions (see mimus_client.get_leveling_args and get_evolving_args).
+# Instead of sorting the whole collection for every decision, the session
+# keeps these indexes up to date with the cards each server response adds,
+# consumes or changes, and decisions look cards up by rank with bisect.
+#
+# Each index is a sorted list of (value, tie-break, card id) keys:
+#  - by_xp: all cards by xp01.  Levelable cards come first, since evolvable
+#    cards are the ones at or above the XP limit.
+#  - by_type: all cards by type (rarity).
+#  - level_by_type / evolve_by_type: the level/evolve partition from
+#    mimus_client.attributes(), by type.
+#
+# Cards with equal values are ordered by a random tie-break drawn when the
+# card is added or changed, like the random order swizzle() gives them.
+# Unlike swizzle(), the order of tied cards that haven't changed stays the
+# same from one decision to the next.
+#
+# pylint: disable=invalid-name
+"""Incrementally maintained sorted indexes of a player's cards."""
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from random import random, randint, randrange
+
+
+def _remove(index, key):
+    """Remove key from a sorted index."""
+    del index[bisect_left(index, key)]
+
+
+class CardIndex(object):
+    """Sorted indexes of a player's cards.
+
+    Has the same leveling_args/evolving_args interface as
+    mimus_client.DictCardView and card_view.CardView.
+
+    Attributes:
+        xp_limit: XP at which a card can be evolved instead of leveled.
+        by_xp: Keys of all cards, by xp01.
+        by_type: Keys of all cards, by type.
+        level_by_type: Keys of levelable cards, by type.
+        evolve_by_type: Keys of evolvable cards, by type.
+    """
+
+    def __init__(self, xp_limit, cards=None):
+        """Build the indexes.
+
+        Args:
+            xp_limit: XP at which a card can be evolved instead of leveled.
+            cards: (optional) Dictionary of card dictionaries keyed by card
+                id, like mimus_server.Session.cards.
+        """
+        self.xp_limit = xp_limit
+        self.reset(cards or {})
+
+    def __len__(self):
+        return len(self._keys)
+
+    def reset(self, cards):
+        """Rebuild the indexes from a full collection of cards."""
+        self._keys = {}  # card id -> (xp key, type key, evolvable)
+        self.by_xp = []
+        self.by_type = []
+        self.level_by_type = []
+        self.evolve_by_type = []
+        for c in cards.itervalues():
+            xp_key, type_key, evolvable = self._make_keys(c)
+            self._keys[c['id']] = (xp_key, type_key, evolvable)
+            self.by_xp.append(xp_key)
+            self.by_type.append(type_key)
+            if evolvable:
+                self.evolve_by_type.append(type_key)
+            else:
+                self.level_by_type.append(type_key)
+        for index in (self.by_xp, self.by_type, self.level_by_type,
+                      self.evolve_by_type):
+            index.sort()
+
+    def _make_keys(self, c):
+        """Return the index keys for a card."""
+        # Independent tie-breaks, as swizzle() shuffles ties separately for
+        # each field.
+        return ((c['xp01'], random(), c['id']),
+                (c['type'], random(), c['id']),
+                c['xp01'] >= self.xp_limit)
+
+    def add(self, c):
+        """Add a card, or re-index a card that changed."""
+        if c['id'] in self._keys:
+            self.remove(c['id'])
+        xp_key, type_key, evolvable = keys = self._make_keys(c)
+        self._keys[c['id']] = keys
+        insort(self.by_xp, xp_key)
+        insort(self.by_type, type_key)
+        insort(self.evolve_by_type if evolvable else self.level_by_type,
+               type_key)
+
+    def remove(self, card_id):
+        """Remove a card, if it is indexed."""
+        if card_id not in self._keys:
+            return
+        xp_key, type_key, evolvable = self._keys.pop(card_id)
+        _remove(self.by_xp, xp_key)
+        _remove(self.by_type, type_key)
+        _remove(self.evolve_by_type if evolvable else self.level_by_type,
+                type_key)
+
+    def update(self, removed=(), changed=()):
+        """Apply the card changes from a server response.
+
+        Args:
+            removed: Ids of the cards that were consumed.
+            changed: Card dictionaries of the cards that were added or
+                changed.
+        """
+        for card_id in removed:
+            self.remove(card_id)
+        for c in changed:
+            self.add(c)
+
+    def leveling_args(self, level_cfg):
+        """Same as mimus_client.get_leveling_args.
+
+        Args:
+            level_cfg: The 'level' configuration section (min/max cards to
+                consume).
+
+        Returns:
+            (dest_id, set of card ids to consume), or False if there is
+            nothing to level.
+        """
+        num_level = len(self.level_by_type)
+        if not (len(self.evolve_by_type) < num_level and len(self) > 15):
+            return False
+
+        # The rarest third of the levelable cards are targets, never
+        # consumed: every levelable card ranked at or above the threshold.
+        top = num_level / 3
+        if not top:
+            return False
+        threshold = self.level_by_type[num_level - top]
+
+        def consumable(key):
+            """Levelable and not one of the rarest third."""
+            xp_key, type_key, evolvable = self._keys[key[2]]  # pylint: disable=unused-variable
+            return not evolvable and type_key < threshold
+
+        # Levelable cards come first in by_xp.
+        candidates = (key[2] for key in islice(self.by_xp, num_level)
+                      if consumable(key))
+        first = next(candidates, None)
+        if first is None:
+            return False
+        num_to_consume = randint(level_cfg['min_cards'],
+                                 min(level_cfg['max_cards'], top))
+        cards_to_consume = set([first])
+        for card_id in candidates:
+            if len(cards_to_consume) >= num_to_consume:
+                break
+            cards_to_consume.add(card_id)
+
+        dest_id = self.level_by_type[num_level - 1 - randrange(top)][2]
+        return (dest_id, cards_to_consume)
+
+    def evolving_args(self, level_cfg):
+        """Same as mimus_client.get_evolving_args.
+
+        Args:
+            level_cfg: The 'level' configuration section (min/max cards to
+                consume).
+
+        Returns:
+            (dest_id, set of card ids to consume), or False if there is
+            nothing to evolve.
+        """
+        num_evolve = len(self.evolve_by_type)
+        if not (num_evolve and len(self) >= 15):
+            return False
+
+        # The rarest third of the evolvable cards are targets, never consumed.
+        top = num_evolve / 3
+        if not top:
+            return False
+        dest_id = self.evolve_by_type[num_evolve - 1 - randrange(top)][2]
+        threshold = self.evolve_by_type[num_evolve - top]
+
+        # Of the rest, the rarest third aren't consumed either.
+        num_rest = len(self) - top
+        rare_rest = num_rest / 3
+        if num_rest - rare_rest <= 0:
+            return False
+
+        def consumable(key):
+            """Not a target, and not one of the rarest third of the rest."""
+            xp_key, type_key, evolvable = self._keys[key[2]]  # pylint: disable=unused-variable
+            if evolvable and type_key >= threshold:
+                return False
+            # Cards rarer than this one, less the targets among them.
+            rarer = len(self.by_type) - bisect_right(self.by_type, type_key)
+            rarer_targets = min(top, num_evolve - bisect_right(
+                self.evolve_by_type, type_key))
+            return rarer - rarer_targets >= rare_rest
+
+        num_to_consume = randint(level_cfg['min_cards'],
+                                 min(level_cfg['max_cards'],
+                                     num_rest - rare_rest))
+        cards_to_consume = set()
+        for key in self.by_xp:
+            if len(cards_to_consume) >= num_to_consume:
+                break
+            if consumable(key):
+                cards_to_consume.add(key[2])
+        return (dest_id, cards_to_consume)
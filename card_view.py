@@ -0,0 +1,148 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# NumPy implementation of the client's card decisions (see
+# mimus_client.get_leveling_args and get_evolving_args).  The player's cards
+# are copied into id/type/xp01 columns once per decision, and the sorting and
+# filtering the dictionary version does with swizzle() and list.remove()
+# become array sorts and slices.
+#
+# The decisions are the same as the dictionary version's.  It sorts the
+# evolve targets with swizzle(), which orders cards with equal values
+# randomly; that is done here by sorting on the value and then on a random
+# key (numpy.lexsort).  The cards it consumes, and level targets, it takes in
+# the order a set of their ids iterates in (it turns swizzle()'s lists into
+# sets), and so does this version.  The counts and choices that use the
+# random module in the dictionary version still do here.
+#
+# pylint: disable=invalid-name,no-member
+"""Array-backed view of a player's cards for client decisions."""
+from random import randint, randrange
+import numpy
+
+# Tie-breaking keys.  Seeded by seed(), for repeatable simulations.
+_rng = numpy.random.RandomState()
+
+
+def seed(value):
+    """Seed the random tie-breaking."""
+    _rng.seed(value)
+
+
+def _sort(rows, values):
+    """Return rows sorted by ascending values[rows], ties in random order."""
+    return rows[numpy.lexsort((_rng.random_sample(len(rows)), values[rows]))]
+
+
+def _set_order(view, rows):
+    """Return rows in the order a set of their card ids iterates in."""
+    ids = view.ids[rows].tolist()
+    row_of = dict(zip(ids, rows.tolist()))
+    return numpy.array([row_of[card_id] for card_id in set(ids)],
+                       dtype=numpy.intp)
+
+
+def _ids(view, rows):
+    """Return the card ids of rows as a set of ints."""
+    return set(view.ids[rows].tolist())
+
+
+class CardView(object):
+    """Columns of a player's cards.
+
+    Attributes:
+        ids: Card ids.
+        types: Card types, rarer cards have higher types.
+        xp: Card XP (the 'xp01' field).
+        evolvable: Boolean mask of the cards with enough XP to evolve.
+    """
+
+    def __init__(self, cards, xp_limit):
+        """Build the columns.
+
+        Args:
+            cards: Dictionary of card dictionaries keyed by card id, like
+                mimus_server.Session.cards.
+            xp_limit: XP at which a card can be evolved instead of leveled.
+        """
+        num = len(cards)
+        self.ids = numpy.fromiter(cards.iterkeys(), numpy.int64, num)
+        self.types = numpy.fromiter(
+            (c['type'] for c in cards.itervalues()), numpy.int64, num)
+        self.xp = numpy.fromiter(
+            (c['xp01'] for c in cards.itervalues()), numpy.int64, num)
+        self.evolvable = self.xp >= xp_limit
+
+    def leveling_args(self, level_cfg):
+        """Same as mimus_client.get_leveling_args.
+
+        Args:
+            level_cfg: The 'level' configuration section (min/max cards to
+                consume).
+
+        Returns:
+            (dest_id, set of card ids to consume), or False if there is
+            nothing to level.
+        """
+        num_evolvable = int(self.evolvable.sum())
+        num_levelable = len(self.ids) - num_evolvable
+        if not (num_evolvable < num_levelable and len(self.ids) > 15):
+            return False
+
+        # The last third of the candidates, in set order, are targets, never
+        # consumed.
+        candidates = _set_order(self, numpy.flatnonzero(~self.evolvable))
+        top_third = candidates[::-1][:len(candidates) / 3]
+        by_xp = candidates[:len(candidates) - len(top_third)]
+
+        if not (len(by_xp) and len(top_third)):
+            return False
+        num_to_consume = randint(level_cfg['min_cards'],
+                                 min(level_cfg['max_cards'], len(top_third)))
+        cards_to_consume = _ids(self, by_xp[:num_to_consume])
+        dest_id = int(self.ids[top_third[randrange(len(top_third))]])
+        return (dest_id, cards_to_consume)
+
+    def evolving_args(self, level_cfg):
+        """Same as mimus_client.get_evolving_args.
+
+        Args:
+            level_cfg: The 'level' configuration section (min/max cards to
+                consume).
+
+        Returns:
+            (dest_id, set of card ids to consume), or False if there is
+            nothing to evolve.
+        """
+        if not (self.evolvable.any() and len(self.ids) >= 15):
+            return False
+
+        # Rarest third of the evolvable cards are targets, never consumed.
+        by_rarity = _sort(numpy.flatnonzero(self.evolvable), self.types)[::-1]
+        top_candidates = by_rarity[:len(by_rarity) / 3]
+        if not len(top_candidates):
+            return False
+        dest_id = int(self.ids[top_candidates[randrange(len(top_candidates))]])
+
+        # Of the rest, in set order, don't consume the last third either.
+        rest = numpy.ones(len(self.ids), dtype=bool)
+        rest[top_candidates] = False
+        rest = _set_order(self, numpy.flatnonzero(rest))
+        by_xp = rest[:len(rest) - len(rest) / 3]
+
+        if not len(by_xp):
+            return False
+        num_to_consume = randint(level_cfg['min_cards'],
+                                 min(level_cfg['max_cards'], len(by_xp)))
+        return (dest_id, _ids(self, by_xp[:num_to_consume]))
@@ -0,0 +1,79 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A storage backend is the database engine the db workers run statements on.
+# Each backend is a module in this package providing:
+#
+#  dialect
+#    Name of the engine's SQL dialect ('redis' for the Redis store, which has
+#    no SQL).
+#
+#  savepoints
+#    Whether transactions can be rolled back to a SAVEPOINT, which group
+#    commit (db_worker --batch-size) needs.
+#
+#  Error, OperationalError, IntegrityError
+#    Exception classes of the engine's driver: the base class of its errors,
+#    a lost or failed connection (the transaction is retried), and a
+#    constraint violation.
+#
+#  connect(params)
+#    Returns a new connection to the database described by a db_config.py
+#    connection parameters dictionary.  Connections have the subset of the
+#    MySQLdb connection API the db workers use: autocommit(on), cursor(),
+#    commit(), rollback(), ping() and close().  Cursors have execute(sql,
+#    params) and executemany(sql, param_lists), with '%s' placeholders,
+#    fetchall(), close(), and the 'description', 'rowcount' and 'lastrowid'
+#    attributes.  After an executemany INSERT, lastrowid is the id of the
+#    first row inserted.
+#
+#    Cursors of backends that run a whole transaction at once (the Redis
+#    store) also have execute_transaction(statements), which the worker calls
+#    with all of a transaction's statements (see
+#    db_worker.group_statements) before executing them one by one.
+#
+#  create_database(cursor, name)
+#    Creates the database if it doesn't exist, and switches to it.
+#
+#  create_tables(cursor, tnames, c)
+#    Creates the tables described by the db_api/objects modules named, if
+#    they don't exist.  c is the mimus config.
+#
+#  setup_connection(con, name)
+#    Prepares a newly opened connection for running transactions on the
+#    database: autocommit off, and the engine's session settings.
+#
+#  interleaves_ids
+#    Whether the backend has interleave_ids.  The worker refuses to step the
+#    ids of one that doesn't (db_shards.id_step above 1), so it can't be
+#    sharded.
+#
+#  interleave_ids(cursor, step, offset)
+#    Only if interleaves_ids.  Makes the AUTO_INCREMENT ids the connection
+#    hands out start at offset and go up by step, so the ids of several
+#    shards don't collide.
+#
+# pylint: disable=invalid-name
+"""Pluggable storage backends for the db workers."""
+from importlib import import_module
+
+
+def load(name):
+    """Return the storage backend module with the given name.
+
+    Args:
+        name: Name of a module in this package, 'mysql', 'sqlite' or
+            'redis_store'.
+    """
+    return import_module('db_api.backends.%s' % name)
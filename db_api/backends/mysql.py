@@ -0,0 +1,83 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# MySQL storage backend (Cloud SQL, or any MySQL 5.6+ server), through
+# MySQLdb.  See db_api/backends/__init__.py for the interface.
+#
+# pylint: disable=invalid-name
+"""MySQL storage backend."""
+import MySQLdb as mysql
+
+# Custom modules
+from db_api.statement_generator import create_table
+
+dialect = 'mysql'
+interleaves_ids = True
+savepoints = True
+
+Error = mysql.Error
+OperationalError = mysql.OperationalError
+IntegrityError = mysql.IntegrityError
+
+
+def connect(params):
+    """Open a connection to a MySQL database.
+
+    Args:
+        params: Connection parameters (see db_config.py).  Connects through
+            the Cloud SQL proxy's unix socket if they have a 'path', otherwise
+            over TCP.
+    """
+    if 'path' in params:
+        # Use the cloudsql proxy
+        return mysql.connect(host=params['host'],
+                             user=params['user'],
+                             passwd=params['pass'],
+                             db=params['name'],
+                             unix_socket=params['path'])
+    # standard TCP mysql connection
+    return mysql.connect(host=params['host'],
+                         port=params['port'],
+                         user=params['user'],
+                         passwd=params['pass'],
+                         db=params['name'])
+
+
+def create_database(cursor, name):
+    """Create the database if it doesn't exist, and switch to it."""
+    cursor.execute("CREATE DATABASE IF NOT EXISTS %s" % name)
+    cursor.execute("USE %s" % name)
+
+
+def create_tables(cursor, tnames, c):
+    """Create the tables if they don't exist."""
+    for tname in tnames:
+        for SQL in create_table(tname, c, dialect):
+            cursor.execute(SQL)
+
+
+def setup_connection(con, name):
+    """Prepare a newly opened connection for running transactions."""
+    con.autocommit(False)
+    cursor = con.cursor()
+    cursor.execute("USE %s" % name)
+    cursor.execute('SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED')
+    cursor.close()
+
+
+def interleave_ids(cursor, step, offset):
+    """Make the connection's AUTO_INCREMENT ids start at offset and go up by
+    step."""
+    cursor.execute('SET SESSION auto_increment_increment = %d, auto_increment_offset = %d' %
+                   (step, offset))
@@ -0,0 +1,430 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Redis storage backend: keeps the player and card tables in Redis instead of
+# a SQL database, to measure how the game runs without a SQL layer at all.
+# See db_api/backends/__init__.py for the interface.
+#
+# Each table (see the table_schema of the db_api/objects modules) is stored
+# as, with keys prefixed by the database name ('mimus:'):
+#  - <table>:<id>                  hash of the row's fields
+#  - <table>:<field>:<value>       set of the ids of the rows with that value,
+#                                  for each of its indexed_fields (so a
+#                                  player's cards are in card:ownerid:<id>)
+#  - <table>:next_id               counter of the AUTO_INCREMENT ids handed
+#                                  out, for rows inserted without an id
+#
+# Only statement templates (see db_api/statement_generator.py) can run.  The
+# db worker hands a cursor all of a transaction's statements at once
+# (execute_transaction), and they run in order in one Lua script, which Redis
+# runs atomically: no other client sees a transaction half done, and it takes
+# one round trip.  The worker then executes the statements one by one as for
+# any backend, which just returns the results the script gave each.
+#
+# Redis doesn't undo the writes a script made before an error, so templates
+# are checked before the script runs, and an INSERT of a duplicate id is
+# checked before it writes anything (it then raises IntegrityError, and the
+# rest of the transaction goes ahead, as in MySQL).  Rolling back a
+# transaction that has run does nothing, so the worker can't group commit
+# (--batch-size) on this backend, as that relies on savepoints.  How much a
+# commit survives a crash is down to the Redis server's appendonly and
+# appendfsync settings.
+#
+# pylint: disable=invalid-name,line-too-long
+"""Redis storage backend."""
+from collections import deque
+from importlib import import_module
+
+import redis
+
+dialect = 'redis'
+interleaves_ids = True
+# Each transaction's script can't be undone, so there is nothing to roll a
+# failed transaction of a group commit back to.
+savepoints = False
+
+Error = redis.RedisError
+OperationalError = redis.ConnectionError
+
+
+class IntegrityError(redis.RedisError):
+    """An INSERT would have duplicated a row's id."""
+
+
+# Runs a transaction's statements.  ARGV holds the key prefix, the step and
+# offset of new ids, and the number of statements, then for each statement:
+# its operation ('insert', 'select' or 'update'), table, key field, primary
+# key, comma-separated fields, indexed fields and columns, and its number of
+# parameter lists, their length and all their parameters.  Returns, for each
+# statement, {status (0, or 1 for a duplicate id), rowcount, lastrowid, rows},
+# rows being the values of every column of each row, one row after another.
+TRANSACTION_SCRIPT = """
+local prefix, step, offset = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local unpack = unpack or table.unpack
+
+local function split(s)
+    local parts = {}
+    for part in string.gmatch(s, '[^,]+') do
+        table.insert(parts, part)
+    end
+    return parts
+end
+
+local function ids_by_number(a, b)
+    return tonumber(a) < tonumber(b)
+end
+
+local function insert(tname, fields, indexed, columns, pkey, params)
+    local ids = {}
+    local generated = 0
+    for r, row in ipairs(params) do
+        for f, field in ipairs(fields) do
+            if field == pkey then
+                ids[r] = row[f]
+            end
+        end
+        if ids[r] == nil then
+            generated = generated + 1
+        elseif redis.call('EXISTS', prefix .. tname .. ':' .. ids[r]) == 1 then
+            return {1, 0, 0, {}}
+        end
+    end
+    if generated > 0 then
+        local counter = redis.call('INCRBY', prefix .. tname .. ':next_id',
+                                   generated) - generated
+        for r = 1, #params do
+            if ids[r] == nil then
+                counter = counter + 1
+                ids[r] = string.format('%d', (counter - 1) * step + offset)
+            end
+        end
+    end
+    for r, row in ipairs(params) do
+        local values = {}
+        for c, column in ipairs(columns) do
+            values[column] = '0'
+        end
+        for f, field in ipairs(fields) do
+            values[field] = row[f]
+        end
+        values[pkey] = ids[r]
+        local hash = {}
+        for c, column in ipairs(columns) do
+            table.insert(hash, column)
+            table.insert(hash, values[column])
+        end
+        redis.call('HMSET', prefix .. tname .. ':' .. ids[r], unpack(hash))
+        for i, field in ipairs(indexed) do
+            redis.call('SADD', prefix .. tname .. ':' .. field .. ':' ..
+                       values[field], ids[r])
+        end
+    end
+    return {0, #params, ids[1] and tonumber(ids[1]) or 0, {}}
+end
+
+local function select_rows(tname, key, columns, pkey, params)
+    local ids = {}
+    local seen = {}
+    for v, value in ipairs(params[1]) do
+        local matches = {value}
+        if key ~= pkey then
+            matches = redis.call('SMEMBERS',
+                                 prefix .. tname .. ':' .. key .. ':' .. value)
+        end
+        for m, id in ipairs(matches) do
+            if not seen[id] then
+                seen[id] = true
+                table.insert(ids, id)
+            end
+        end
+    end
+    table.sort(ids, ids_by_number)
+    local rows = {}
+    local rowcount = 0
+    for i, id in ipairs(ids) do
+        local row = redis.call('HMGET', prefix .. tname .. ':' .. id,
+                               unpack(columns))
+        if row[1] then
+            rowcount = rowcount + 1
+            for c = 1, #columns do
+                table.insert(rows, row[c])
+            end
+        end
+    end
+    return {0, rowcount, 0, rows}
+end
+
+local function update(tname, fields, indexed, params)
+    local is_indexed = {}
+    for i, field in ipairs(indexed) do
+        is_indexed[field] = true
+    end
+    local rowcount = 0
+    for r, row in ipairs(params) do
+        for k = #fields + 1, #row do
+            local hash = prefix .. tname .. ':' .. row[k]
+            local old = redis.call('HMGET', hash, unpack(fields))
+            if redis.call('EXISTS', hash) == 1 then
+                local changed = false
+                for f, field in ipairs(fields) do
+                    if old[f] ~= row[f] then
+                        changed = true
+                        redis.call('HSET', hash, field, row[f])
+                        if is_indexed[field] then
+                            local set = prefix .. tname .. ':' .. field .. ':'
+                            redis.call('SREM', set .. old[f], row[k])
+                            redis.call('SADD', set .. row[f], row[k])
+                        end
+                    end
+                end
+                if changed then
+                    rowcount = rowcount + 1
+                end
+            end
+        end
+    end
+    return {0, rowcount, 0, {}}
+end
+
+local results = {}
+local arg = 5
+for s = 1, tonumber(ARGV[4]) do
+    local operation, tname, key, pkey = ARGV[arg], ARGV[arg + 1],
+        ARGV[arg + 2], ARGV[arg + 3]
+    local fields, indexed, columns = split(ARGV[arg + 4]),
+        split(ARGV[arg + 5]), split(ARGV[arg + 6])
+    local count, width = tonumber(ARGV[arg + 7]), tonumber(ARGV[arg + 8])
+    arg = arg + 9
+    local params = {}
+    for r = 1, count do
+        local row = {}
+        for p = 1, width do
+            row[p] = ARGV[arg]
+            arg = arg + 1
+        end
+        params[r] = row
+    end
+    if operation == 'insert' then
+        results[s] = insert(tname, fields, indexed, columns, pkey, params)
+    elseif operation == 'select' then
+        results[s] = select_rows(tname, key, columns, pkey, params)
+    else
+        results[s] = update(tname, fields, indexed, params)
+    end
+end
+return results
+"""
+
+_tables = {}  # table name -> table_schema
+
+
+def _template(label):
+    """Return (table, operation, fields, key) for a statement template id.
+
+    Raises:
+        ValueError: The label isn't a template this backend can run.
+    """
+    try:
+        tname, operation, fields, key, count = label.split(':')
+        count = int(count)
+        if tname not in _tables:
+            _tables[tname] = import_module('db_api.objects.%s' % tname).table_schema
+        table = _tables[tname]
+    except (ValueError, ImportError, AttributeError):
+        raise ValueError("The Redis store only runs statement templates, not '%s'" % label)
+    if operation not in ('insert', 'select', 'update'):
+        raise ValueError("Invalid statement template '%s'" % label)
+    if operation == 'select' and (
+            not count or
+            key not in [table['primary_key']] + table['indexed_fields']):
+        raise ValueError("The Redis store can only select rows by their id or an indexed field, not '%s'" % label)
+    if operation == 'update' and key != table['primary_key']:
+        raise ValueError("The Redis store can only update rows by their id, not '%s'" % label)
+    fields = fields.split(',') if fields else []
+    return table, operation, fields, key
+
+
+class Connection(object):
+    """A connection to the Redis store, with the MySQLdb connection API the
+    db workers use.
+
+    Attributes:
+        id_step, id_offset: The AUTO_INCREMENT ids the connection hands out
+            start at id_offset and go up by id_step (see interleave_ids).
+    """
+
+    def __init__(self, client, prefix):
+        self._redis = client
+        self._prefix = prefix
+        self._script = client.register_script(TRANSACTION_SCRIPT)
+        self.id_step = 1
+        self.id_offset = 1
+
+    def autocommit(self, on):
+        """Nothing to do: every transaction commits when its script runs."""
+
+    def cursor(self):
+        """Return a new cursor."""
+        return Cursor(self)
+
+    def run(self, statements):
+        """Run a transaction's statements in one script.
+
+        Args:
+            statements: List of (template id, params, many) tuples.
+
+        Returns:
+            List of [status, rowcount, lastrowid, values] results, one per
+            statement (see TRANSACTION_SCRIPT).
+        """
+        args = [self._prefix, self.id_step, self.id_offset, len(statements)]
+        for label, params, many in statements:
+            table, operation, fields, key = _template(label)
+            param_lists = params if many else [params]
+            args.extend([operation, table['name'], key, table['primary_key'],
+                         ','.join(fields), ','.join(table['indexed_fields']),
+                         ','.join(table['schema']), len(param_lists),
+                         len(param_lists[0])])
+            for param_list in param_lists:
+                args.extend(param_list)
+        return self._script(args=args)
+
+    def commit(self):
+        """Nothing to do: the transaction committed when its script ran."""
+
+    def rollback(self):
+        """Nothing to do: a transaction that ran can't be rolled back."""
+
+    def ping(self):
+        """Raise an Error if the connection is lost."""
+        self._redis.ping()
+
+    def close(self):
+        """Close the connection."""
+        self._redis.connection_pool.disconnect()
+
+
+class Cursor(object):
+    """A cursor of the Redis store, with the MySQLdb cursor API the db
+    workers use.  Statements only return the results of the transaction
+    last run with execute_transaction.
+
+    Attributes:
+        connection: The Connection the cursor belongs to.
+    """
+
+    def __init__(self, con):
+        self.connection = con
+        self._pending = deque()  # (SQL, params, columns, result) of each statement
+        self._rows = []
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute_transaction(self, statements):
+        """Run all of a transaction's statements at once.
+
+        Args:
+            statements: The transaction's [label, SQL, params, many,
+                return_type] statements (see db_worker.group_statements).
+
+        Raises:
+            ValueError: A statement isn't a template the Redis store can run.
+                None of them have run.
+        """
+        results = self.connection.run([(label, params, many)
+                                       for label, query, params, many, return_type in statements])  # pylint: disable=unused-variable
+        self._pending = deque()
+        for (label, query, params, many, return_type), result in zip(statements, results):  # pylint: disable=unused-variable
+            table, operation = _template(label)[:2]
+            columns = list(table['schema']) if operation == 'select' else None
+            self._pending.append((query, params, columns, result))
+
+    def execute(self, sql, params=None):
+        """Return the results of a statement of the transaction that ran.
+
+        Statements the transaction skipped (e.g. reads the worker served
+        from its player cache) are passed over.
+
+        Raises:
+            IntegrityError: The statement was an INSERT of a duplicate id.
+            ValueError: The statement isn't one of the transaction's.
+        """
+        while self._pending:
+            query, query_params, columns, result = self._pending.popleft()
+            if query == sql and query_params == params:
+                break
+        else:
+            raise ValueError("The Redis store only runs statements through execute_transaction, not '%s'" % sql)
+        status, rowcount, lastrowid, values = result
+        if status:
+            raise IntegrityError("Duplicate entry for '%s' %s" % (sql, params))
+        self.rowcount = rowcount
+        self.lastrowid = lastrowid
+        if columns is not None:
+            self.description = [(column, None, None, None, None, None, None)
+                                for column in columns]
+            values = [int(value) for value in values]
+            self._rows = [tuple(values[i:i + len(columns)])
+                          for i in range(0, len(values), len(columns))]
+        else:
+            self.description = None
+            self._rows = []
+
+    def executemany(self, sql, param_lists):
+        """Return the results of an executemany of the transaction that
+        ran."""
+        self.execute(sql, param_lists)
+
+    def fetchall(self):
+        """Return the rows the last statement returned, as tuples."""
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        """Nothing to do."""
+
+
+def connect(params):
+    """Open a connection to a Redis store.
+
+    Args:
+        params: Connection parameters (see db_config.py): 'host', 'port',
+            'db', 'password', and the database 'name' its keys are prefixed
+            with.
+    """
+    client = redis.StrictRedis(host=params['host'], port=params['port'],
+                               db=params['db'], password=params['password'])
+    client.ping()
+    return Connection(client, params['name'] + ':')
+
+
+def create_database(cursor, name):  # pylint: disable=unused-argument
+    """Nothing to do: keys are created as rows are inserted."""
+
+
+def create_tables(cursor, tnames, c):  # pylint: disable=unused-argument
+    """Nothing to do: rows are kept in hashes, which need no tables."""
+
+
+def setup_connection(con, name):  # pylint: disable=unused-argument
+    """Prepare a newly opened connection for running transactions."""
+    con.autocommit(False)
+
+
+def interleave_ids(cursor, step, offset):
+    """Make the connection's AUTO_INCREMENT ids start at offset and go up by
+    step."""
+    cursor.connection.id_step = step
+    cursor.connection.id_offset = offset
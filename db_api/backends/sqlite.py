@@ -0,0 +1,208 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SQLite storage backend, for load testing the whole client -> server ->
+# worker pipeline on a single machine, and for comparing the cost of the SQL
+# layer between engines.  See db_api/backends/__init__.py for the interface.
+#
+# The database is a file (db_config.py, DB_SQLITE_PATH), opened in WAL mode so
+# readers don't block the writer.  SQLite allows a single writer at a time:
+# transactions that start with a write take the write lock up front
+# (BEGIN IMMEDIATE), and wait up to the busy timeout for it.  Transactions
+# that start with a SELECT take it when they first write, and fail with
+# "database is locked" (an OperationalError, so the worker retries them) if
+# another writer got there first.
+#
+# Each connection keeps up to CACHED_STATEMENTS prepared statements, keyed by
+# their SQL.  Statement templates compile to the same SQL every time (see
+# db_api/statement_generator.py), so each is only prepared once per
+# connection.  MySQL-style '%s' placeholders are rewritten to '?', and an
+# executemany INSERT runs as one multi-row INSERT, as MySQLdb does, so the id
+# of its first row is known.
+#
+# pylint: disable=invalid-name
+"""SQLite storage backend."""
+import re
+import sqlite3
+
+# Custom modules
+from db_api.statement_generator import create_table
+
+dialect = 'sqlite'
+interleaves_ids = False
+savepoints = True
+
+Error = sqlite3.Error
+OperationalError = sqlite3.OperationalError
+IntegrityError = sqlite3.IntegrityError
+
+# Prepared statements kept per connection.
+CACHED_STATEMENTS = 256
+# Most parameters a statement can have in older SQLite versions.
+MAX_VARIABLES = 999
+
+_INSERT_VALUES = re.compile(r'\s*INSERT\s.*\sVALUES\s*(\(.*\))\s*$',
+                            re.IGNORECASE | re.DOTALL)
+
+
+def _qmark(sql):
+    """Rewrite MySQLdb '%s' placeholders to SQLite's '?'."""
+    return sql.replace('%s', '?')
+
+
+class Connection(object):
+    """A SQLite connection, with the MySQLdb connection API the db workers
+    use.  Unless autocommit is on, a transaction is begun by the first
+    statement after a commit or rollback, as in MySQL."""
+
+    def __init__(self, db):
+        self._db = db
+        self._autocommit = False
+        self._in_transaction = False
+
+    def autocommit(self, on):
+        """Turn autocommit on or off."""
+        self._autocommit = on
+
+    def _begin(self, sql):
+        """Begin a transaction for a statement, if one isn't open."""
+        if self._in_transaction or self._autocommit:
+            return
+        verb = sql.lstrip()[:6].upper()
+        if verb == 'PRAGMA':
+            return
+        self._db.execute('BEGIN' if verb == 'SELECT' else 'BEGIN IMMEDIATE')
+        self._in_transaction = True
+
+    def cursor(self):
+        """Return a new cursor."""
+        return Cursor(self)
+
+    def commit(self):
+        """Commit the open transaction, if any."""
+        if self._in_transaction:
+            self._in_transaction = False
+            self._db.execute('COMMIT')
+
+    def rollback(self):
+        """Roll back the open transaction, if any."""
+        if self._in_transaction:
+            self._in_transaction = False
+            self._db.execute('ROLLBACK')
+
+    def ping(self):
+        """Raise an Error if the connection is closed."""
+        self._db.execute('SELECT 1')
+
+    def close(self):
+        """Close the connection."""
+        self._db.close()
+
+
+class Cursor(object):
+    """A SQLite cursor, with the MySQLdb cursor API the db workers use.  Rows
+    are fetched as soon as a statement runs (like MySQLdb's default cursor),
+    so rowcount is the number of rows a SELECT returned."""
+
+    def __init__(self, con):
+        self._con = con
+        self._cursor = con._db.cursor()  # pylint: disable=protected-access
+        self._rows = []
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _done(self):
+        """Record the results of the statement just run."""
+        self.description = self._cursor.description
+        self.lastrowid = self._cursor.lastrowid
+        if self.description is not None:
+            self._rows = self._cursor.fetchall()
+            self.rowcount = len(self._rows)
+        else:
+            self._rows = []
+            self.rowcount = self._cursor.rowcount
+
+    def execute(self, sql, params=None):
+        """Run a statement with '%s' placeholders."""
+        self._con._begin(sql)  # pylint: disable=protected-access
+        self._cursor.execute(_qmark(sql), params or ())
+        self._done()
+
+    def executemany(self, sql, param_lists):
+        """Run a statement with each parameter list.  An INSERT runs as
+        multi-row INSERTs, and lastrowid is then the id of its first row."""
+        param_lists = [list(params) for params in param_lists]
+        match = _INSERT_VALUES.match(sql)
+        if not match or not param_lists:
+            self._con._begin(sql)  # pylint: disable=protected-access
+            self._cursor.executemany(_qmark(sql), param_lists)
+            self._done()
+            return
+        per_row = len(param_lists[0])
+        chunk = max(1, MAX_VARIABLES // max(1, per_row))
+        head, row = _qmark(sql[:match.start(1)]), _qmark(match.group(1))
+        first_id = None
+        rowcount = 0
+        for start in range(0, len(param_lists), chunk):
+            rows = param_lists[start:start + chunk]
+            self.execute(head + ','.join([row] * len(rows)),
+                         [param for params in rows for param in params])
+            if first_id is None:
+                first_id = self.lastrowid - len(rows) + 1
+            rowcount += self.rowcount
+        self.lastrowid = first_id
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        """Return the rows the last statement returned, as tuples."""
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        """Close the cursor."""
+        self._cursor.close()
+
+
+def connect(params):
+    """Open a connection to a SQLite database file, in WAL mode.
+
+    Args:
+        params: Connection parameters (see db_config.py): the database file
+            ('path'), the seconds to wait for the write lock
+            ('busy_timeout'), and the PRAGMA synchronous level
+            ('synchronous').
+    """
+    db = sqlite3.connect(params['path'], timeout=params['busy_timeout'],
+                         isolation_level=None, check_same_thread=False,
+                         cached_statements=CACHED_STATEMENTS)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=%s' % params['synchronous'])
+    return Connection(db)
+
+
+def create_database(cursor, name):  # pylint: disable=unused-argument
+    """Nothing to do: the database file is created when it's first opened."""
+
+
+def create_tables(cursor, tnames, c):
+    """Create the tables, and their indexes, if they don't exist."""
+    for tname in tnames:
+        for SQL in create_table(tname, c, dialect):
+            cursor.execute(SQL)
+
+
+def setup_connection(con, name):  # pylint: disable=unused-argument
+    """Prepare a newly opened connection for running transactions."""
+    con.autocommit(False)
@@ -0,0 +1,225 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Coalesces the same kind of read (a player row, or a player's cardlist) from
+# many server sessions in this process into one DB API transaction:
+#  - The first session to ask for a kind of read becomes the batch leader.  It
+#    waits cfg['db_api']['read_coalesce_window'] seconds for other sessions to
+#    add their player ids to the batch (or less, if the batch fills up to
+#    cfg['db_api']['read_coalesce_max'] ids).
+#  - The leader runs a single 'WHERE ... IN (<all the ids>)' transaction.
+#  - Each session gets back only its own rows, demultiplexed by the player id
+#    column ('id' for player rows, 'ownerid' for cards), in the columnar
+#    results format of db_api.enqueue.execute_batch (read them with
+#    enqueue.result_rows).
+# With routing on (see db_api/routing.py), there is a batch per kind of read
+# and partition, so each batch's players are all served by the same worker.
+# Likewise with sharding (see db_api/sharding.py), a batch only holds players
+# of one shard, as a transaction can't span shards.
+#
+# pylint: disable=invalid-name,global-statement
+"""Cross-session read coalescing for the DB API."""
+from __future__ import with_statement
+from collections import defaultdict
+import logging
+import threading
+import uuid
+
+# Custom modules
+import db_api.connections as connections
+import db_api.enqueue as enqueue
+import db_api.routing as routing
+import db_api.sharding as sharding
+import db_api.objects.card as card
+import db_api.objects.player as player
+
+coalescelogger = logging.getLogger('mimus.coalesce')
+
+# Kinds of reads that can be coalesced:
+#   kind -> (function returning the queries for a list of player ids,
+#            column holding the player id in the result rows)
+READS = {
+    'player': (player.get_many, 'id'),
+    'cardlist': (card.get_all_many, 'ownerid'),
+}
+
+_lock = threading.Lock()
+_coalescer = None
+
+
+class _Batch(object):
+    """Player ids waiting for the same kind of read."""
+
+    def __init__(self):
+        self.player_ids = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.columns = []  # column names of the result rows
+        self.rows = {}  # player id -> result rows, as tuples
+
+
+class ReadCoalescer(object):
+    """Batches concurrent reads of the same kind into one transaction.
+
+    Attributes:
+        window: Seconds a batch leader waits for more reads.
+        max_ids: Maximum number of player ids in one batch.
+        stats: Dictionary of counters: 'reads' requested, 'transactions' run.
+    """
+
+    def __init__(self, execute, window, max_ids, partition=None):
+        """Create a coalescer.
+
+        Args:
+            execute: Function taking (trans_id, queries, route), running the
+                queries as a DB API transaction routed by the player id route
+                and returning the results dictionary, or False on failure.
+            window: Seconds a batch leader waits for more reads.
+            max_ids: Maximum number of player ids in one batch.
+            partition: (optional) Function returning the partition of a
+                player id.  Only players of the same partition are batched
+                together.
+        """
+        self._execute = execute
+        self.window = window
+        self.max_ids = max_ids
+        self._partition = partition
+        self._lock = threading.Lock()
+        self._pending = {}  # (kind, partition) -> _Batch still accepting player ids
+        self.stats = {'reads': 0, 'transactions': 0}
+
+    def read(self, kind, player_id):
+        """Read rows of one kind for a player, together with other sessions'
+        concurrent reads.
+
+        Args:
+            kind: One of the keys of READS.
+            player_id: Hashed player name.
+
+        Returns:
+            Results dictionary holding only this player's rows under 'kind'
+            (as if the read had been run alone), or False if the
+            transaction failed.
+        """
+        pending = (kind, self._partition(player_id) if self._partition else None)
+        with self._lock:
+            self.stats['reads'] += 1
+            batch = self._pending.get(pending)
+            leader = batch is None
+            if leader:
+                batch = self._pending[pending] = _Batch()
+            batch.player_ids.append(player_id)
+            if len(batch.player_ids) >= self.max_ids:
+                # Full, close it now.
+                del self._pending[pending]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending.get(pending) is batch:
+                    del self._pending[pending]
+            self._run(kind, batch)
+        else:
+            batch.done.wait()
+        return self._demultiplex(kind, batch, player_id)
+
+    def _run(self, kind, batch):
+        """Run the batch's transaction, and wake up the sessions waiting on
+        it."""
+        try:
+            queries, key = READS[kind]
+            ids = sorted(set(batch.player_ids))
+            coalescelogger.debug("Reading %s for %d players", kind, len(ids))
+            batch.results = self._execute(str(uuid.uuid4()), queries(ids),
+                                          ids[0])
+            if batch.results:
+                batch.columns, rows = enqueue.result_columns(batch.results,
+                                                             kind)
+                if rows:
+                    batch.rows = _rows_by_player(rows,
+                                                 batch.columns.index(key))
+            with self._lock:
+                self.stats['transactions'] += 1
+        finally:
+            batch.done.set()
+
+    @staticmethod
+    def _demultiplex(kind, batch, player_id):
+        """Return the batch results for one player."""
+        if not batch.results:
+            return False
+        rows = batch.rows.get(player_id, [])
+        return {kind: {'columns': batch.columns, 'rows': rows},
+                'affected': len(rows),
+                'timers': batch.results.get('timers', {})}
+
+
+def _rows_by_player(rows, column):
+    """Group result rows by player id, in the given column."""
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row[column]].append(row)
+    return grouped
+
+
+def stats():
+    """Return the process-wide coalescer's counters ('reads' requested and
+    'transactions' run), or None if it hasn't been used."""
+    with _lock:
+        if _coalescer is None:
+            return None
+        return dict(_coalescer.stats)
+
+
+def get(cfg):
+    """Return the process-wide read coalescer, or None if coalescing is
+    turned off (cfg['db_api']['read_coalesce_window'] is 0).
+
+    Args:
+        cfg: Configuration dictionary (typically read from mimus_cfg.py)
+    """
+    global _coalescer
+    if not cfg['db_api']['read_coalesce_window']:
+        return None
+    with _lock:
+        if _coalescer is None:
+            workq = connections.get_workq(cfg)
+            redis = connections.get_redis(cfg)
+            log = connections.get_log(cfg)
+
+            def _execute(trans_id, queries, route):
+                """Run a coalesced read as a DB API transaction."""
+                return enqueue.execute_batch(
+                    trans_id=trans_id, queries=queries, worker_q=workq,
+                    ack_redis=redis, srv_id='coalesced', log=log,
+                    ack_mode=cfg['db_api']['ack_mode'],
+                    timeout=cfg['db_con']['timeout'],
+                    wire_format=cfg['db_api']['wire_format'],
+                    columnar=True, route=route)
+            partition = None
+            if cfg['db_api']['route_partitions']:
+                partition = routing.HashRing(
+                    cfg['db_api']['route_partitions']).partition
+            if cfg['db_shards']['count'] > 1:
+                shard = sharding.ShardMap.from_cfg(cfg).shard
+                ring = partition
+                partition = lambda player_id: (
+                    ring(player_id) if ring else None, shard(player_id))
+            _coalescer = ReadCoalescer(_execute,
+                                       cfg['db_api']['read_coalesce_window'],
+                                       cfg['db_api']['read_coalesce_max'],
+                                       partition)
+        return _coalescer
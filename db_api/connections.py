@@ -0,0 +1,190 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# When many server sessions run in one process (see the --players option of
+# mimus_client.py), giving each of them its own Pub/Sub client, Redis
+# connection and log file handle multiplies sockets, TLS handshakes and file
+# descriptors.  Instead, every session borrows from the single set of
+# connections kept here:
+#  - A bounded, blocking Redis connection pool.  Sessions block for a free
+#    connection instead of opening a new one when the pool is exhausted.
+#    (Transports with their own result store, see db_api/transports, share
+#    that instead.)
+#  - One work queue publisher.  The gcloud HTTP transport isn't thread-safe,
+#    so publishes are serialized through a lock.  With routing on, it
+#    publishes to the topic of each batch's partition (see db_api/routing.py).
+#  - One slow query log writer, also serialized through a lock.
+#
+# pylint: disable=line-too-long,invalid-name,global-statement
+"""Process-wide DB API connections shared by all server sessions."""
+import logging
+import threading
+from redis import StrictRedis, BlockingConnectionPool
+
+# Custom modules
+import db_api.routing as routing
+import db_api.transports as transports
+
+conlogger = logging.getLogger('mimus.connections')
+
+_lock = threading.Lock()
+_redis = None
+_workq = None
+_log = None
+
+# Number of times each kind of connection was opened, and the number of times
+# an already open connection was handed out again.
+_counts = {
+    'redis': {'created': 0, 'checkouts': 0},
+    'workq': {'created': 0, 'checkouts': 0},
+    'log': {'created': 0, 'checkouts': 0},
+}
+
+
+def _count(kind, counter):
+    """Thread-safe increment of one of the connection counters."""
+    with _lock:
+        _counts[kind][counter] += 1
+
+
+class _CountingConnectionPool(BlockingConnectionPool):
+    """Redis connection pool that keeps track of connection reuse."""
+
+    def make_connection(self):
+        _count('redis', 'created')
+        return super(_CountingConnectionPool, self).make_connection()
+
+    def get_connection(self, command_name, *keys, **options):
+        _count('redis', 'checkouts')
+        return super(_CountingConnectionPool, self).get_connection(
+            command_name, *keys, **options)
+
+
+class _SharedTopic(object):
+    """Work queue topic wrapper that serializes publishes from many threads."""
+
+    def __init__(self, topic):
+        self._topic = topic
+        self._lock = threading.Lock()
+        self.name = topic.name
+
+    def publish(self, message, **attrs):
+        """Publish a message to the wrapped topic."""
+        with self._lock:
+            return self._topic.publish(message, **attrs)
+
+
+class _SharedLog(object):
+    """Append-only log file shared by many threads."""
+
+    def __init__(self, filename):
+        self._file = open(filename, 'a+')
+        self._lock = threading.Lock()
+
+    def write(self, msg):
+        """Write msg to the log file."""
+        with self._lock:
+            self._file.write(msg)
+
+
+def get_redis(cfg):
+    """Return the shared Redis connection to read results from.
+
+    Args:
+        cfg: Configuration dictionary (typically read from mimus_cfg.py)
+
+    Returns:
+        StrictRedis instance backed by the process-wide connection pool, or
+        the result store of the configured transport if it has its own.
+    """
+    global _redis
+    with _lock:
+        if _redis is None:
+            transport = transports.load(cfg['db_api']['transport'])
+            if hasattr(transport, 'results'):
+                conlogger.info("Connecting: DB API %s result store",
+                               cfg['db_api']['transport'])
+                _redis = transport.results(cfg)
+            else:
+                conlogger.info("Connecting: DB API Redis instance at '%s:%s' (max %d connections)",
+                               cfg['redis_con']['hostname'], cfg['redis_con']['port'],
+                               cfg['redis_con']['max_connections'])
+                pool = _CountingConnectionPool(
+                    host=cfg['redis_con']['hostname'],
+                    port=cfg['redis_con']['port'],
+                    db=cfg['redis_con']['db'],
+                    password=cfg['redis_con']['password'],
+                    max_connections=cfg['redis_con']['max_connections'],
+                    timeout=cfg['redis_con']['pool_timeout'])
+                _redis = StrictRedis(connection_pool=pool)
+    return _redis
+
+
+def get_workq(cfg):
+    """Return the shared DB API work queue publisher.
+
+    Args:
+        cfg: Configuration dictionary (typically read from mimus_cfg.py)
+
+    Returns:
+        Topic wrapper to publish batches to, for the transport configured in
+        cfg['db_api']['transport'].
+    """
+    global _workq
+    with _lock:
+        if _workq is None:
+            conlogger.info("Connecting: DB API %s topic '%s'",
+                           cfg['db_api']['transport'], cfg['pubsub']['topic'])
+            transport = transports.load(cfg['db_api']['transport'])
+            if cfg['db_api']['route_partitions']:
+                conlogger.info("Routing to %d partitions",
+                               cfg['db_api']['route_partitions'])
+                _workq = _SharedTopic(routing.RoutedTopic(transport, cfg))
+            else:
+                _workq = _SharedTopic(transport.topic(cfg))
+            _counts['workq']['created'] += 1
+        _counts['workq']['checkouts'] += 1
+    return _workq
+
+
+def get_log(cfg):  # pylint: disable=unused-argument
+    """Return the shared slow query log writer.
+
+    Args:
+        cfg: Configuration dictionary (typically read from mimus_cfg.py)
+
+    Returns:
+        Object with a file-like write() method.
+    """
+    global _log
+    with _lock:
+        if _log is None:
+            _log = _SharedLog('backend_issues.log')
+            _counts['log']['created'] += 1
+        _counts['log']['checkouts'] += 1
+    return _log
+
+
+def stats():
+    """Return connection creation/reuse counters.
+
+    Returns:
+        Dictionary keyed by connection kind ('redis', 'workq', 'log'), each
+        holding the number of connections 'created' and the number of times
+        an existing connection was 'reused'.
+    """
+    with _lock:
+        return {kind: {'created': c['created'],
+                       'reused': c['checkouts'] - c['created']}
+                for kind, c in _counts.iteritems()}
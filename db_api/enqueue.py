@@ -15,12 +15,15 @@
 # pylint: disable=line-too-long,invalid-name
 """Module for enqueuing a database transaction and waiting for it to complete."""
 from __future__ import with_statement
+from collections import deque
 from retrying import retry
 import logging
+import threading
 import time
 
 # Custom modules
 from db_api.timer import Timer
+import db_api.wire as wire
 
 # DEBUGGING
 nh = logging.NullHandler()
@@ -40,6 +43,50 @@ except ImportError:
 #dblogger.setLevel(logging.WARN)
 
 
+# Recent ack latencies (seconds from publish to results in hand), per ack mode.
+_ack_latencies = {'push': deque(maxlen=10000), 'poll': deque(maxlen=10000)}
+# All transactions acked, per ack mode.
+_acked = {'push': 0, 'poll': 0}
+_ack_latency_lock = threading.Lock()
+
+
+def _load_results(results_data):
+    """Parse the results the db worker put in redis, and finish its timers.
+
+    Args:
+        results_data: Encoded results stored by the worker, binary or JSON.
+
+    Returns:
+        results: Dictionary of the results and result metadata.
+    """
+    results = wire.load_results(results_data)
+    # Explanation of the timers can be found in the ../db_worker.py file.
+    results['timers']['802 redis ack'] = time.time() - results[
+        'timers']['802 redis ack']
+    results['timers']['900 ===TOTAL==='] = time.time() - results[
+        'timers']['900 ===TOTAL===']
+    return results
+
+
+def _consume(ack_redis, ack_id):
+    """Get and delete the results stored under ack_id, atomically.
+
+    GET and DEL run in one MULTI/EXEC, so the results are freed as soon as
+    they are read instead of when they expire (GETDEL needs Redis 6.2).
+
+    Args:
+        ack_redis: Redis connection to query for results.
+        ack_id: Redis key under which the results are stored.
+
+    Returns:
+        The stored results, or None if they aren't there yet.
+    """
+    pipe = ack_redis.pipeline(transaction=True)
+    pipe.get(ack_id)
+    pipe.delete(ack_id)
+    return pipe.execute()[0]
+
+
 @retry(stop_max_delay=30000,
        wait_exponential_multiplier=100,
        wait_exponential_max=2500)
@@ -61,12 +108,7 @@ def _check_for_ack(ack_redis, ack_id):
         while not acked:
             try:
                 with Timer() as in_t:
-                    results = json.loads(ack_redis.get(ack_id))
-                # Explanation of the timers can be found in the ../db_worker.py file.
-                results['timers']['802 redis ack'] = time.time() - results[
-                    'timers']['802 redis ack']
-                results['timers']['900 ===TOTAL==='] = time.time() - results[
-                    'timers']['900 ===TOTAL===']
+                    results = _load_results(_consume(ack_redis, ack_id))
                 acked = True
             except TypeError, e:
                 # Json module can't load the string if the redis query returned nothing.
@@ -84,18 +126,128 @@ def _check_for_ack(ack_redis, ack_id):
     return acked, results
 
 
+def _wait_for_push(ack_redis, ack_id, timeout):
+    """Block until the db worker pushes the batch results onto the ack_id list.
+
+    Unlike _check_for_ack, this doesn't poll: the BLPOP returns as soon as the
+    worker pushes the results, or after the timeout.
+
+    Args:
+        ack_redis: Redis connection to wait on for results.
+        ack_id: Redis list key onto which the results will be pushed.
+        timeout: Maximum number of seconds to wait.
+
+    Returns:
+       acked: boolean value true if the results were found before the timeout.
+       results: Dictionary of the results and result metadata.
+
+    Raises:
+        KeyError: The results didn't show up before the timeout.
+    """
+    dblogger.debug("Waiting on redis list %s", ack_id)
+    popped = ack_redis.blpop(ack_id, timeout=timeout)
+    if not popped:
+        raise KeyError("Unable to find %s key in redis after %d seconds" %
+                       (ack_id, timeout))
+    return True, _load_results(popped[1])
+
+
+def result_columns(results, return_type):
+    """Return the rows a transaction returned under return_type as columns
+    and row tuples, whichever way the worker sent them.
+
+    Args:
+        results: The transaction results.
+        return_type: Results key of the rows.
+
+    Returns:
+        (column names, list of rows, each a sequence of values in column
+        order).
+    """
+    rows = results.get(return_type)
+    if not rows:
+        return [], []
+    if isinstance(rows, dict):
+        return rows['columns'], rows['rows']
+    columns = list(rows[0])
+    return columns, [[row[column] for column in columns] for row in rows]
+
+
+def result_rows(results, return_type):
+    """Return the rows a transaction returned under return_type as
+    dictionaries, whichever way the worker sent them.
+
+    Args:
+        results: The transaction results.
+        return_type: Results key of the rows.
+
+    Returns:
+        List of row dictionaries.
+    """
+    rows = results.get(return_type)
+    if not rows:
+        return []
+    if isinstance(rows, dict):
+        columns = rows['columns']
+        return [dict(zip(columns, row)) for row in rows['rows']]
+    return rows
+
+
+def _percentile(sorted_values, pct):
+    """Return the pct percentile of an already sorted list."""
+    index = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def ack_latency_report():
+    """Summarize recent ack latencies.
+
+    Returns:
+        Dictionary keyed by ack mode ('push', 'poll'), each holding the number
+        of transactions measured and their p50/p99 ack latency in seconds,
+        and the number of transactions acked in all ('total').  Modes with no
+        measurements are omitted.
+    """
+    report = {}
+    with _ack_latency_lock:
+        for mode, latencies in _ack_latencies.iteritems():
+            if latencies:
+                ordered = sorted(latencies)
+                report[mode] = {'count': len(ordered),
+                                'total': _acked[mode],
+                                'p50': _percentile(ordered, 50),
+                                'p99': _percentile(ordered, 99)}
+    return report
+
+
 # pylint: disable=too-many-arguments,too-many-locals
-def execute_batch(trans_id, queries, worker_q, ack_redis, srv_id, log):
+def execute_batch(trans_id, queries, worker_q, ack_redis, srv_id, log,
+                  ack_mode='poll', timeout=30, wire_format='json',
+                  columnar=False, route=None):
     """Enqueue batch of db queries to be processed by the db worker processes.
     Wait for it to complete and return the results.
 
     Args:
         trans_id: Transaction ID for this batch.
-        queries: List of queries that make up the batch.
+        queries: List of queries that make up the batch, or an intent
+            dictionary for the worker to expand into them (see
+            db_api/intents.py).
         worker_q: Google Cloud Pub/Sub topic to publish batches to.
         ack_redis: Redis instance to query for batch results.
         srv_id: Unique ID for the originating server instance.
         log: slow query log file handle.
+        ack_mode: How to wait for the results. 'push' asks the worker to push
+            them onto a list that we block on; 'poll' (the default) asks the
+            worker to set a key that we poll for with exponential backoff.
+        timeout: Seconds to wait for results in 'push' mode.
+        wire_format: How to encode the batch and results. 'binary' uses the
+            compact format in db_api/wire.py; 'json' (the default) JSON.
+            Intents are always sent as JSON.
+        columnar: Ask the worker for rows as column names and row tuples
+            instead of row dictionaries (read them with result_columns or
+            result_rows).
+        route: (optional) Player id to route the batch by, if it isn't
+            srv_id (see db_api/routing.py).
 
     Returns:
         results: Dictionary of database query results and metadata.
@@ -107,14 +259,29 @@ def execute_batch(trans_id, queries, worker_q, ack_redis, srv_id, log):
     with Timer() as t:
 
         # Prepare queries
-        queries_json = json.dumps({'queries': queries})
+        attributes = {}
+        if columnar:
+            attributes['rows'] = 'columns'
+        if route is not None:
+            attributes['route'] = str(route)
+        if wire_format == 'binary':
+            attributes['wire'] = str(wire.VERSION)
+        if isinstance(queries, dict):
+            queries_data = json.dumps(queries)
+            attributes['intent'] = queries['op']
+        elif wire_format == 'binary':
+            queries_data = wire.encode_queries(queries)
+        else:
+            queries_data = json.dumps({'queries': queries})
 
         # Publish queries to the db worker queue
         with Timer() as in_t:
-            worker_q.publish(message=queries_json,
+            worker_q.publish(message=queries_data,
                              srv_id=str(srv_id),
                              trans_id=str(trans_id),
-                             insertion_time=str(time.time()))
+                             insertion_time=str(time.time()),
+                             ack_mode=ack_mode,
+                             **attributes)
 
         q_msg = "%.03f - Pubsub Publish" % in_t.elapsed
         if in_t.elapsed > warning_thresh:
@@ -129,12 +296,19 @@ def execute_batch(trans_id, queries, worker_q, ack_redis, srv_id, log):
         while not acked:
             try:
                 # Look for this transaction result in the redis instance
-                acked, results = _check_for_ack(ack_redis, redis_key)
+                if ack_mode == 'push':
+                    acked, results = _wait_for_push(ack_redis, redis_key,
+                                                    timeout)
+                else:
+                    acked, results = _check_for_ack(ack_redis, redis_key)
             except KeyError, e:
                 dblogger.warning(repr(e))
                 log.write(repr(e))
                 return False
         results['timers']['803 ack check'] = time.time() - ack_timer
+        with _ack_latency_lock:
+            _ack_latencies[ack_mode].append(results['timers']['803 ack check'])
+            _acked[ack_mode] += 1
 
     # Print timer elapsed
     sql_msg = "%.03f - SQL roundtrip " % t.elapsed
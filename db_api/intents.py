@@ -0,0 +1,187 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Game action intents.  Instead of the list of statement templates that make
+# up a transaction, the server can send the db worker the action itself, e.g.
+#   {'op': 'play_stage', 'player': 2788244105, 'drops': [17, 230],
+#    'points': 1010, 'cardlist': False}
+# and the worker expands it into the statements with the handler registered
+# for its 'op' (see HANDLERS).  Handlers only use the card and player object
+# modules, so an intent runs exactly the statements the equivalent query list
+# would: compiled templates, with a stage's drops inserted by one multi-row
+# INSERT and consumed cards updated by one 'WHERE id IN (...)' UPDATE.
+#
+# Intents are always JSON encoded (they are a few dozen bytes), and marked by
+# the message's 'intent' attribute, which holds the op.  The results are
+# returned the same way as for a query list, under the same return types.
+#
+# pylint: disable=line-too-long
+"""Game action intents for the db worker."""
+from __future__ import with_statement
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+# Custom modules
+import db_api.objects.card as card
+import db_api.objects.player as player
+import db_api.wire as wire
+
+
+def play_stage(player_id, drops, points, cardlist=False):
+    """Return the intent for a stage the player cleared.
+
+    Args:
+        player_id: Hashed player name.
+        drops: List of the types of the cards dropped, in drop order.
+        points: The player's friend points after the stage.
+        cardlist: Whether to read back the player's full cardlist.  If not,
+            only the ids of the dropped cards are returned.
+
+    Returns:
+        Intent dictionary.
+    """
+    return {'op': 'play_stage', 'player': player_id, 'drops': drops,
+            'points': points, 'cardlist': cardlist}
+
+
+def level_card(player_id, dest, card_ids, cardlist=False):
+    """Return the intent to level a card by consuming others.
+
+    Args:
+        player_id: Hashed player name.
+        dest: Dictionary of destination card key/value pairs.
+        card_ids: List of ids of the cards to consume.
+        cardlist: Whether to read back the player's full cardlist.  If not,
+            only the destination card is read back.
+
+    Returns:
+        Intent dictionary.
+    """
+    return {'op': 'level_card', 'player': player_id, 'card': dest['id'],
+            'xp01': dest['xp01'], 'consumed': list(card_ids),
+            'cardlist': cardlist}
+
+
+def evolve_card(player_id, dest, card_ids, cardlist=False):
+    """Return the intent to evolve a card by consuming others.
+
+    Args:
+        player_id: Hashed player name.
+        dest: Dictionary of destination card key/value pairs.
+        card_ids: List of ids of the cards to consume.
+        cardlist: Whether to read back the player's full cardlist.  If not,
+            only the destination card is read back.
+
+    Returns:
+        Intent dictionary.
+    """
+    return {'op': 'evolve_card', 'player': player_id, 'card': dest['id'],
+            'type': dest['type'], 'consumed': list(card_ids),
+            'cardlist': cardlist}
+
+
+def add_slots(player_id, slots):
+    """Return the intent to set the player's number of card slots.
+
+    Args:
+        player_id: Hashed player name.
+        slots: The player's card slots after adding more.
+
+    Returns:
+        Intent dictionary.
+    """
+    return {'op': 'add_slots', 'player': player_id, 'slots': slots}
+
+
+def _card_reads(intent):
+    """Return the queries reading back the cards an intent changed."""
+    if intent['cardlist']:
+        return card.get_all(intent['player'])
+    return card.get([intent['card']])
+
+
+def _play_stage(intent):
+    """Expand a play_stage intent."""
+    queries = card.create_many(intent['player'], intent['drops'])
+    queries.extend(player.update({'id': intent['player'],
+                                  'points': intent['points']}))
+    queries.extend(player.get(intent['player']))
+    if intent['cardlist']:
+        queries.extend(card.get_all(intent['player']))
+    return queries
+
+
+def _level_card(intent):
+    """Expand a level_card intent."""
+    dest = {'id': intent['card'], 'xp01': intent['xp01']}
+    return card.combine(dest, intent['consumed']) + _card_reads(intent)
+
+
+def _evolve_card(intent):
+    """Expand an evolve_card intent."""
+    dest = {'id': intent['card'], 'type': intent['type']}
+    return card.evolve(dest, intent['consumed']) + _card_reads(intent)
+
+
+def _add_slots(intent):
+    """Expand an add_slots intent."""
+    return (player.update({'id': intent['player'], 'slots': intent['slots']}) +
+            player.get(intent['player']))
+
+
+# op -> handler returning the intent's list of (query, return_type) pairs.
+HANDLERS = {
+    'play_stage': _play_stage,
+    'level_card': _level_card,
+    'evolve_card': _evolve_card,
+    'add_slots': _add_slots,
+}
+
+
+def expand(intent):
+    """Return the queries that carry out an intent.
+
+    Args:
+        intent: Intent dictionary.
+
+    Returns:
+        List of (query, return_type) pairs.
+
+    Raises:
+        ValueError: The intent's op has no handler.
+    """
+    try:
+        handler = HANDLERS[intent['op']]
+    except KeyError:
+        raise ValueError("Unknown intent op %r" % intent.get('op'))
+    return handler(intent)
+
+
+def load_queries(msg):
+    """Return the queries in a work queue message, expanding its intent if
+    it carries one.
+
+    Args:
+        msg: The message.  msg.data holds the encoded intent or queries, and
+            msg.attributes the transaction metadata.
+
+    Returns:
+        List of (query, return_type) pairs.
+    """
+    if msg.attributes.get('intent'):
+        return expand(json.loads(msg.data))
+    return wire.load_queries(msg)
@@ -36,6 +36,9 @@ table_schema = {
          ('levels', 'INT'), ('xp01', 'MEDIUMINT'), ('xp02', 'MEDIUMINT')])
 }
 
+# Generate the validator for this table's data once, at import.
+db_api_query.compile_validator(table_schema)
+
 
 def get_all(player_id):
     """Return query to list all cards owned by a player
@@ -44,17 +47,69 @@ def get_all(player_id):
         player_id: Hashed player name.
 
     Returns:
-        queries_to_execute: List of (query_string, results_key) pairs.
-            query_string: Query to get cards from the database.
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to get cards from the database.
             results_key: Dictionary key under which to look for the results
                 of this query.
     """
-    get_cards_query = db_api_query.select(table_schema,
-                                          values=[player_id, ],
-                                          field='ownerid')
+    get_cards_query = db_api_query.select_template(table_schema,
+                                                   values=[player_id, ],
+                                                   field='ownerid')
+    return [(get_cards_query, 'cardlist'), ]
+
+
+def get_all_many(player_ids):
+    """Return query to list all cards owned by several players at once.
+
+    Args:
+        player_ids: List of hashed player names.
+
+    Returns:
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to get cards from the database.
+            results_key: Dictionary key under which to look for the results
+                of this query.  Cards of all the players are returned
+                together, their 'ownerid' tells them apart.
+    """
+    get_cards_query = db_api_query.select_template(table_schema,
+                                                   values=player_ids,
+                                                   field='ownerid')
     return [(get_cards_query, 'cardlist'), ]
 
 
+def get(card_ids):
+    """Return query to re-read specific cards after changing them.
+
+    Args:
+        card_ids: List of ids of the cards to read.
+
+    Returns:
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to get cards from the database.
+            results_key: Dictionary key under which to look for the results
+                of this query.
+    """
+    get_cards_query = db_api_query.select_template(table_schema, values=card_ids)
+    return [(get_cards_query, 'cardchanges'), ]
+
+
+def new_row(player_id, card_type, card_id):
+    """Return the row the database holds for a card created by create_many.
+
+    Args:
+        player_id: Hashed player name.
+        card_type: Integer for the type of the card.
+        card_id: The id the database assigned to the card.
+
+    Returns:
+        Dictionary of the card's key/value pairs, with every other field at
+        its column default.
+    """
+    row = dict.fromkeys(table_schema['schema'], 0)
+    row.update({'id': card_id, 'ownerid': player_id, 'type': card_type})
+    return row
+
+
 def combine(dest, card_ids):
     """Return query to combine cards.
 
@@ -63,8 +118,8 @@ def combine(dest, card_ids):
         card_ids: List of ids of the cards to combine.
 
     Returns:
-        queries_to_execute: List of (query_string, results_key) pairs.
-            query_string: Query to update/retrieve cards from the database.
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to update/retrieve cards from the database.
             results_key: Dictionary key under which to look for the results
                 of this query.
     """
@@ -72,22 +127,21 @@ def combine(dest, card_ids):
     # Var init
     queries_to_execute = []
     value = 100
-    xp = 0
 
-    # Loop through cards to consume, generate queries to remove their owners
+    # Generate a single query to remove the owners of all cards to consume
     cardlogger.debug("Consuming ids: " + str(card_ids))
-    for key in card_ids:
-        query = db_api_query.update(table_schema, key, {'ownerid': 0,
-                                                       'levels': dest['id']})
-        queries_to_execute.append((query, 'affected'))
-        # pylint: disable=fixme
-        # TODO: determine XP granted by level of consumed card instead of using a
-        # flat amount
-        xp += value
+    if card_ids:
+        query = db_api_query.update_template(table_schema, list(card_ids),
+                                             {'ownerid': 0, 'levels': dest['id']})
+        queries_to_execute.append((query, 'consumed'))
+    # pylint: disable=fixme
+    # TODO: determine XP granted by level of consumed card instead of using a
+    # flat amount
+    xp = value * len(card_ids)
 
     # add the XP into the destination card
-    query = db_api_query.update(table_schema, dest['id'],
-                                {'xp01': xp + dest['xp01']})
+    query = db_api_query.update_template(table_schema, dest['id'],
+                                         {'xp01': xp + dest['xp01']})
     queries_to_execute.append((query, 'affected'))
     return queries_to_execute
 
@@ -100,8 +154,8 @@ def evolve(dest, card_ids):
         card_ids: List of ids of the cards to combine.
 
     Returns:
-        queries_to_execute: List of (query_string, results_key) pairs.
-            query_string: Query to update/retrieve cards from the database.
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to update/retrieve cards from the database.
             results_key: Dictionary key under which to look for the results
                 of this query.
     """
@@ -109,17 +163,17 @@ def evolve(dest, card_ids):
     # Var init
     queries_to_execute = []
 
-    # Loop through cards to consume, generate queries to remove their owners
+    # Generate a single query to remove the owners of all cards to consume
     cardlogger.debug("Consuming ids: " + str(card_ids))
-    for key in card_ids:
-        query = db_api_query.update(table_schema, key, {'ownerid': 0,
-                                                       'evolves': dest['id']})
-        queries_to_execute.append((query, 'affected'))
+    if card_ids:
+        query = db_api_query.update_template(table_schema, list(card_ids),
+                                             {'ownerid': 0, 'evolves': dest['id']})
+        queries_to_execute.append((query, 'consumed'))
 
     # 'Evolve' the destination card by changing its card type to a rarer one.
-    query = db_api_query.update(table_schema, dest['id'],
-                                {'type': dest['type'] + 1,
-                                 'xp01': 0})
+    query = db_api_query.update_template(table_schema, dest['id'],
+                                         {'type': dest['type'] + 1,
+                                          'xp01': 0})
     queries_to_execute.append((query, 'affected'))
     return queries_to_execute
 
@@ -136,8 +190,8 @@ def create(player_id, card_type, cost_type=None, cost_amount=None):
             card.
 
     Returns:
-        queries_to_execute: List of (query_string, results_key) pairs.
-            query_string: Query to get cards from the database.
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to get cards from the database.
             results_key: Dictionary key under which to look for the results
                 of this query.
     """
@@ -153,5 +207,34 @@ def create(player_id, card_type, cost_type=None, cost_amount=None):
         card[cost_type] = cost_amount
 
     # Create the card
-    create_card = db_api_query.insert(table_schema, card)
+    create_card = db_api_query.insert_template(table_schema, card)
     return [(create_card, 'affected'), ]
+
+
+def create_many(player_id, card_types):
+    """Return queries to create several cards and give them to the player.
+    Cards created this way are always drops or gifts (no cost).
+
+    Args:
+        player_id: Hashed player name.
+        card_types: List of integers for the types of card to make.
+
+    Returns:
+        queries_to_execute: List of (query, results_key) pairs, one per
+            card.  Empty if there are no cards to create.
+            query: Statement template to create a card in the database.  All
+                of them share a template, so the worker inserts them with a
+                single multi-row INSERT.
+            results_key: Dictionary key under which to look for the results
+                of this query.  The results hold the id of the first card
+                created; the rest follow it consecutively, in the order of
+                card_types.
+    """
+    if not card_types:
+        return []
+
+    return [(db_api_query.insert_template(table_schema,
+                                          {'type': card_type,
+                                           'ownerid': player_id}),
+             'inserted')
+            for card_type in card_types]
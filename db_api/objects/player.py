@@ -36,6 +36,9 @@ table_schema = {
                            ('stamina', 'SMALLINT')])
 }
 
+# Generate the validator for this table's data once, at import.
+db_api_query.compile_validator(table_schema)
+
 
 def name_to_id(name):
     """convert player name to ID"""
@@ -52,16 +55,33 @@ def get(player_id):
         player_id: Hashed player name.
 
     Returns:
-        queries_to_execute: List of (query_string, results_key) pairs.
-            query_string: Query to get player from the database.
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to get player from the database.
             results_key: Dictionary key under which to look for the results
                 of this query.
     """
 
-    get_player = db_api_query.select(table_schema, values=[player_id, ])
+    get_player = db_api_query.select_template(table_schema, values=[player_id, ])
     return [(get_player, 'player')]
 
 
+def get_many(player_ids):
+    """Return query to get several players by ID at once.
+
+    Args:
+        player_ids: List of hashed player names.
+
+    Returns:
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to get the players from the database.
+            results_key: Dictionary key under which to look for the results
+                of this query.
+    """
+
+    get_players = db_api_query.select_template(table_schema, values=player_ids)
+    return [(get_players, 'player')]
+
+
 def update(player):
     """Return query to update player row.
 
@@ -69,13 +89,13 @@ def update(player):
         player: Dictionary of player stat key/value pairs.
 
     Returns:
-        queries_to_execute: List of (query_string, results_key) pairs.
-            query_string: Query to update player in the database.
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to update player in the database.
             results_key: Dictionary key under which to look for the results
                 of this query.
     """
 
-    update_player = db_api_query.update(table_schema, player['id'], player)
+    update_player = db_api_query.update_template(table_schema, player['id'], player)
     return [(update_player, 'affected'), ]
 
 
@@ -88,13 +108,13 @@ def create(player_id, c):
         c: Config dictionary, typically read from mimus_cfg.py.
 
     Returns:
-        queries_to_execute: List of (query_string, results_key) pairs.
-            query_string: Query to create player in the database.
+        queries_to_execute: List of (query, results_key) pairs.
+            query: Statement template to create player in the database.
             results_key: Dictionary key under which to look for the results
                 of this query.
     """
     loadout = {'id': player_id}
     loadout.update(c['player']['initial_loadout'])
-    create_player = db_api_query.insert(table_schema, loadout)
+    create_player = db_api_query.insert_template(table_schema, loadout)
 
     return [(create_player, 'affected')]
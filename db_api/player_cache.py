@@ -0,0 +1,316 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Db worker cache of player rows and cardlists.  Only correct when this worker
+# is the only one writing the players it caches, i.e. when transactions are
+# routed to workers by player (see db_api/routing.py), and when each player
+# has one transaction in flight at a time (sessions wait for each
+# transaction's results before sending the next).
+#
+# The cache understands the statement templates of the player and card tables
+# (see db_api/statement_generator.py):
+#  - Reads of player rows by id, and of cards by ownerid or id, are served
+#    from the cache when all the rows asked for are cached.  Otherwise they
+#    run on the database, and the rows read are cached.
+#  - Updates by primary key are applied to the cached rows, and inserted cards
+#    are added to their owner's cached cardlist (with every column not
+#    inserted at its default of 0), so the reads that follow them in the same
+#    or later transactions still hit.
+#  - Any other write (plain SQL, or a template the cache doesn't know) clears
+#    the whole cache, as does a rolled back transaction.
+# Players are evicted least recently used first when there are more than
+# 'size' of them.
+#
+# With 'verify' on, cache hits are also read from the database and compared;
+# a mismatch is logged, counted and fixed in the cache.
+#
+# pylint: disable=invalid-name
+"""Db worker cache of player rows and cardlists."""
+from __future__ import with_statement
+from collections import OrderedDict
+import logging
+import threading
+
+cachelogger = logging.getLogger('mimus.player_cache')
+
+
+class _Entry(object):
+    """The cached rows of one player."""
+
+    def __init__(self):
+        self.player = None  # player row tuple
+        self.cards = None  # card id -> row tuple, if the cardlist is cached
+
+
+class PlayerCache(object):
+    """Bounded LRU cache of player rows and cardlists.
+
+    Attributes:
+        size: Maximum number of players cached.
+        verify: Whether cache hits are checked against the database.
+        stats: Dictionary of counters: 'hits', 'misses', 'evictions',
+            'invalidations' (times the whole cache was cleared) and
+            'mismatches' (found by verify).
+    """
+
+    def __init__(self, size, verify=False):
+        """Create an empty cache.
+
+        Args:
+            size: Maximum number of players cached.
+            verify: (optional) Check cache hits against the database.
+        """
+        self.size = size
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # player id -> _Entry, LRU first
+        self._owners = {}  # card id -> player id, for cached cardlists
+        self._columns = {}  # table name -> column names
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                      'invalidations': 0, 'mismatches': 0}
+
+    def _entry(self, player_id, create=False):
+        """Return a player's entry, marking it most recently used."""
+        entry = self._entries.pop(player_id, None)
+        if entry is None:
+            if not create:
+                return None
+            entry = _Entry()
+            while len(self._entries) >= self.size:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                self._drop_cards(evicted_id, evicted)
+                self.stats['evictions'] += 1
+        self._entries[player_id] = entry
+        return entry
+
+    def _drop_cards(self, player_id, entry):
+        """Forget a player's cached cardlist."""
+        if entry.cards:
+            for card_id in entry.cards:
+                if self._owners.get(card_id) == player_id:
+                    del self._owners[card_id]
+        entry.cards = None
+
+    def _lookup(self, table, key, ids):
+        """Return the cached rows for a read, or None if any aren't cached."""
+        rows = []
+        if table == 'player' and key == 'id':
+            for player_id in ids:
+                entry = self._entry(player_id)
+                if entry is None or entry.player is None:
+                    return None
+                rows.append(entry.player)
+        elif table == 'card' and key == 'ownerid':
+            for player_id in ids:
+                entry = self._entry(player_id)
+                if entry is None or entry.cards is None:
+                    return None
+                rows.extend(entry.cards.itervalues())
+        elif table == 'card' and key == 'id':
+            for card_id in ids:
+                entry = self._entries.get(self._owners.get(card_id))
+                if entry is None:
+                    return None
+                rows.append(entry.cards[card_id])
+        else:
+            return None
+        return rows
+
+    def read(self, label, params):
+        """Return the cached result of a read, counting the hit or miss.
+
+        Args:
+            label: Statement label (see db_worker.group_statements).
+            params: The statement's parameters.
+
+        Returns:
+            (columns, rows) if the rows are all cached, otherwise None.
+        """
+        template = _parse(label)
+        if template is None or template[1] != 'select' or not params:
+            return None
+        table, operation, fields, key = template  # pylint: disable=unused-variable
+        with self._lock:
+            rows = self._lookup(table, key, params)
+            if rows is None or table not in self._columns:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return self._columns[table], rows
+
+    def fill(self, label, params, columns, rows):
+        """Cache the rows a read returned from the database.
+
+        Args:
+            label: Statement label (see db_worker.group_statements).
+            params: The statement's parameters.
+            columns: Column names of the rows.
+            rows: List of row tuples.
+        """
+        template = _parse(label)
+        if template is None or template[1] != 'select' or not params:
+            return
+        table, operation, fields, key = template  # pylint: disable=unused-variable
+        with self._lock:
+            self._columns[table] = list(columns)
+            if table == 'player' and key == 'id':
+                for row in rows:
+                    self._entry(row[columns.index('id')], create=True).player = row
+            elif table == 'card' and key == 'ownerid':
+                id_column = columns.index('id')
+                owner_column = columns.index('ownerid')
+                cardlists = dict((player_id, OrderedDict()) for player_id in params)
+                for row in rows:
+                    cardlists[row[owner_column]][row[id_column]] = row
+                for player_id, cards in cardlists.iteritems():
+                    entry = self._entry(player_id, create=True)
+                    self._drop_cards(player_id, entry)
+                    entry.cards = cards
+                    for card_id in cards:
+                        self._owners[card_id] = player_id
+            elif table == 'card' and key == 'id':
+                id_column = columns.index('id')
+                for row in rows:
+                    entry = self._entries.get(self._owners.get(row[id_column]))
+                    if entry is not None:
+                        entry.cards[row[id_column]] = row
+
+    def check(self, label, params, cached, columns, rows):
+        """Compare a cache hit with the rows read from the database, and fix
+        the cache if they differ (verify mode).
+
+        Args:
+            label: Statement label (see db_worker.group_statements).
+            params: The statement's parameters.
+            cached: (columns, rows) returned by read().
+            columns: Column names of the rows read from the database.
+            rows: List of row tuples read from the database.
+        """
+        if (cached[0] == list(columns) and
+                sorted(cached[1]) == sorted(tuple(row) for row in rows)):
+            return
+        cachelogger.error("Cached rows for %s %s don't match the database: %s != %s",
+                          label, params, cached[1], rows)
+        with self._lock:
+            self.stats['mismatches'] += 1
+        self.fill(label, params, columns, rows)
+
+    def write(self, label, params, many, first_id, id_step=1):
+        """Apply a statement that ran on the database to the cache.
+
+        Args:
+            label: Statement label (see db_worker.group_statements).
+            params: The statement's parameters, or list of parameter lists
+                if many is True.
+            many: Whether the statement ran with executemany.
+            first_id: LAST_INSERT_ID after the statement.
+            id_step: (optional) Step between the ids of the rows an INSERT
+                inserted.
+        """
+        template = _parse(label)
+        if template is not None and template[1] == 'select':
+            return
+        with self._lock:
+            if template is None or not self._apply(template, params if many else [params], first_id, id_step):
+                self._clear()
+
+    def _apply(self, template, param_lists, first_id, id_step):
+        """Apply a write to the cached rows; False if the cache can't."""
+        table, operation, fields, key = template
+        columns = self._columns.get(table)
+        if operation == 'update' and key == 'id' and table in ('player', 'card'):
+            if columns is None:
+                return True  # nothing of this table is cached
+            indexes = [columns.index(field) for field in fields]
+            for params in param_lists:
+                values = params[:len(fields)]
+                for row_id in params[len(fields):]:
+                    self._update(table, row_id, indexes, values)
+            return True
+        if operation == 'insert' and table == 'player':
+            for params in param_lists:
+                self._entries.pop(dict(zip(fields, params)).get('id'), None)
+            return True
+        if operation == 'insert' and table == 'card':
+            if not first_id:
+                return False
+            for offset, params in enumerate(param_lists):
+                new = dict(zip(fields, params))
+                entry = self._entries.get(new.get('ownerid'))
+                if entry is None or entry.cards is None:
+                    continue
+                new['id'] = first_id + offset * id_step
+                row = tuple(new.get(column, 0) for column in columns)
+                entry.cards[new['id']] = row
+                self._owners[new['id']] = new['ownerid']
+            return True
+        return False
+
+    def _update(self, table, row_id, indexes, values):
+        """Update the fields of a cached row."""
+        if table == 'player':
+            entry = self._entries.get(row_id)
+            if entry is not None and entry.player is not None:
+                entry.player = _replace(entry.player, indexes, values)
+            return
+        owner = self._owners.get(row_id)
+        if owner is None:
+            return
+        cards = self._entries[owner].cards
+        row = cards[row_id] = _replace(cards[row_id], indexes, values)
+        new_owner = row[self._columns['card'].index('ownerid')]
+        if new_owner != owner:
+            # Consumed cards change owner (to 0).
+            del cards[row_id]
+            del self._owners[row_id]
+            entry = self._entries.get(new_owner)
+            if entry is not None and entry.cards is not None:
+                entry.cards[row_id] = row
+                self._owners[row_id] = new_owner
+
+    def _clear(self):
+        """Forget everything cached."""
+        self._entries.clear()
+        self._owners.clear()
+        self.stats['invalidations'] += 1
+
+    def invalidate(self):
+        """Forget everything cached, e.g. after a rollback."""
+        with self._lock:
+            self._clear()
+
+    def report(self):
+        """Return the counters, with the number of players cached."""
+        with self._lock:
+            report = dict(self.stats)
+            report['players'] = len(self._entries)
+        return report
+
+
+def _replace(row, indexes, values):
+    """Return a row tuple with the values at indexes replaced."""
+    row = list(row)
+    for i, value in zip(indexes, values):
+        row[i] = value
+    return tuple(row)
+
+
+def _parse(label):
+    """Return (table, operation, fields, key) of a statement template label,
+    or None for plain SQL."""
+    parts = label.split(':')
+    if len(parts) != 5 or ' ' in label:
+        return None
+    table, operation, fields, key, count = parts  # pylint: disable=unused-variable
+    return table, operation, fields.split(',') if fields else [], key
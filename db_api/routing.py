@@ -0,0 +1,107 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Routes transactions to db workers by player.  With
+# cfg['db_api']['route_partitions'] = N, the work queue is split into N
+# partitions, each its own topic and subscription of the configured transport
+# ('<topic>-p<K>' and '<sub>-p<K>'), and each db worker serves one partition
+# (db_worker.py --partition K).  A transaction goes to the partition its
+# 'route' attribute (a player id), or else its srv_id, hashes to on a
+# consistent hash ring.  Sessions' srv_ids are their player ids, so all of a
+# player's transactions run on the same worker, which can then cache the
+# player's rows (see db_api/player_cache.py).
+#
+# The ring has ROUTE_REPLICAS points per partition, so adding a partition
+# only moves about 1/N of the players.  Workers must be restarted when the
+# number of partitions changes, as their caches don't know which players
+# moved.
+#
+# pylint: disable=invalid-name
+"""Consistent hash routing of transactions to work queue partitions."""
+from __future__ import with_statement
+from bisect import bisect
+import copy
+import hashlib
+
+# Points on the ring per partition.
+ROUTE_REPLICAS = 100
+
+
+def _hash(key):
+    """Return the ring position of a key."""
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+    """Consistent hash ring mapping keys to partition numbers."""
+
+    def __init__(self, partitions, replicas=ROUTE_REPLICAS):
+        """Build the ring.
+
+        Args:
+            partitions: Number of partitions.
+            replicas: Points on the ring per partition.
+        """
+        points = sorted((_hash('%d-%d' % (partition, replica)), partition)
+                        for partition in range(partitions)
+                        for replica in range(replicas))
+        self._positions = [position for position, partition in points]
+        self._partitions = [partition for position, partition in points]
+
+    def partition(self, key):
+        """Return the partition a key (a player id or srv_id) belongs to."""
+        i = bisect(self._positions, _hash(str(key)))
+        return self._partitions[i % len(self._partitions)]
+
+
+def partition_cfg(cfg, partition):
+    """Return a copy of cfg whose work queue topic and subscription are those
+    of one partition.
+
+    Args:
+        cfg: Configuration dictionary (typically read from mimus_cfg.py)
+        partition: Partition number.
+    """
+    part_cfg = copy.copy(cfg)
+    part_cfg['pubsub'] = dict(cfg['pubsub'])
+    part_cfg['pubsub']['topic'] = '%s-p%d' % (cfg['pubsub']['topic'], partition)
+    part_cfg['pubsub']['sub'] = '%s-p%d' % (cfg['pubsub']['sub'], partition)
+    return part_cfg
+
+
+class RoutedTopic(object):
+    """Publishes each batch to the topic of the partition it routes to.
+
+    Attributes:
+        name: Name of the unpartitioned topic.
+        ring: HashRing of the partitions.
+    """
+
+    def __init__(self, transport, cfg):
+        """Connect to all the partitions' topics.
+
+        Args:
+            transport: Transport module (see db_api/transports).
+            cfg: Configuration dictionary (typically read from mimus_cfg.py)
+        """
+        partitions = cfg['db_api']['route_partitions']
+        self.name = cfg['pubsub']['topic']
+        self.ring = HashRing(partitions)
+        self._topics = [transport.topic(partition_cfg(cfg, partition))
+                        for partition in range(partitions)]
+
+    def publish(self, message, **attrs):
+        """Publish a batch to the topic of its partition."""
+        key = attrs.get('route', attrs['srv_id'])
+        return self._topics[self.ring.partition(key)].publish(message, **attrs)
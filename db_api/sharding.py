@@ -0,0 +1,141 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Player-id sharding across several databases.  A player's rows (the player
+# row and the cards it owns) all live in one shard, picked from the player's
+# CRC32 id (see db_api.objects.player.name_to_id) by the shard map in
+# cfg['db_shards']:
+#  - 'hash':  shard = player_id % count
+#  - 'range': shard K holds the ids below bounds[K] (and at or above
+#             bounds[K-1]); the last shard holds the rest.  Ranges can be moved
+#             a little at a time with rebalance_shards.py.
+# The connection parameters of each shard are in db_config.py.
+#
+# Every transaction must stay within one shard.  The db worker runs each on
+# the shard of the player it is routed by (its 'route' attribute, or else its
+# srv_id), and rejects it if its statements name players of other shards.
+# Statements that name cards by id can't be checked, and are trusted to
+# belong to the routed player.
+#
+# pylint: disable=invalid-name
+"""Player-id shard map and transaction shard checks."""
+from bisect import bisect_right
+
+SHARD_METHODS = ('hash', 'range')
+
+
+class ShardMap(object):
+    """Maps player ids to shard numbers.
+
+    Attributes:
+        method: 'hash' or 'range'.
+        count: Number of shards.
+        bounds: For 'range', the exclusive upper bound of the ids of every
+            shard but the last, in increasing order.
+    """
+
+    def __init__(self, method='hash', count=1, bounds=()):
+        """Build a shard map.
+
+        Raises:
+            ValueError: The method is unknown, or the bounds don't fit the
+                number of shards.
+        """
+        if method not in SHARD_METHODS:
+            raise ValueError("Unknown shard method '%s'" % method)
+        bounds = list(bounds)
+        if method == 'range' and (len(bounds) != count - 1 or
+                                  bounds != sorted(bounds)):
+            raise ValueError("A range shard map of %d shards needs %d increasing bounds, got %s" %
+                             (count, count - 1, bounds))
+        self.method = method
+        self.count = count
+        self.bounds = bounds
+
+    @classmethod
+    def from_cfg(cls, cfg):
+        """Build the shard map in cfg['db_shards']."""
+        return cls(cfg['db_shards']['method'], cfg['db_shards']['count'],
+                   cfg['db_shards']['bounds'])
+
+    def shard(self, player_id):
+        """Return the shard number of a player id."""
+        if self.count == 1:
+            return 0
+        if self.method == 'hash':
+            return int(player_id) % self.count
+        return bisect_right(self.bounds, int(player_id))
+
+
+def _player_ids(label, params, many):
+    """Return the ids of the players a statement names, if it's a template
+    of the player or card table."""
+    if params is None:
+        return []
+    parts = label.split(':')
+    if len(parts) != 5:
+        return []
+    table, operation, fields, key, count = parts  # pylint: disable=unused-variable
+    fields = fields.split(',') if fields else []
+    param_lists = params if many else [params]
+    if (table, key) in (('player', 'id'), ('card', 'ownerid')):
+        return [player_id for params in param_lists
+                for player_id in params[len(fields):]]
+    column = {'player': 'id', 'card': 'ownerid'}.get(table)
+    if operation in ('insert', 'update') and column in fields:
+        # Consumed cards are given to owner 0, which isn't a player.
+        return [params[fields.index(column)] for params in param_lists
+                if params[fields.index(column)]]
+    return []
+
+
+def statement_players(statements):
+    """Return the set of ids of the players a transaction's statements name.
+
+    Args:
+        statements: The transaction's [label, SQL, params, many, return_type]
+            statements (see db_worker.group_statements).
+    """
+    return set(player_id
+               for label, query, params, many, return_type in statements  # pylint: disable=unused-variable
+               for player_id in _player_ids(label, params, many))
+
+
+def message_player(msg):
+    """Return the id of the player a work queue message is routed by, or
+    None if it isn't routed by a player."""
+    key = msg.attributes.get('route', msg.attributes.get('srv_id'))
+    try:
+        return int(key)
+    except (TypeError, ValueError):
+        return None
+
+
+def check_statements(shard_map, shard, statements):
+    """Check that a transaction's statements only name players of its shard.
+
+    Args:
+        shard_map: The ShardMap.
+        shard: The shard the transaction runs on.
+        statements: The transaction's [label, SQL, params, many, return_type]
+            statements (see db_worker.group_statements).
+
+    Raises:
+        ValueError: A statement names a player of another shard.
+    """
+    for label, query, params, many, return_type in statements:  # pylint: disable=unused-variable
+        for player_id in _player_ids(label, params, many):
+            if shard_map.shard(player_id) != shard:
+                raise ValueError("Transaction spans shards: %s names player %s of shard %d, not %d" %
+                                 (label, player_id, shard_map.shard(player_id), shard))
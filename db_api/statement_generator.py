@@ -22,7 +22,6 @@
 import os
 import logging
 from importlib import import_module
-from pprint import pformat
 from db_api.datatypes.SQL import types
 
 # Logging config
@@ -32,44 +31,62 @@ if os.getenv('SQL_STATEMENT_PRINT', None):
     sqllogger.setLevel(logging.DEBUG)
 
 
-def _validate_data(table, data):
-    '''Validate that data falls within the minimum and maximum allowed values
+_validators = {}  # table name -> validate function from compile_validator
+
+
+def compile_validator(table):
+    '''Generate the function that validates data for a table.
+
+    Only the fields present in the data are checked.  Values below 0 are
+    raised to 0, and values above the maximum for their column's type are
+    lowered to it.  The first overflow of each field is logged as an error,
+    later ones only at debug level.
 
     Args:
         table: The table definition dictionary.  For examples, look at the
             'table_schema' variable in one of the db_api/object files.
-        data: The data to insert into the table, in dictionary format.
 
     Returns:
-        data: The data to insert into the table, in dictionary format, updated
-            to fit within min/max values where necessary.
+        validate: Function taking the data to insert into the table, in
+            dictionary format, and returning it updated to fit within min/max
+            values where necessary.
     '''
-    #sqllogger.debug(pformat(table))
-    for field, data_type in table['schema'].iteritems():
-        if not field == table['primary_key'] and field in data:
-            if int(data[field]) < 0:
+    # field -> (maximum value, type name), for all fields but the primary key
+    bounds = dict((field, (types[data_type]['max_value'], data_type))
+                  for field, data_type in table['schema'].iteritems()
+                  if field != table['primary_key'])
+    overflowed = set()
+
+    def validate(data):
+        '''Clamp data to the valid range of each of its fields.'''
+        for field, value in data.iteritems():
+            bound = bounds.get(field)
+            if bound is None:
+                continue
+            value = int(value)
+            if value < 0:
                 # put the minimum possible value if it underflowed
                 data[field] = 0
-            elif int(data[field]) > types[data_type]['max_value']:
+            elif value > bound[0]:
                 error_msg = "Field:'%s', value: '%s' is of type '%s'" % (
-                    str(field), str(data[field]), data_type)
+                    str(field), str(data[field]), bound[1])
                 error_msg = error_msg + ' and is not in the valid range of [%d,%d]' % (
-                    0, types[data_type]['max_value'])
-                sqllogger.error(error_msg)
+                    0, bound[0])
+                if field in overflowed:
+                    sqllogger.debug(error_msg)
+                else:
+                    overflowed.add(field)
+                    sqllogger.error(error_msg)
                 # put the maximum possible value if it overflowed
-                data[field] = types[data_type]['max_value']
-                #raise ValueError(error_msg)
-                #return None
-    return data
+                data[field] = bound[0]
+        return data
 
+    _validators[table['name']] = validate
+    return validate
 
-def insert(table, data):
-    '''Generate a SQL statement to insert a row after validating that row's data.
 
-    NOTES:
-      - If any data provided doesn't match the schema, the row is discarded.
-      - Fields provided that don't exist in the table's schema are discarded, but
-        if all remaining data is valid, the row will be inserted.
+def _validate_data(table, data):
+    '''Validate that data falls within the minimum and maximum allowed values
 
     Args:
         table: The table definition dictionary.  For examples, look at the
@@ -77,31 +94,57 @@ def insert(table, data):
         data: The data to insert into the table, in dictionary format.
 
     Returns:
-        insert_SQL: a string containing the resulting SQL query.
+        data: The data to insert into the table, in dictionary format, updated
+            to fit within min/max values where necessary.
     '''
+    validate = _validators.get(table['name'])
+    if validate is None:
+        validate = compile_validator(table)
+    return validate(data)
+
+
+################################
+# STATEMENT TEMPLATES
+#
+# Instead of a SQL string, the DB API can send the worker a statement template
+# id and a list of parameters.  The id names the table, the operation, the
+# fields and the number of key values, e.g. 'card:update:ownerid,levels:id:3'
+# is 'UPDATE card SET ownerid=%s,levels=%s WHERE id IN (%s,%s,%s)'.  Fields
+# are always listed in schema order, so every statement with the same table,
+# operation and set of fields shares a template.  The worker compiles each
+# template id to SQL once (compile_template), and runs consecutive statements
+# that share a template with a single executemany.
 
-    sqllogger.debug('Preparing INSERT')
-    sqllogger.debug(pformat(data))
+_templates = {}  # template id -> parameterized SQL
+
+
+def _template_fields(table, data):
+    '''Return the schema fields present in data, in schema order.'''
+    return [field for field in table['schema'] if field in data]
+
+
+def insert_template(table, data):
+    '''Generate a statement template to insert a row after validating that
+    row's data.  Fields that don't exist in the table's schema are discarded.
+
+    Args:
+        table: The table definition dictionary.  For examples, look at the
+            'table_schema' variable in one of the db_api/object files.
+        data: The data to insert into the table, in dictionary format.
+
+    Returns:
+        [template_id, params]: The statement template id, and the list of
+            values to run it with.
+    '''
     data = _validate_data(table, data)
-    if data:
-        # make SQL statement
-        fields = data.keys()
-        SQL = []
-        SQL.append('INSERT INTO %s (%s) values ' % (table['name'], ','.join(fields)))
-        SQL.append('(')
-        for field in fields:
-            SQL.append("'%s'," % data[field])
-        SQL[-1] = SQL[-1][:-1]  # Remove final trailing comma
-        SQL.append(')')
-
-        insert_SQL = ''.join(SQL)
-        sqllogger.debug(insert_SQL)
-        return insert_SQL
-
-
-def select(table, values=None, field=None):
-    '''Generate a SQL statement to select all the rows where the value of 'field'
-        is in the list 'values'.
+    fields = _template_fields(table, data)
+    template_id = '%s:insert:%s::1' % (table['name'], ','.join(fields))
+    return [template_id, [data[field] for field in fields]]
+
+
+def select_template(table, values=None, field=None):
+    '''Generate a statement template to select all the rows where the value
+    of 'field' is in the list 'values'.
 
     Args:
         table: The table definition dictionary.  For examples, look at the
@@ -113,29 +156,20 @@ def select(table, values=None, field=None):
             being used as the field.
 
     Returns:
-        select_SQL: a string containing the resulting SQL query.
+        [template_id, params]: The statement template id, and the list of
+            values to run it with.
     '''
-    # If no field specified, use the primary key
     if not field:
         field = table['primary_key']
+    values = list(values or [])
+    template_id = '%s:select::%s:%d' % (table['name'], field, len(values))
+    return [template_id, values]
 
-    sqllogger.debug('Preparing SELECT')
-    SQL = []
-    SQL.append('SELECT * FROM %s ' % table['name'])
-    if values:
-        SQL.append('WHERE %s IN (' % field)
-        for value in values:
-            SQL.append(str(value) + ',')
-        SQL[-1] = SQL[-1][:-1]  # Remove final trailing comma
-        SQL.append(')')
 
-    select_SQL = ''.join(SQL)
-    sqllogger.debug(select_SQL)
-    return select_SQL
-
-
-def update(table, pkey, data):
-    '''Generate a SQL statement that updates a row.
+def update_template(table, pkey, data):
+    '''Generate a statement template that updates a row, or several rows with
+    the same data.  Fields that don't exist in the table's schema are
+    discarded.
 
     Args:
         table: The table definition dictionary.  For examples, look at the
@@ -144,42 +178,115 @@ def update(table, pkey, data):
         data: The data to insert into the table, in dictionary format.
 
     Returns:
-        update_SQL: a string containing the resulting SQL query.
+        [template_id, params]: The statement template id, and the list of
+            values to run it with.
     '''
-
-    sqllogger.debug('Preparing UPDATE')
-    SQL = []
-    SQL.append('UPDATE %s SET ' % table['name'])
     data = _validate_data(table, data)
-    if data:
-        for key, value in data.iteritems():
-            SQL.append('%s=%s,' % (key, value))
-        SQL[-1] = SQL[-1][:-1]  # Remove final trailing comma
-        SQL.append(' WHERE %s=%s' % (table['primary_key'], pkey))
+    fields = _template_fields(table, data)
+    if isinstance(pkey, (list, tuple, set, frozenset)):
+        keys = list(pkey)
+    else:
+        keys = [pkey]
+    template_id = '%s:update:%s:%s:%d' % (table['name'], ','.join(fields),
+                                          table['primary_key'], len(keys))
+    return [template_id, [data[field] for field in fields] + keys]
+
+
+def compile_template(template_id):
+    '''Return the parameterized SQL for a statement template id, compiling it
+    on first use.
+
+    Args:
+        template_id: Statement template id, as generated by insert_template,
+            select_template or update_template.
 
-    update_SQL = ''.join(SQL)
-    sqllogger.debug(update_SQL)
-    return update_SQL
+    Returns:
+        SQL: The statement, with a '%s' placeholder for each parameter.
+
+    Raises:
+        ValueError: The template id is malformed, or names a table or fields
+            that don't exist.
+    '''
+    SQL = _templates.get(template_id)
+    if SQL is not None:
+        return SQL
+
+    try:
+        tname, operation, fields, key, count = template_id.split(':')
+        count = int(count)
+        table = import_module('db_api.objects.%s' % tname).table_schema
+    except (ValueError, ImportError, AttributeError):
+        raise ValueError("Invalid statement template '%s'" % template_id)
+    fields = fields.split(',') if fields else []
+    for field in fields + ([key] if key else []):
+        if field not in table['schema']:
+            raise ValueError("Invalid statement template '%s'" % template_id)
+
+    placeholders = ','.join(['%s'] * count)
+    if operation == 'insert' and fields:
+        SQL = 'INSERT INTO %s (%s) values (%s)' % (
+            tname, ','.join(fields), ','.join(['%s'] * len(fields)))
+    elif operation == 'select' and key:
+        SQL = 'SELECT * FROM %s' % tname
+        if count:
+            SQL = SQL + ' WHERE %s IN (%s)' % (key, placeholders)
+    elif operation == 'update' and fields and key and count:
+        SQL = 'UPDATE %s SET %s WHERE %s IN (%s)' % (
+            tname, ','.join('%s=%%s' % field for field in fields), key,
+            placeholders)
+    else:
+        raise ValueError("Invalid statement template '%s'" % template_id)
+
+    sqllogger.debug("Compiled template '%s': %s", template_id, SQL)
+    _templates[template_id] = SQL
+    return SQL
+
+
+def statement(query):
+    '''Return the SQL and parameters to run a DB API query with.
+
+    Args:
+        query: Either a SQL string, or a [template_id, params] pair.
+
+    Returns:
+        (SQL, params): params is None for a SQL string.
+    '''
+    if isinstance(query, (list, tuple)):
+        return compile_template(query[0]), query[1]
+    return query, None
 
 
-def create_table(tname, c):
-    '''Generate a SQL statement to create a table, if it does not exist.
+def create_table(tname, c, dialect='mysql'):
+    '''Generate the SQL statements to create a table, and its indexes, if they
+    do not exist.
 
     Args:
         tname: Table name to create. Information about the table will be
             loaded from db_api/objects/<tname>.py.
         c: config, typically loaded from mimus_cfg.py
+        dialect: (optional) SQL dialect of the storage backend, 'mysql' or
+            'sqlite' (see db_api/backends).
 
     Returns:
-        create_SQL: a string containing the resulting SQL query.
+        create_SQL: a list of strings containing the resulting SQL queries.
     '''
 
     # import the module for this table
     table = import_module(os.path.join(c['db_api']['dir'], 'objects',
                                        tname).replace(r'/', r'.')).table_schema
 
-    # Generate create SQL statement based on the schema provided
     sqllogger.debug('Preparing CREATE TABLE')
+    if dialect == 'sqlite':
+        create_SQL = _create_table_sqlite(tname, table)
+    else:
+        create_SQL = [_create_table_mysql(tname, table)]
+    sqllogger.debug(create_SQL)
+    return create_SQL
+
+
+def _create_table_mysql(tname, table):
+    '''Generate the MySQL statement to create a table.'''
+    # Generate create SQL statement based on the schema provided
     SQL = []
     SQL.append('CREATE TABLE IF NOT EXISTS %s (' % tname)
     for field, data_type in table['schema'].iteritems():
@@ -202,6 +309,21 @@ def create_table(tname, c):
     # Turn on table compresssion
     SQL.append('ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8')
 
-    create_SQL = ''.join(SQL)
-    sqllogger.debug(create_SQL)
-    return create_SQL
+    return ''.join(SQL)
+
+
+def _create_table_sqlite(tname, table):
+    '''Generate the SQLite statements to create a table and its indexes.'''
+    columns = []
+    for field, data_type in table['schema'].iteritems():
+        if field == table['primary_key']:
+            # An INTEGER PRIMARY KEY is the rowid, and auto increments.
+            columns.append('%s INTEGER PRIMARY KEY NOT NULL' % field)
+        else:
+            # The other integer types all have INTEGER affinity.
+            columns.append('%s %s NOT NULL DEFAULT 0' % (field, data_type))
+    SQL = ['CREATE TABLE IF NOT EXISTS %s (%s)' % (tname, ', '.join(columns))]
+    for field in table['indexed_fields']:
+        SQL.append('CREATE INDEX IF NOT EXISTS %s_%s_idx ON %s (%s)' %
+                   (tname, field, tname, field))
+    return SQL
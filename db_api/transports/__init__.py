@@ -0,0 +1,60 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# A transport carries batches of queries from the server (db_api.enqueue) to
+# the db workers, and optionally carries the results back.  Each transport is a
+# module in this package providing:
+#
+#  topic(cfg)
+#    Returns the object the server publishes batches to.  It must have a
+#    'name' attribute and a publish(message, **attributes) method, where
+#    message is the encoded batch (a byte string: JSON, or binary, see
+#    db_api/wire.py) and attributes are string metadata (srv_id, trans_id,
+#    insertion_time, wire, ...).
+#
+#  subscription(cfg)
+#    Returns the object a db worker pulls batches from.  It must have a 'name'
+#    attribute, a pull(return_immediately, max_messages) method returning a
+#    list of (ack_id, message) pairs, where message has 'data' and
+#    'attributes' attributes, and an acknowledge(ack_ids) method.  Messages
+#    that aren't acknowledged are eventually redelivered.  Each call returns a
+#    new object, which is only used from one thread.
+#
+#  results(cfg)  (optional)
+#    Returns the store results are passed back through, implementing the
+#    subset of the StrictRedis API used by db_api.enqueue and db_worker.
+#    Transports that don't provide one use the Redis instance configured in
+#    cfg['redis_con'].
+#
+# pylint: disable=invalid-name
+"""Pluggable work queue transports for the DB API."""
+from importlib import import_module
+
+
+class Message(object):
+    """A batch received from a work queue."""
+
+    def __init__(self, data, attributes):
+        self.data = data
+        self.attributes = attributes
+
+
+def load(name):
+    """Return the transport module with the given name.
+
+    Args:
+        name: Name of a module in this package, typically
+            cfg['db_api']['transport'].
+    """
+    return import_module('db_api.transports.%s' % name)
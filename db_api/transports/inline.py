@@ -0,0 +1,65 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Synchronous variant of the in-memory transport, for the discrete-event
+# simulator (see mimus_sim.py).  Publishing a batch queues it exactly like the
+# local transport, then immediately calls the handler registered with
+# set_handler() in the publishing thread, which is expected to pull and run
+# it.  By the time publish() returns the results are in the result store, so
+# the server never waits and everything runs in a single thread.
+#
+# pylint: disable=invalid-name
+"""Synchronous in-process work queue transport."""
+
+# Custom modules
+import db_api.transports.local as local
+
+_handler = None
+
+
+def set_handler(handler):
+    """Register the function that runs published batches.
+
+    Args:
+        handler: Function called with no arguments after every publish.  It
+            should pull the batch from subscription(cfg) and process it.
+    """
+    global _handler  # pylint: disable=global-statement
+    _handler = handler
+
+
+class InlineTopic(local.LocalTopic):
+    """In-memory topic that processes each batch as it is published."""
+
+    def publish(self, message, **attrs):
+        """Publish a message, and run it."""
+        super(InlineTopic, self).publish(message, **attrs)
+        if _handler is None:
+            raise RuntimeError("No inline transport handler registered")
+        _handler()
+
+
+def topic(cfg):
+    """Return the in-memory topic to publish batches to."""
+    return InlineTopic(cfg['pubsub']['topic'])
+
+
+def subscription(cfg):
+    """Return a subscription to the in-memory topic."""
+    return local.subscription(cfg)
+
+
+def results(cfg):
+    """Return the process-wide in-memory result store."""
+    return local.results(cfg)
@@ -0,0 +1,252 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# In-memory transport, for running the server and db workers as threads of a
+# single process (see mimus_local.py).  Batches go through a queue per topic
+# and results through a dictionary, so neither Cloud Pub/Sub nor Redis is
+# needed and the framework's own overhead can be measured separately from
+# network and cloud service latency.
+#
+# pylint: disable=invalid-name
+"""In-process work queue and result store transport."""
+from __future__ import with_statement
+from itertools import count
+from time import time as _now
+import threading
+import Queue
+
+# Custom modules
+from db_api.transports import Message
+
+# Seconds a pulled message has to be acknowledged before it's redelivered,
+# same as the Cloud Pub/Sub default.
+ACK_DEADLINE = 10
+
+_lock = threading.Lock()
+_queues = {}
+_results = None
+
+
+class _Queue(object):
+    """Work queue shared by a topic and its subscriptions."""
+
+    def __init__(self):
+        self.pending = Queue.Queue()
+        self.outstanding = {}  # ack_id -> (deadline, message)
+        self.lock = threading.Lock()
+        self.ack_ids = count()
+
+    def redeliver_expired(self):
+        """Put messages that weren't acknowledged in time back on the queue."""
+        now = _now()
+        with self.lock:
+            expired = [ack_id for ack_id, (deadline, msg) in
+                       self.outstanding.iteritems() if deadline < now]
+            for ack_id in expired:
+                self.pending.put(self.outstanding.pop(ack_id)[1])
+
+
+def _queue(name):
+    """Return the work queue for a topic, creating it if necessary."""
+    with _lock:
+        if name not in _queues:
+            _queues[name] = _Queue()
+        return _queues[name]
+
+
+class LocalTopic(object):
+    """Publishes batches to an in-memory work queue."""
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = _queue(name)
+
+    def publish(self, message, **attrs):
+        """Publish a message."""
+        self._queue.pending.put(Message(message, attrs))
+
+
+class LocalSubscription(object):
+    """Pulls batches from an in-memory work queue."""
+
+    def __init__(self, topic_name, name):
+        self.name = name
+        self._queue = _queue(topic_name)
+
+    def pull(self, return_immediately=False, max_messages=1):
+        """Pull up to max_messages messages.
+
+        Waits up to a second for the first message unless return_immediately
+        is set.
+
+        Returns:
+            List of (ack_id, message) pairs.
+        """
+        self._queue.redeliver_expired()
+        received = []
+        try:
+            received.append(self._queue.pending.get(
+                block=not return_immediately, timeout=1))
+            while len(received) < max_messages:
+                received.append(self._queue.pending.get_nowait())
+        except Queue.Empty:
+            pass
+
+        pulled = []
+        deadline = _now() + ACK_DEADLINE
+        with self._queue.lock:
+            for msg in received:
+                ack_id = str(next(self._queue.ack_ids))
+                self._queue.outstanding[ack_id] = (deadline, msg)
+                pulled.append((ack_id, msg))
+        return pulled
+
+    def acknowledge(self, ack_ids):
+        """Acknowledge messages, so they aren't redelivered."""
+        with self._queue.lock:
+            for ack_id in ack_ids:
+                self._queue.outstanding.pop(ack_id, None)
+
+
+class LocalResults(object):
+    """Thread-safe in-memory implementation of the subset of the StrictRedis
+    API used to pass back results: string keys with an expiry, and lists that
+    can be blocked on."""
+
+    def __init__(self):
+        self._data = {}  # key -> [value, expires_at]
+        self._cond = threading.Condition()
+
+    def _live(self, name):
+        """Return the entry for a key, dropping it if it has expired."""
+        entry = self._data.get(name)
+        if entry and entry[1] is not None and entry[1] < _now():
+            del self._data[name]
+            entry = None
+        return entry
+
+    def get(self, name):
+        """Return the value of a string key, or None."""
+        with self._cond:
+            entry = self._live(name)
+            return entry[0] if entry else None
+
+    def set(self, name, value, ex=None):
+        """Set a string key, optionally expiring after ex seconds."""
+        with self._cond:
+            self._data[name] = [value, _now() + ex if ex else None]
+        return True
+
+    def setex(self, name, time, value):
+        """Set a string key that expires after 'time' seconds."""
+        return self.set(name, value, ex=time)
+
+    def delete(self, *names):
+        """Delete keys, returning the number deleted."""
+        deleted = 0
+        with self._cond:
+            for name in names:
+                if self._live(name):
+                    del self._data[name]
+                    deleted += 1
+        return deleted
+
+    def expire(self, name, time):
+        """Expire a key after 'time' seconds."""
+        with self._cond:
+            entry = self._live(name)
+            if entry:
+                entry[1] = _now() + time
+            return bool(entry)
+
+    def lpush(self, name, *values):
+        """Push values onto the head of a list, waking up blocked readers."""
+        with self._cond:
+            entry = self._live(name)
+            if not entry:
+                entry = self._data[name] = [[], None]
+            for value in values:
+                entry[0].insert(0, value)
+            self._cond.notify_all()
+            return len(entry[0])
+
+    def blpop(self, keys, timeout=0):
+        """Pop from the head of the first non-empty list, waiting up to
+        timeout seconds (forever if 0) for one.
+
+        Returns:
+            (key, value) pair, or None on timeout.
+        """
+        if isinstance(keys, basestring):
+            keys = [keys]
+        deadline = _now() + timeout if timeout else None
+        with self._cond:
+            while True:
+                for name in keys:
+                    entry = self._live(name)
+                    if entry and entry[0]:
+                        value = entry[0].pop(0)
+                        if not entry[0]:
+                            del self._data[name]
+                        return (name, value)
+                remaining = deadline - _now() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def pipeline(self, transaction=True):  # pylint: disable=unused-argument
+        """Return a pipeline that applies its commands together."""
+        return _LocalPipeline(self)
+
+
+class _LocalPipeline(object):
+    """Buffers LocalResults commands and applies them under a single lock."""
+
+    def __init__(self, results):
+        self._results = results
+        self._commands = []
+
+    def __getattr__(self, command):
+        def _buffer(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return _buffer
+
+    def execute(self):
+        """Run the buffered commands, returning their results in order."""
+        # Condition locks are reentrant, so the commands can take it again.
+        with self._results._cond:  # pylint: disable=protected-access
+            replies = [getattr(self._results, command)(*args, **kwargs)
+                       for command, args, kwargs in self._commands]
+        self._commands = []
+        return replies
+
+
+def topic(cfg):
+    """Return the in-memory topic to publish batches to."""
+    return LocalTopic(cfg['pubsub']['topic'])
+
+
+def subscription(cfg):
+    """Return a subscription to the in-memory topic."""
+    return LocalSubscription(cfg['pubsub']['topic'], cfg['pubsub']['sub'])
+
+
+def results(cfg):  # pylint: disable=unused-argument
+    """Return the process-wide in-memory result store."""
+    global _results  # pylint: disable=global-statement
+    with _lock:
+        if _results is None:
+            _results = LocalResults()
+        return _results
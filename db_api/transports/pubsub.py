@@ -0,0 +1,36 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint: disable=invalid-name
+"""Google Cloud Pub/Sub work queue transport.  Results are passed back
+through Redis."""
+from gcloud import pubsub
+
+
+def topic(cfg):
+    """Return the Cloud Pub/Sub topic to publish batches to."""
+    client = pubsub.Client(project=cfg['gcp']['project'])
+    return client.topic(cfg['pubsub']['topic'])
+
+
+def subscription(cfg):
+    """Return the Cloud Pub/Sub subscription to pull batches from, creating
+    the topic and subscription if they don't exist."""
+    worker_topic = topic(cfg)
+    sub = worker_topic.subscription(cfg['pubsub']['sub'])
+    if not worker_topic.exists():
+        worker_topic.create()
+    if not sub.exists():
+        sub.create()
+    return sub
@@ -0,0 +1,155 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Work queue on a Redis Stream, for load tests that can't use Cloud Pub/Sub.
+# The stream is the Redis instance already used for results (cfg['redis_con']),
+# the stream name is cfg['pubsub']['topic'] and the consumer group name is
+# cfg['pubsub']['sub'], so all db workers share the work.
+#  - publish: XADD of the batch and its attributes as stream entry fields.
+#  - pull: XREADGROUP for up to max_messages new entries.  Every
+#    claim_interval seconds, entries another consumer read but didn't XACK
+#    within claim_idle_ms (e.g. because its worker died) are first taken
+#    over with XAUTOCLAIM, the equivalent of a Pub/Sub ack deadline
+#    expiring.
+#  - acknowledge: XACK and XDEL, so the stream only holds pending work.
+#
+# Requires Redis 6.2 or later for XAUTOCLAIM.
+#
+# pylint: disable=invalid-name
+"""Redis Streams work queue transport.  Results are passed back through
+Redis."""
+from time import time
+from uuid import uuid4
+import socket
+from redis import StrictRedis
+from redis.exceptions import ResponseError
+
+# Custom modules
+from db_api.transports import Message
+
+
+def _connect(cfg):
+    """Return a connection to the Redis instance holding the stream."""
+    return StrictRedis(host=cfg['redis_con']['hostname'],
+                       port=cfg['redis_con']['port'],
+                       db=cfg['redis_con']['db'],
+                       password=cfg['redis_con']['password'])
+
+
+def _message(fields):
+    """Build a Message from the fields of a stream entry."""
+    attributes = dict(fields)
+    data = attributes.pop('data')
+    return Message(data, attributes)
+
+
+class StreamTopic(object):
+    """Publishes batches to a Redis Stream."""
+
+    def __init__(self, redis, stream):
+        self.name = stream
+        self._redis = redis
+
+    def publish(self, message, **attrs):
+        """Publish a message."""
+        fields = dict(attrs)
+        fields['data'] = message
+        return self._redis.xadd(self.name, fields)
+
+
+class StreamSubscription(object):
+    """Pulls batches from a Redis Stream as a member of a consumer group."""
+
+    def __init__(self, redis, stream, group, stream_cfg):
+        self.name = group
+        self._redis = redis
+        self._stream = stream
+        # Consumer names only need to be unique within the group.
+        self._consumer = '%s-%s' % (socket.gethostname(), uuid4().hex[:8])
+        self._block_ms = stream_cfg['block_ms']
+        self._claim_idle_ms = stream_cfg['claim_idle_ms']
+        self._claim_interval = stream_cfg['claim_interval']
+        self._next_claim = 0
+        try:
+            redis.xgroup_create(stream, group, id='0', mkstream=True)
+        except ResponseError, err:
+            # BUSYGROUP: another worker already created it.
+            if 'BUSYGROUP' not in str(err):
+                raise
+
+    def _claim_abandoned(self, max_messages):
+        """Take over entries other consumers haven't acked in time."""
+        reply = self._redis.execute_command(
+            'XAUTOCLAIM', self._stream, self.name, self._consumer,
+            self._claim_idle_ms, '0-0', 'COUNT', max_messages)
+        # reply is [next start id, [[id, [field, value, ...]], ...], ...]
+        claimed = []
+        deleted = []
+        for entry_id, fields in reply[1]:
+            if fields:
+                claimed.append((entry_id, _message(
+                    zip(fields[::2], fields[1::2]))))
+            else:
+                # Deleted from the stream.  Redis 6.2 leaves such entries
+                # pending, so ack them or they are claimed again forever.
+                deleted.append(entry_id)
+        if deleted:
+            self._redis.xack(self._stream, self.name, *deleted)
+        return claimed
+
+    def pull(self, return_immediately=False, max_messages=1):
+        """Pull up to max_messages messages.
+
+        Waits up to block_ms for new messages unless return_immediately is
+        set.
+
+        Returns:
+            List of (ack_id, message) pairs.
+        """
+        pulled = []
+        if time() > self._next_claim:
+            self._next_claim = time() + self._claim_interval
+            pulled = self._claim_abandoned(max_messages)
+            if pulled:
+                return pulled
+
+        block = None if return_immediately else self._block_ms
+        reply = self._redis.xreadgroup(self.name, self._consumer,
+                                       {self._stream: '>'},
+                                       count=max_messages, block=block)
+        for stream, entries in reply or []:  # pylint: disable=unused-variable
+            for entry_id, fields in entries:
+                pulled.append((entry_id, _message(fields.iteritems())))
+        return pulled
+
+    def acknowledge(self, ack_ids):
+        """Acknowledge messages, and remove them from the stream."""
+        if not ack_ids:
+            return
+        pipe = self._redis.pipeline()
+        pipe.xack(self._stream, self.name, *ack_ids)
+        pipe.xdel(self._stream, *ack_ids)
+        pipe.execute()
+
+
+def topic(cfg):
+    """Return the stream to publish batches to."""
+    return StreamTopic(_connect(cfg), cfg['pubsub']['topic'])
+
+
+def subscription(cfg):
+    """Return a new consumer of the stream, creating the stream and consumer
+    group if they don't exist."""
+    return StreamSubscription(_connect(cfg), cfg['pubsub']['topic'],
+                              cfg['pubsub']['sub'], cfg['redis_streams'])
@@ -0,0 +1,476 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Compact binary encoding of query batches and their results, used instead
+# of JSON when cfg['db_api']['wire_format'] is 'binary'.  The originator
+# publishes a batch with a 'wire' attribute holding the format version; the
+# worker decodes the batch and encodes the results with that version.
+# Messages without the attribute are JSON, as are results that don't start
+# with the binary magic, so either end can still talk to one that only
+# speaks JSON.
+#
+# Version 1 (all integers little-endian):
+#  - Every message starts with a 3-byte magic ('MWQ' for batches, 'MWR' for
+#    results), a version byte, and a string table: a 4-byte length and the
+#    message's strings joined by NUL bytes.  Names (return types, template
+#    ids, column names, timer names) are sent as a 2-byte index into
+#    STRINGS followed by the message's string table, so each is sent at
+#    most once, and the well-known ones in STRINGS never.
+#  - Batch: 2-byte query count, then for each query the index of its
+#    return type and either:
+#      's' SQL string, with a 4-byte length
+#      't' template id index, 2-byte parameter count, width code ('I' or
+#          'q'), packed parameters
+#      'j' template id index, JSON encoded parameters with a 4-byte length
+#          (parameters that aren't all integers)
+#  - Results: 2-byte entry count, then for each entry the index of its key
+#    and either:
+#      'i' 8-byte integer ('affected')
+#      'r' rows: 2-byte column count, column name indexes, one struct code
+#          per column, 4-byte row count, packed rows.  Columns of a known
+#          table (see db_api/objects) are packed at the width of their type
+#          in datatypes/SQL.types (MEDIUMINT, having no struct code, in 4
+#          bytes).  Other integer columns are packed in 8.
+#      'c' columnar rows ({'columns': [...], 'rows': [...]}): same as 'r',
+#          with the columns in the order given, decoded to row tuples
+#      'm' timers: 2-byte count, then packed (name index, 8-byte double)
+#          pairs
+#      'j' anything else, JSON encoded with a 4-byte length
+#
+# Version 2 is version 1 with one more well-known string, 'id_step'.  The
+# worker answers each batch in the batch's version, so servers of either
+# version can share workers.
+#
+# pylint: disable=invalid-name
+"""Compact binary wire format for DB API batches and results."""
+from itertools import chain, izip
+from operator import itemgetter
+import struct
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+# Custom modules
+from db_api.datatypes.SQL import types
+import db_api.objects.card as card
+import db_api.objects.player as player
+
+VERSION = 2
+VERSIONS = (1, 2)
+
+_QUERIES_MAGIC = 'MWQ'
+_RESULTS_MAGIC = 'MWR'
+
+_TABLES = (card.table_schema, player.table_schema)
+
+# Well-known strings, sent as their index in this list.  A message's own
+# strings are numbered after the well-known ones of its version, so any change
+# to this list renumbers them for peers on an older list: append to it only
+# with a new VERSION, and record how many strings that version knows in
+# _STRING_COUNTS.
+STRINGS = [
+    # Worker and DB API timers
+    '010 q wait', '020 (pull wait)', '050 json_load', '800 commit', '801 ack',
+    '802 redis ack', '803 ack check', '900 ===TOTAL===',
+    '910 (===WORKER PROCESSING===)', '999 SQL roundtrip',
+    # Results keys
+    'affected', 'timers', 'player', 'cardlist', 'cardchanges', 'consumed',
+    'inserted', 'first_id', 'rowcount',
+    # Card and player columns.  Listed rather than read from the table
+    # schemas, so a new column can't renumber the strings after it.
+    'id', 'ownerid', 'type', 'stones', 'points', 'evolves', 'levels', 'xp01',
+    'xp02', 'slots', 'stamina',
+    # Version 2
+    'id_step',
+]
+# Number of well-known strings (the first ones in STRINGS) of each version.
+_STRING_COUNTS = {1: 30, 2: 31}
+assert len(STRINGS) == _STRING_COUNTS[VERSION], \
+    'STRINGS changed without a new wire format VERSION'
+_STRING_CODES = dict((string, code) for code, string in enumerate(STRINGS))
+
+# struct code for each datatypes.SQL type, by size in bytes
+_TYPE_CODES = {1: 'B', 2: 'H', 3: 'I', 4: 'I', 8: 'Q'}
+
+# frozenset of a table's column names -> (column names, struct codes), for
+# the tables whose rows are returned
+_TABLE_COLUMNS = {}
+# frozenset of a table's column names -> {column name: struct code}
+_COLUMN_CODES = {}
+for _table in _TABLES:
+    _codes = [_TYPE_CODES[types[data_type]['bytes']]
+              for data_type in _table['schema'].itervalues()]
+    _TABLE_COLUMNS[frozenset(_table['schema'])] = (list(_table['schema']),
+                                                   ''.join(_codes))
+    _COLUMN_CODES[frozenset(_table['schema'])] = dict(zip(_table['schema'],
+                                                          _codes))
+
+_INT_TYPES = frozenset([int, long])
+
+_H = struct.Struct('<H')
+_I = struct.Struct('<I')
+_q = struct.Struct('<q')
+_Hc = struct.Struct('<Hc')
+_structs = {}  # struct format -> compiled Struct
+
+
+def _struct(fmt):
+    """Return the compiled Struct for a format, compiling it on first use."""
+    compiled = _structs.get(fmt)
+    if compiled is None:
+        compiled = _structs[fmt] = struct.Struct(fmt)
+    return compiled
+
+
+def _all_ints(values):
+    """Whether all the values can be packed as integers."""
+    return _INT_TYPES.issuperset(map(type, values))
+
+
+def _utf8(value):
+    """Return value as a byte string."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class _Writer(object):
+    """Builds an encoded message."""
+
+    def __init__(self, version=VERSION):
+        self.version = version
+        self.known = _STRING_COUNTS[version]
+        self.out = []
+        self.strings = []
+        self.codes = {}  # string -> index, for strings not well-known
+
+    def code(self, string):
+        """Return the index of a name, adding it to the message's string
+        table if it isn't a well-known one of the message's version."""
+        code = _STRING_CODES.get(string)
+        if code is None or code >= self.known:
+            code = self.codes.get(string)
+            if code is None:
+                code = self.codes[string] = self.known + len(self.strings)
+                self.strings.append(_utf8(string))
+        return code
+
+    def name(self, string):
+        """Append the index of a name."""
+        self.out.append(_H.pack(self.code(string)))
+
+    def blob(self, value):
+        """Append a string with a 4-byte length."""
+        value = _utf8(value)
+        self.out.append(_I.pack(len(value)))
+        self.out.append(value)
+
+    def message(self, magic):
+        """Return the message."""
+        table = '\0'.join(self.strings)
+        return ''.join([magic, chr(self.version), _I.pack(len(table)), table] +
+                       self.out)
+
+
+class _Reader(object):
+    """Reads the fields of an encoded message in order."""
+
+    def __init__(self, data, magic):
+        if not is_binary(data, magic):
+            raise ValueError("Not a binary %s message" % magic)
+        self.version = ord(data[3])
+        if self.version not in VERSIONS:
+            raise ValueError("Unsupported wire format version %d" %
+                             self.version)
+        self.data = data
+        self.pos = 8
+        table = self.read(_I.unpack_from(data, 4)[0])
+        self.strings = STRINGS[:_STRING_COUNTS[self.version]]
+        if table:
+            self.strings += table.decode('utf-8').split(u'\0')
+
+    def read(self, size):
+        """Return the next size bytes."""
+        start = self.pos
+        self.pos += size
+        return self.data[start:self.pos]
+
+    def unpack(self, compiled):
+        """Return the next value(s) packed with a Struct."""
+        start = self.pos
+        self.pos += compiled.size
+        return compiled.unpack_from(self.data, start)
+
+    def name(self):
+        """Return the next name."""
+        return self.strings[self.unpack(_H)[0]]
+
+    def blob(self):
+        """Return the next string with a 4-byte length."""
+        return self.read(self.unpack(_I)[0])
+
+
+def is_binary(data, magic=_RESULTS_MAGIC):
+    """Whether data is a binary encoded message (and not JSON)."""
+    return isinstance(data, str) and data[:3] == magic
+
+
+def encode_queries(queries):
+    """Encode a batch of queries.
+
+    Args:
+        queries: List of (query, return_type) pairs, as generated by the
+            db_api/objects modules.
+
+    Returns:
+        Encoded batch, a byte string.
+    """
+    writer = _Writer()
+    out = writer.out
+    out.append(_H.pack(len(queries)))
+    for query, return_type in queries:
+        writer.name(return_type)
+        if not isinstance(query, (list, tuple)):
+            out.append('s')
+            writer.blob(query)
+            continue
+        template_id, params = query
+        if _all_ints(params):
+            code = 'I' if (not params or (min(params) >= 0 and
+                                          max(params) <= 0xFFFFFFFF)) else 'q'
+            out.append('t')
+            writer.name(template_id)
+            out.append(_Hc.pack(len(params), code))
+            out.append(_struct('<%d%s' % (len(params), code)).pack(*params))
+        else:
+            out.append('j')
+            writer.name(template_id)
+            writer.blob(json.dumps(params))
+    return writer.message(_QUERIES_MAGIC)
+
+
+def decode_queries(data):
+    """Decode a batch encoded by encode_queries.
+
+    Returns:
+        List of (query, return_type) pairs, with [template_id, params]
+        lists for statement templates.
+
+    Raises:
+        ValueError: data isn't a binary batch of a supported version.
+    """
+    reader = _Reader(data, _QUERIES_MAGIC)
+    queries = []
+    for i in range(reader.unpack(_H)[0]):  # pylint: disable=unused-variable
+        return_type = reader.name()
+        tag = reader.read(1)
+        if tag == 's':
+            query = reader.blob()
+        elif tag == 't':
+            template_id = reader.name()
+            count, code = reader.unpack(_Hc)
+            query = [template_id,
+                     list(reader.unpack(_struct('<%d%s' % (count, code))))]
+        else:
+            template_id = reader.name()
+            query = [template_id, json.loads(reader.blob())]
+        queries.append((query, return_type))
+    return queries
+
+
+def _pack_rows(writer, rows):
+    """Append rows packed with a column header, or return False if they
+    can't be packed."""
+    out = writer.out
+    if not rows:
+        out.append(_H.pack(0))
+        out.append(_I.pack(0))
+        return True
+    columns = frozenset(rows[0])
+    names, codes = _TABLE_COLUMNS.get(columns) or (sorted(columns),
+                                                   'q' * len(columns))
+    # Every row must have exactly these columns, all integers.
+    if set(map(len, rows)) != set([len(names)]):
+        return False
+    try:
+        values = map(itemgetter(*names), rows)
+    except KeyError:
+        return False
+    if len(names) > 1:
+        values = list(chain.from_iterable(values))
+    if not _all_ints(values):
+        return False
+    try:
+        packed = _struct('<' + codes * len(rows)).pack(*values)
+    except struct.error:
+        return False
+    out.append(_H.pack(len(names)))
+    out.append(_struct('<%dH' % len(names)).pack(
+        *[writer.code(name) for name in names]))
+    out.append(codes)
+    out.append(_I.pack(len(rows)))
+    out.append(packed)
+    return True
+
+
+def _pack_columns(writer, block):
+    """Append columnar rows, or return False if they can't be packed."""
+    names = block['columns']
+    rows = block['rows']
+    column_codes = _COLUMN_CODES.get(frozenset(names))
+    if column_codes is None:
+        codes = 'q' * len(names)
+    else:
+        codes = ''.join(column_codes[name] for name in names)
+    if rows and set(map(len, rows)) != set([len(names)]):
+        return False
+    values = list(chain.from_iterable(rows))
+    if not _all_ints(values):
+        return False
+    try:
+        packed = _struct('<' + codes * len(rows)).pack(*values)
+    except struct.error:
+        return False
+    out = writer.out
+    out.append(_H.pack(len(names)))
+    out.append(_struct('<%dH' % len(names)).pack(
+        *[writer.code(name) for name in names]))
+    out.append(codes)
+    out.append(_I.pack(len(rows)))
+    out.append(packed)
+    return True
+
+
+def encode_results(results, version=VERSION):
+    """Encode a transaction's results.
+
+    Args:
+        results: Dictionary of query results keyed by return_type, plus
+            'affected' and 'timers', as put together by the db worker.
+        version: (optional) Wire format version to encode them in, that of
+            the batch they are the results of.
+
+    Returns:
+        Encoded results, a byte string.
+    """
+    writer = _Writer(version)
+    out = writer.out
+    out.append(_H.pack(len(results)))
+    for key, value in results.iteritems():
+        writer.name(key)
+        if type(value) in _INT_TYPES:
+            out.append('i')
+            out.append(_q.pack(value))
+        elif key == 'timers':
+            out.append('m')
+            out.append(_H.pack(len(value)))
+            pairs = []
+            for name, elapsed in value.iteritems():
+                pairs.append(writer.code(name))
+                pairs.append(elapsed)
+            out.append(_struct('<' + 'Hd' * len(value)).pack(*pairs))
+        elif isinstance(value, dict) and 'columns' in value:
+            mark = len(out)
+            out.append('c')
+            if not _pack_columns(writer, value):
+                del out[mark:]
+                out.append('j')
+                writer.blob(json.dumps(value))
+        else:
+            mark = len(out)
+            out.append('r')
+            if not (isinstance(value, list) and _pack_rows(writer, value)):
+                del out[mark:]
+                out.append('j')
+                writer.blob(json.dumps(value))
+    return writer.message(_RESULTS_MAGIC)
+
+
+def decode_results(data):
+    """Decode results encoded by encode_results.
+
+    Returns:
+        Dictionary of the results and result metadata, as it was encoded.
+
+    Raises:
+        ValueError: data isn't binary results of a supported version.
+    """
+    reader = _Reader(data, _RESULTS_MAGIC)
+    strings = reader.strings
+    results = {}
+    for i in range(reader.unpack(_H)[0]):  # pylint: disable=unused-variable
+        key = reader.name()
+        tag = reader.read(1)
+        if tag == 'i':
+            results[key] = reader.unpack(_q)[0]
+        elif tag == 'm':
+            count = reader.unpack(_H)[0]
+            values = iter(reader.unpack(_struct('<' + 'Hd' * count)))
+            results[key] = dict((strings[code], elapsed)
+                                for code, elapsed in izip(values, values))
+        elif tag in 'rc':
+            width = reader.unpack(_H)[0]
+            names = [strings[code] for code in
+                     reader.unpack(_struct('<%dH' % width))]
+            codes = reader.read(width)
+            num_rows = reader.unpack(_I)[0]
+            values = iter(reader.unpack(_struct('<' + codes * num_rows)))
+            rows = list(izip(*[values] * width)) if width else []
+            if tag == 'c':
+                results[key] = {'columns': names, 'rows': rows}
+            else:
+                results[key] = [dict(zip(names, row)) for row in rows]
+        else:
+            results[key] = json.loads(reader.blob())
+    return results
+
+
+def load_queries(msg):
+    """Return the queries in a work queue message, in whichever format the
+    'wire' attribute says it's in.
+
+    Args:
+        msg: The message.  msg.data holds the encoded queries, and
+            msg.attributes the transaction metadata.
+
+    Returns:
+        List of (query, return_type) pairs.
+    """
+    if msg.attributes.get('wire'):
+        return decode_queries(msg.data)
+    return json.loads(msg.data)['queries']
+
+
+def dump_results(msg, results):
+    """Encode a transaction's results in the format its message asked for.
+
+    Args:
+        msg: The message the transaction came in.
+        results: Dictionary of query results.
+
+    Returns:
+        Encoded results: a byte string for binary, JSON otherwise.
+    """
+    if msg.attributes.get('wire'):
+        return encode_results(results, int(msg.attributes['wire']))
+    return json.dumps(results)
+
+
+def load_results(data):
+    """Decode results stored by the worker, binary or JSON."""
+    if is_binary(data):
+        return decode_results(data)
+    return json.loads(data)
@@ -16,7 +16,9 @@
 """Configuration file for the database.  Includes connection parameters, and
 a convenience function for connecting to the database."""
 import os
-import MySQLdb as mysql
+
+# Custom modules
+import db_api.backends as backends
 
 # Connection type and parameters can be specified in the environment
 # itself by manipulating the appropriate env vars.
@@ -28,6 +30,8 @@ con_type = {
     'tcp_direct': {},
     'cloudsql_proxy': {},
     'cloudsql_tcp': {},
+    'sqlite': {},
+    'redis': {},
 }
 con_type['tcp_direct'] = {
     # params for connecting to a db over tcp.
@@ -49,9 +53,32 @@ con_type['cloudsql_tcp'] = {
     'port': int(os.getenv('DB_PORT', 3306)),
 }
 
+con_type['sqlite'] = {
+    # params for a local SQLite database file (see db_api/backends/sqlite.py)
+    'path': os.getenv('DB_SQLITE_PATH', 'mimus.db'),
+    # seconds a transaction waits for the write lock
+    'busy_timeout': float(os.getenv('DB_SQLITE_BUSY_TIMEOUT', 30)),
+    # PRAGMA synchronous: NORMAL only fsyncs the WAL at checkpoints, FULL on
+    # every commit (like MySQL with innodb_flush_log_at_trx_commit=1).
+    'synchronous': os.getenv('DB_SQLITE_SYNCHRONOUS', 'NORMAL'),
+}
+
+con_type['redis'] = {
+    # params for keeping the tables in Redis (see db_api/backends/redis_store.py)
+    'host': os.getenv('DB_HOST', '127.0.0.1'),
+    'port': int(os.getenv('DB_PORT', 6379)),
+    'db': int(os.getenv('DB_REDIS_DB', 0)),
+    'password': os.getenv('DB_REDIS_PASSWORD', None),
+}
+
 # Look in env var for what kind of db connection this environment is using.
 dbc = con_type[connection]
 
+# Storage backend for the connection type (see db_api/backends).  MySQLdb is
+# only imported for the MySQL connection types.
+backend = backends.load({'sqlite': 'sqlite',
+                         'redis': 'redis_store'}.get(connection, 'mysql'))
+
 # Elements common to all connection types.
 dbc.update({
     #'user': 'root',
@@ -70,19 +97,57 @@ if 'project' in dbc and 'zone' in dbc and 'instance_name' in dbc:
     # https://cloud.google.com/sql/docs/sql-proxy
     dbc['path'] = os.path.join('/cloudsql', dbc['cloud_sql_db'])
 
-def db_connect():
-    '''Convenience mysql connect function with args already populated.'''
-    if connection in ['cloudsql_proxy']:
-        # Use the cloudsql proxy
-        return mysql.connect(host=dbc['host'],
-                             user=dbc['user'],
-                             passwd=dbc['pass'],
-                             db=dbc['name'],
-                             unix_socket=dbc['path'])
+def _host_params(host):
+    """Return a copy of dbc for another database, given as 'host[:port]' for
+    the tcp connection types, as the instance name for 'cloudsql_proxy', or
+    as the database file for 'sqlite'."""
+    params = dict(dbc)
+    if connection == 'sqlite':
+        params['path'] = host
+    elif 'cloud_sql_db' in params:
+        params['instance_name'] = host
+        params['cloud_sql_db'] = ':'.join(
+            [params['project'], params['zone'], host])
+        params['path'] = os.path.join('/cloudsql', params['cloud_sql_db'])
     else:
-        # standard TCP mysql connection
-        return mysql.connect(host=dbc['host'],
-                             port=dbc['port'],
-                             user=dbc['user'],
-                             passwd=dbc['pass'],
-                             db=dbc['name'])
+        host_port = host.split(':')
+        params['host'] = host_port[0]
+        if len(host_port) > 1:
+            params['port'] = int(host_port[1])
+    return params
+
+# Connection parameters of each shard, when players are sharded across
+# several databases (see db_api/sharding.py).  DB_SHARD_HOSTS is a
+# comma-separated list of the shards' databases, in shard order (see
+# _host_params).  The other parameters are the same for all shards.  Empty
+# means a single shard, the database configured above.
+shards = [_host_params(host)
+          for host in os.getenv('DB_SHARD_HOSTS', '').split(',') if host]
+if not shards:
+    shards = [dbc]
+
+# Connection parameters of each shard's read replicas, which the db worker
+# runs read-only transactions on.  DB_REPLICA_HOSTS lists the replicas of
+# each shard, in shard order and separated by ';', as comma-separated
+# databases (see _host_params), e.g. 'r0a,r0b;r1a' for two shards, or
+# ';r1a' if only the second shard has replicas.  Empty means no replicas.
+_replica_hosts = os.getenv('DB_REPLICA_HOSTS', '')
+replicas = []
+if _replica_hosts:
+    replicas = [[_host_params(host) for host in shard_hosts.split(',') if host]
+                for shard_hosts in _replica_hosts.split(';')]
+if replicas and len(replicas) != len(shards):
+    raise ValueError('DB_REPLICA_HOSTS lists replicas of %d shards, not %d' %
+                     (len(replicas), len(shards)))
+
+def db_connect(shard=0, replica=None):
+    '''Convenience connect function with args already populated.
+
+    Args:
+        shard: (optional) Number of the shard to connect to.
+        replica: (optional) Number of the shard's replica to connect to,
+            instead of the shard's primary.
+    '''
+    if replica is None:
+        return backend.connect(shards[shard])
+    return backend.connect(replicas[shard][replica])
@@ -0,0 +1,182 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# pylint: disable=invalid-name
+"""Fixed-size pool of health-checked database connections."""
+from __future__ import with_statement
+from contextlib import contextmanager
+from time import time
+import logging
+import Queue
+import threading
+
+# Custom modules
+from db_config import backend
+
+poollogger = logging.getLogger('db_worker.pool')
+
+
+class ConnectionPool(object):
+    """Pool of database connections, built on a connect function such as
+    db_config.db_connect.
+
+    Connections are opened lazily, and checked before being handed out if they
+    have been idle for longer than ping_interval seconds.  A connection that
+    fails its check, or that the borrower marks as broken, is closed and
+    transparently replaced with a new one on the next checkout.
+
+    Attributes:
+        size: Maximum number of open connections.
+        created: Number of connections opened so far.
+        reconnects: Number of connections replaced after failing.
+    """
+
+    def __init__(self, connect, size, setup=None, ping_interval=10):
+        """Initialize the pool.
+
+        Args:
+            connect: Function that returns a new database connection.
+            size: Maximum number of open connections.
+            setup: (optional) Function called with each newly opened
+                connection, to prepare its session.
+            ping_interval: Idle seconds after which a connection is pinged
+                before being handed out.
+        """
+        self._connect = connect
+        self._setup = setup
+        self._ping_interval = ping_interval
+        self._idle = Queue.Queue()
+        self.size = size
+        # Guards the counters, which executor threads update concurrently.
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reconnects = 0
+        # Empty slots are filled with real connections on first checkout.
+        for _ in range(size):
+            self._idle.put((None, 0))
+
+    def _open(self):
+        """Open and prepare a new connection."""
+        con = self._connect()
+        if self._setup:
+            self._setup(con)
+        with self._lock:
+            self.created += 1
+        return con
+
+    def _healthy(self, con):
+        """Return True if the connection still responds."""
+        try:
+            con.ping()
+            return True
+        except backend.Error, err:
+            poollogger.warning("Database connection failed health check: %s",
+                               repr(err))
+            return False
+
+    def get(self):
+        """Check a connection out of the pool, blocking until one is free."""
+        con, last_used = self._idle.get()
+        if con is not None and time() - last_used > self._ping_interval:
+            if not self._healthy(con):
+                self._close(con)
+                con = None
+        if con is None:
+            try:
+                con = self._open()
+            except Exception:
+                # Give the slot back so the pool doesn't shrink.
+                self._idle.put((None, 0))
+                raise
+        return con
+
+    def put(self, con):
+        """Return a healthy connection to the pool."""
+        self._idle.put((con, time()))
+
+    def _close(self, con):
+        """Close a broken connection."""
+        try:
+            con.close()
+        except backend.Error:
+            pass
+        with self._lock:
+            self.reconnects += 1
+
+    def discard(self, con):
+        """Close a broken connection, and free up its slot in the pool."""
+        self._close(con)
+        self._idle.put((None, 0))
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and back in.
+
+        If the block raises a database OperationalError (typically a dropped
+        or timed out connection), the connection is discarded instead of
+        being returned to the pool.
+        """
+        con = self.get()
+        try:
+            yield con
+        except backend.OperationalError:
+            self.discard(con)
+            raise
+        except Exception:
+            self.put(con)
+            raise
+        self.put(con)
+
+
+class ShardedConnectionPool(object):
+    """A ConnectionPool per database shard (see db_api/sharding.py).
+
+    Attributes:
+        pools: List of the shards' ConnectionPools, in shard order.
+    """
+
+    def __init__(self, connect, shards, size, setup=None, ping_interval=10):
+        """Initialize a pool for each shard.
+
+        Args:
+            connect: Function that returns a new connection to the shard it
+                is passed the number of.
+            shards: Number of shards.
+            size: Maximum number of open connections per shard.
+            setup: (optional) Function called with each newly opened
+                connection and the number of its shard, to prepare its
+                session.
+            ping_interval: Idle seconds after which a connection is pinged
+                before being handed out.
+        """
+        self.pools = [
+            ConnectionPool(lambda shard=shard: connect(shard), size,
+                           setup and (lambda con, shard=shard: setup(con, shard)),
+                           ping_interval)
+            for shard in range(shards)]
+
+    @property
+    def created(self):
+        """Number of connections opened so far, on all shards."""
+        return sum(pool.created for pool in self.pools)
+
+    @property
+    def reconnects(self):
+        """Number of connections replaced after failing, on all shards."""
+        return sum(pool.reconnects for pool in self.pools)
+
+    def connection(self, shard=0):
+        """Context manager that checks a connection to a shard out and back
+        in (see ConnectionPool.connection)."""
+        return self.pools[shard].connection()
@@ -14,24 +14,63 @@
 # limitations under the License.
 #
 # Database worker process.  Basic outline:
-#  - Sets up a pubsub client, db connection, and redis connection
-#  - Reads lists of queries from a pubsub topic
+#  - Sets up a work queue subscription (Cloud Pub/Sub by default, see
+#    db_api/transports), db connection, and redis connection
+#  - Reads lists of queries from the work queue, or game action intents it
+#    expands into them (see db_api/intents.py)
 #  - Runs those queries in order on the database
 #   - Each query comes with a 'return_type' string that is used to
 #     determine where to put the query's results in the dictionary
 #     put in redis.
+#   - A query is either a SQL string, or a statement template id and its
+#     parameters (see db_api/statement_generator.py).  Templates are compiled
+#     to SQL once per worker, and consecutive queries sharing a template are
+#     run with one executemany.
+#   - Statements that don't return rows (INSERT/UPDATE) put a
+#     {'first_id': LAST_INSERT_ID, 'rowcount': rows affected} entry under
+#     their return_type instead, unless the return_type is 'affected'.  This
+#     lets the originator apply the change to its cached rows without
+#     selecting them again.  INSERT entries also hold the step between the
+#     ids of the rows inserted ('id_step', db_shards.id_step, more than 1
+#     when the shards' ids are interleaved).
 #  - Stores any query results under the appropriate key in the results
-#    dictionary
+#    dictionary: as a list of row dictionaries, or, when the message's 'rows'
+#    attribute is 'columns', as the column names once and a list of row
+#    tuples ({'columns': [...], 'rows': [(...), ...]}).  Rows are fetched as
+#    tuples either way.
 #  - Acks the pubsub message
-#  - Puts the results dictionary in redis under the transaction id
+#  - Puts the results dictionary in redis under the transaction id, either as
+#    a plain key the originator polls for, or pushed onto a list the
+#    originator is blocked on (when the message's 'ack_mode' is 'push')
+#
+# With --concurrency N, a single thread pulls messages into a bounded queue
+# and N executor threads run them, each on its own connection from a pool of
+# health-checked connections.  Connections that time out or drop are
+# reconnected on next use.
+#
+# With --batch-size M, up to M messages are pulled and run together as a
+# group commit: each transaction runs inside its own SAVEPOINT (a failed one
+# is rolled back to it, without affecting the others), then there is one
+# commit, one ack of all the messages and one Redis pipeline of all the
+# results.  Backends without savepoints (the Redis store) can't do this.
+#
+# When players are sharded across several databases (cfg['db_shards'], see
+# db_api/sharding.py), each transaction runs on a connection to the shard of
+# the player it is routed by, from a pool per shard.  Transactions naming
+# players of other shards are rejected.
+#
+# When the databases have read replicas (db_config.replicas), transactions
+# made only of SELECTs run on a connection to one of their shard's replicas,
+# unless one of their players wrote within the last
+# cfg['db_replicas']['staleness'] seconds.  Workers mark the players of each
+# transaction that writes with a 'written-<player id>' key in the results
+# Redis, set in the same pipeline as its results, so the mark is there before
+# the player can make its next transaction, on any worker.  Shards without
+# replicas run all their transactions on the primary.
 #
 # Limitations/NYI:
-#  - Currently, it's possible for the db connection to timeout, and this script
-#    doesn't attempt to reconnect.
 #  - The way timers are done could be cleaned up, they are pretty rough.
 #    (Currently using numbers in the keys to preserve order when printing out)
-#  - Script currently only processes one message per loop; this isn't a huge
-#    limitation as the limiting factor is the time the database query takes
 #
 # pylint: disable=line-too-long,invalid-name,
 """Database worker process."""
@@ -40,23 +79,63 @@ from __future__ import with_statement
 from retrying import retry
 from redis import StrictRedis
 from uuid import uuid4
-from gcloud import pubsub
 from time import sleep, time
+from itertools import count
+from collections import defaultdict
 from imp import load_source
 from pprint import pformat
 import os, sys
-import MySQLdb as mysql
 import logging.handlers as handlers
 import optparse
 import logging
 import binascii
 import warnings
+import threading
+import Queue
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
 
 # Custom Modules
-# Mimus config is loaded from the file specified on the commandline.
-from db_config import db_connect
+# Mimus config is loaded from the file specified on the commandline (this
+# default is used when the worker is run from another module, see
+# mimus_local.py).
+from mimus_cfg import cfg
+from db_config import backend, db_connect
 from db_config import dbc as db_config
-from db_api.statement_generator import create_table
+from db_config import shards as db_shards
+from db_config import replicas as db_replicas
+from db_api.statement_generator import compile_template
+from db_pool import ShardedConnectionPool
+from db_api.player_cache import PlayerCache
+import db_api.intents as intents
+import db_api.routing as routing
+import db_api.sharding as sharding
+import db_api.transports as transports
+import db_api.wire as wire
+
+# Replaced by a logger tagged with the worker ID when run as a script.
+logger = logging.getLogger('db_worker')
+
+# Cache of the player rows and cardlists this worker reads and writes, when
+# it serves a partition of the players (--partition, see
+# db_api/player_cache.py), otherwise None.
+player_cache = None
+
+# Map of the players to the database shards.
+shard_map = sharding.ShardMap.from_cfg(cfg)
+# Step between the AUTO_INCREMENT ids the rows of one INSERT get: above 1, the
+# ids of the shards are interleaved (see setup_connection).
+id_step = cfg['db_shards']['id_step']
+
+# Number of read-only transactions run on a replica ('replica'), and run on
+# the primary because a player wrote recently ('stale').
+replica_stats = {'replica': 0, 'stale': 0}
+_replica_lock = threading.Lock()
+# Round robin turn of the next connection to each shard's replicas.
+_replica_turns = defaultdict(count)
 
 #############################
 # DB CONNECTION SETUP
@@ -64,245 +143,842 @@ from db_api.statement_generator import create_table
 @retry(stop_max_delay=10000,
        wait_exponential_multiplier=1000,
        wait_exponential_max=10000)
-def connect():
+def connect(shard=0, replica=None):
     """wrapper for db_connect that handles retries"""
+    params = db_shards[shard] if replica is None else db_replicas[shard][replica]
     logger.debug("DB Connection type: %s", os.getenv('DB_CONNECTION_TYPE',
                                                       'cloudsql_proxy'))
     logger.debug(
         "DB Connection config: %s",
-        pformat(db_config))  # Insecure: prints password! Don't use in production!
-    if 'path' in db_config:
-        mydb = db_config['path']
+        pformat(params))  # Insecure: prints password! Don't use in production!
+    if 'path' in params:
+        mydb = params['path']
     else:
-        mydb = "%s:%d" % (db_config['host'], db_config['port'])
+        mydb = "%s:%d" % (params['host'], params['port'])
     logger.info("Attempting to connect to database at %s", mydb)
-    con = db_connect()
+    con = db_connect(shard, replica)
     logger.info("Connected to %s", mydb)
     return con
 
-def run():  # pylint: disable=too-many-branches,too-many-statements,too-many-locals
-    """Main process loop"""
-    global timers # pylint: disable=global-statement
+# Timer and warning thresholds (in seconds) for logging the timers.  See the
+# comment in process_message for an explanation of the timers.
+WARNING_THRESHES = {
+    'sql': 10,
+    'default': 10,
+}
+
+
+def timer_start(timers, name):
+    """Start timer"""
+    timers[name] = time()
+
+
+def timer_stop(timers, name):
+    """Stop timer"""
+    timers[name] = time() - timers[name]
+
+
+def log_timers(timers, threshes):
+    """Log the timers in correct order, as warnings if over their threshold."""
+    for tmr in sorted(timers.keys()):
+        tmr_msg = "%06.03f - %s" % (timers[tmr], tmr[4:])
+        if timers[tmr] > threshes.get(tmr, WARNING_THRESHES['default']):
+            logger.warning(tmr_msg)
+        else:
+            logger.info(tmr_msg)
+
+
+def table_names():
+    """Get the names of all tables in the db.  All python files in the
+    db_api 'objects' directory (except for __init__.py) describe tables in the
+    database."""
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    module_files = [filename
+                    for filename in os.listdir(os.path.join(current_dir, cfg[
+                        'db_api']['dir'], 'objects'))
+                    if filename.endswith('.py') and not filename.startswith('__')]
+    return [os.path.splitext(filename)[0] for filename in module_files]
+
+
+def init_db():
+    """Create the database and all tables in it if they don't exist, on
+    every shard."""
+    if shard_map.count != len(db_shards):
+        logger.error("db_shards.count is %d, but DB_SHARD_HOSTS lists %d shards!",
+                     shard_map.count, len(db_shards))
+        sys.exit(1)
+    if len(db_shards) > id_step:
+        logger.error("db_shards.id_step is %d, but there are %d shards: they would hand out the same card ids!",
+                     id_step, len(db_shards))
+        sys.exit(1)
+    if id_step > 1 and not backend.interleaves_ids:
+        logger.error("The %s backend can't be sharded: it can't step its card ids by db_shards.id_step!",
+                     backend.dialect)
+        sys.exit(1)
+    for shard in range(shard_map.count):
+        init_shard(shard)
+
+
+def init_shard(shard):
+    """Create the database and all tables in it on one shard if they don't
+    exist."""
     try:
-        con = connect()
-    except mysql.OperationalError, err:
+        con = connect(shard)
+    except backend.OperationalError, err:
         # We ran out of retries.  Die.
         logger.error("Failed to connect to the database!")
         logger.error("%s", repr(err))
         sys.exit(1)
     con.autocommit(False)
-    with con:
-
-        # Create cursor, verify database exists and use it
-        # You can specify db name when making the connection, but it will fail if
-        # the db doesn't exist yet.
-        cursor = con.cursor(mysql.cursors.DictCursor)
-        cursor.execute("CREATE DATABASE IF NOT EXISTS %s" % db_config['name'])
-        cursor.execute("USE %s" % db_config['name'])
-
-        # Initialize all DB tables if they don't exist
-        for tname in TABLE_NAMES:
-            SQL = create_table(tname, cfg)
-            cursor.execute(SQL)
-            cursor.execute('SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED')
-        con.commit()
-        # END DB CONNECTION SETUP
-        #############################
-
-        # Var init
-        time_to_sleep = 0.1
-        start_time = time()
-        prev_warn = 0
-        warning_threshes = {
-            'sql': 10,
-            'default': 10,
-        }
-
-        # Loop & pull
-        logger.info(
-            "Ready to begin polling pubsub subscription '%s:%s' for messages",
-            cfg['pubsub']['topic'], cfg['pubsub']['sub'])
-        if not options.verbose:
-            logger.info("Logging to file %s", options.log_file)
-            logger.removeHandler(verbose_handler)
+
+    # Create cursor, verify database exists and use it
+    # You can specify db name when making the connection, but it will fail if
+    # the db doesn't exist yet.
+    cursor = con.cursor()
+    backend.create_database(cursor, db_config['name'])
+
+    # Initialize all DB tables if they don't exist
+    logger.info("Loading database information")
+    backend.create_tables(cursor, table_names(), cfg)
+    con.commit()
+    con.close()
+
+
+def setup_connection(con, shard=0):
+    """Prepare a newly opened connection for processing transactions."""
+    backend.setup_connection(con, db_config['name'])
+    if id_step > 1:
+        # Interleave the AUTO_INCREMENT ids (of cards) the shards hand out,
+        # so they are unique across shards.
+        cursor = con.cursor()
+        backend.interleave_ids(cursor, id_step, shard + 1)
+        cursor.close()
+
+
+def make_pool(size):
+    """Build a pool of health-checked database connections per shard."""
+    return ShardedConnectionPool(connect, shard_map.count, size,
+                                 setup=setup_connection,
+                                 ping_interval=cfg['db_con']['ping_interval'])
+
+
+def _connect_replica(shard):
+    """Connect to the next of a shard's replicas, round robin."""
+    return connect(shard, next(_replica_turns[shard]) % len(db_replicas[shard]))
+
+
+def make_replica_pool(size):
+    """Build a pool of health-checked replica connections per shard, or
+    return None if the databases have no replicas."""
+    if not db_replicas:
+        return None
+    return ShardedConnectionPool(_connect_replica, shard_map.count, size,
+                                 setup=setup_connection,
+                                 ping_interval=cfg['db_con']['ping_interval'])
+
+
+def _load_message(msg, timers):
+    """Decode a message, and start its worker-side timers.
+
+    Args:
+        msg: The message. msg.data holds the encoded queries, and
+            msg.attributes the transaction metadata.
+        timers: Timers dictionary started by pull() for this message.
+
+    Returns:
+        (uniq_trans_id, queries), or None if the message is so old its
+        originator has already given up on it.  Such messages should just be
+        acked.
+    """
+    timer_start(timers, '050 json_load')
+    uniq_trans_id = "%s:%s" % (msg.attributes['srv_id'],
+                               msg.attributes['trans_id'])
+
+    # This timer is done differently because it was started
+    # in the originating process
+    if 'insertion_time' in msg.attributes:
+        timers['900 ===TOTAL==='] = float(msg.attributes[
+            'insertion_time'])
+        timers['010 q wait'] = time() - float(msg.attributes[
+            'insertion_time'])
+        if timers['010 q wait'] > cfg['db_con']['timeout']:
+            # This message is so old, it's client has already considered it
+            # discarded.  Just trash it and log an error.
+            logger.error("%s ack, %d secs old",
+                         uniq_trans_id, timers['010 q wait'])
+            return None
+    logger.debug(repr(msg.data))
+    queries = intents.load_queries(msg)
+    timer_stop(timers, '050 json_load')
+    return uniq_trans_id, queries
+
+
+def group_statements(queries):
+    """Group a transaction's queries into the statements to run.
+
+    Consecutive statement templates with the same template id and return
+    type are run together with executemany (which the backend turns into a
+    single multi-row statement for INSERTs).  SELECTs and plain SQL strings
+    always run on their own.
+
+    Args:
+        queries: List of (query, return_type) pairs.  query is either a SQL
+            string, or a [template_id, params] pair (see
+            db_api.statement_generator.compile_template).
+
+    Returns:
+        List of [label, SQL, params, many, return_type] statements.  label is
+        the template id, or the SQL for plain SQL strings.  params is None
+        for plain SQL strings, and a list of parameters for templates, or a
+        list of parameter lists if many is True.
+    """
+    statements = []
+    for query, return_type in queries:
+        if not isinstance(query, (list, tuple)):
+            statements.append([query, query, None, False, return_type])
+            continue
+        template_id, params = query
+        last = statements[-1] if statements else None
+        if (last and last[0] == template_id and last[4] == return_type and
+                not last[1].startswith('SELECT')):
+            if not last[3]:
+                last[2] = [last[2]]
+                last[3] = True
+            last[2].append(params)
         else:
-            logger.info("Logging to screen instead of file")
-            logger.removeHandler(file_handler)
+            statements.append([template_id, compile_template(template_id),
+                               params, False, return_type])
+    return statements
 
-        while True:
-            # The timers dictionary is used to store keys with start times and
-            # intervals for how long certain portions of the message processing takes.
-            # For the sake of being able to easily print the timers in the order that
-            # the actions occurred, we pre-pend a number to the action name as the key
-            # for the timer dictionary.  Then, when printing the timers, we simply
-            # discard the number so it doesn't clutter up the output and we get our
-            # timers printed in the order we want.
-            #
-            # - Timers without parenthesis measure the processing time of the pubsub
-            #   message
-            # - Timers in parenthesis measure the processing time of the worker thread
-            # example:
-            #
-            # time   | action
-            # elapsed| name
-            #---------------------------------------------------------------------------
-            # 00.017 - q wait
-            # 00.939 - (pull wait)
-            # 00.000 - json_load
-            # 00.038 - INSERT 1224460250 3063853833:9298b7b6-3d20-4f86-a380-c91613882493
-            # 00.038 - SELECT 4039320666 3063853833:9298b7b6-3d20-4f86-a380-c91613882493
-            # 00.041 - commit
-            # 00.006 - ack
-            # 00.001 - redis ack
-            # 00.370 - ===TOTAL===
-            # 01.292 - (===WORKER PROCESSING===)
-            #
-            # For this message:
-            # - The total time from when it entered the pubsub queue until the results
-            # were put in redis was 0.37 seconds. This measures the client latency.
-            # - The total time the worker spent waiting for message from pubsub to
-            # arrive and then processing it was 1.292 seconds. This measures how busy
-            # the worker process is.
-            #
-            # Legend for SQL actions:
-            # time   | Query  Query      Transaction ID
-            # elasped| type   CRC        (Redis key for the results of this query)
-            #---------------------------------------------------------------------------
-            # 00.038 - INSERT 1224460250 3063853833:9298b7b6-3d20-4f86-a380-c91613882493
-            timers = {}
-
-            timer_start('900 ===TOTAL===')
-            timer_start('910 (===WORKER PROCESSING===)')
-            timer_start('020 (pull wait)')
-            # Pull message, wait if nothing to pull
-            recv = None
+
+def _run_queries(cursor, queries, uniq_trans_id, timers, threshes,  # pylint: disable=too-many-arguments
+                 columnar=False, shard=0):
+    """Run a transaction's queries, without committing.
+
+    Args:
+        cursor: Cursor (returning rows as tuples) to run the queries on.
+        queries: List of (query, return_type) pairs.
+        uniq_trans_id: Transaction ID, for the timers.
+        timers: Timers dictionary for this transaction.
+        threshes: Warning thresholds for the timers, updated with the
+            thresholds of the query timers.
+        columnar: (optional) Return the rows of each return_type as
+            {'columns': column names, 'rows': list of row tuples} instead of
+            a list of row dictionaries.
+        shard: (optional) The shard the cursor's connection is to.
+
+    Returns:
+        results: Dictionary of query results keyed by return_type.
+
+    Raises:
+        ValueError: The queries name players of another shard, or the
+            backend can't run them.  None of them have run.
+    """
+    results = {'affected': 0}
+    statements = group_statements(queries)
+    if shard_map.count > 1:
+        sharding.check_statements(shard_map, shard, statements)
+    if hasattr(cursor, 'execute_transaction'):
+        # The backend runs them all at once, then returns each one's results
+        # as it is executed below.
+        cursor.execute_transaction(statements)
+
+    # Get query, and the key under which to return it
+    num = 100
+    for label, query, params, many, return_type in statements:
+        try:
+            if not return_type in results:
+                results[return_type] = []
+            query_hash = "%s %s %s %s" % (
+                str(num), query.split()[0],
+                str(binascii.crc32(label) & 0xFFFFFFFF),
+                uniq_trans_id)
+            timer_start(timers, query_hash)
+            threshes[query_hash] = WARNING_THRESHES['sql']
+            cached = None
+            if player_cache is not None and not many:
+                cached = player_cache.read(label, params)
+            if cached is not None and not player_cache.verify:
+                logger.debug("Read '%s' %s from the player cache", query, params)
+                columns, rows = cached
+                rowcount = len(rows)
+            else:
+                logger.debug("Executing '%s' %s", query, params)
+                if many:
+                    cursor.executemany(query, params)
+                else:
+                    cursor.execute(query, params)
+                logger.debug("Executed '%s'", query)
+                rowcount = int(cursor.rowcount)
+                columns = None
+                if cursor.description is not None:
+                    columns = [column[0] for column in cursor.description]
+                    rows = cursor.fetchall()
+                    if cached is not None:
+                        player_cache.check(label, params, cached, columns, rows)
+                    elif player_cache is not None:
+                        player_cache.fill(label, params, columns, rows)
+                elif player_cache is not None:
+                    player_cache.write(label, params, many, cursor.lastrowid,
+                                       id_step)
+            if columns is None:
+                # No result set.  Report the ids and number of rows the
+                # statement changed, for originators applying deltas.
+                if return_type != 'affected':
+                    changes = {'first_id': cursor.lastrowid,
+                               'rowcount': rowcount}
+                    if query.startswith('INSERT'):
+                        changes['id_step'] = id_step
+                    results[return_type].append(changes)
+            else:
+                if not columnar:
+                    results[return_type].extend(dict(zip(columns, row))
+                                                for row in rows)
+                elif not results[return_type]:
+                    results[return_type] = {'columns': columns,
+                                            'rows': list(rows)}
+                else:
+                    # Another statement's rows under the same return_type,
+                    # from the same table.
+                    results[return_type]['rows'].extend(rows)
+            results['affected'] = results['affected'] + rowcount
+            logger.debug("query affected %d rows: '%s'", rowcount, query)
+            timer_stop(timers, query_hash)
+            num = num + 1
+        except backend.IntegrityError, err:
+            logger.error("%s", repr(err))
+            logger.error("%s %s", query, params)
+    return results
+
+
+def _invalidate_cache():
+    """Clear the player cache after a rollback, as it may hold rows the
+    rolled back statements wrote or read."""
+    if player_cache is not None:
+        player_cache.invalidate()
+
+
+def _read_only(statements):
+    """Whether a transaction's statements are all SELECTs."""
+    return all(query.lstrip().upper().startswith('SELECT')
+               for label, query, params, many, return_type in statements)  # pylint: disable=unused-variable
+
+
+def _players(msg, statements):
+    """Return the set of ids of the players a transaction is for: those its
+    statements name, and the one it is routed by."""
+    players = sharding.statement_players(statements)
+    player_id = sharding.message_player(msg)
+    if player_id is not None:
+        players.add(player_id)
+    return players
+
+
+def _written_key(player_id):
+    """Redis key marking a player as having written recently."""
+    return 'written-%d' % player_id
+
+
+def _mark_written(pipe, msg, queries):
+    """Queue the commands marking the players of a committed transaction
+    that wrote as having written recently, so their reads stay on the
+    primary for cfg['db_replicas']['staleness'] seconds."""
+    if not db_replicas or not cfg['db_replicas']['staleness']:
+        return
+    statements = group_statements(queries)
+    if _read_only(statements):
+        return
+    for player_id in _players(msg, statements):
+        pipe.setex(name=_written_key(player_id), value=1,
+                   time=cfg['db_replicas']['staleness'])
+
+
+def _columnar(msg):
+    """Whether the message's originator wants columnar results."""
+    return msg.attributes.get('rows') == 'columns'
+
+
+def _queue_results(pipe, msg, uniq_trans_id, results, timers):
+    """Queue the commands storing a transaction's results on a Redis
+    pipeline.
+
+    Args:
+        pipe: Pipeline of the Redis connection (or transport result store)
+            to put results in.
+        msg: The message the transaction came in.
+        uniq_trans_id: Transaction ID, the key to store the results under.
+        results: Dictionary of query results.
+        timers: Timers dictionary for this transaction, returned with the
+            results.
+    """
+    # put the timers in results, so the message originator can also access them
+    results['timers'] = timers
+    if msg.attributes.get('ack_mode') == 'push':
+        # The originator is blocked waiting on this list.
+        pipe.lpush(uniq_trans_id, wire.dump_results(msg, results))
+        pipe.expire(uniq_trans_id, cfg['db_api']['results_ttl'])
+    else:
+        pipe.setex(name=uniq_trans_id, value=wire.dump_results(msg, results),
+                   time=cfg['db_api']['results_ttl'])
+
+
+def process_message(con, sub, result_redis, ack_id, msg, timers, loaded=None,  # pylint: disable=too-many-locals,too-many-arguments
+                    shard=0):
+    """Run one transaction from the work queue and store its results.
+
+    Args:
+        con: Database connection to run the transaction on.
+        sub: Subscription the message was pulled from, used to ack it.
+        result_redis: Redis connection to store the results in.
+        ack_id: Ack ID of the message.
+        msg: The message. msg.data holds the encoded queries, and
+            msg.attributes the transaction metadata.
+        timers: Timers dictionary started by pull() for this message.
+        loaded: (optional) The message as loaded by _load_message, if it
+            already has been.
+        shard: (optional) The shard con is connected to.
+
+    Raises:
+        backend.OperationalError: The database connection failed.  The message
+            is left unacknowledged, so it will be redelivered.
+    """
+    # The timers dictionary is used to store keys with start times and
+    # intervals for how long certain portions of the message processing takes.
+    # For the sake of being able to easily print the timers in the order that
+    # the actions occurred, we pre-pend a number to the action name as the key
+    # for the timer dictionary.  Then, when printing the timers, we simply
+    # discard the number so it doesn't clutter up the output and we get our
+    # timers printed in the order we want.
+    #
+    # - Timers without parenthesis measure the processing time of the pubsub
+    #   message
+    # - Timers in parenthesis measure the processing time of the worker thread
+    # example:
+    #
+    # time   | action
+    # elapsed| name
+    #---------------------------------------------------------------------------
+    # 00.017 - q wait
+    # 00.939 - (pull wait)
+    # 00.000 - json_load
+    # 00.038 - INSERT 1224460250 3063853833:9298b7b6-3d20-4f86-a380-c91613882493
+    # 00.038 - SELECT 4039320666 3063853833:9298b7b6-3d20-4f86-a380-c91613882493
+    # 00.041 - commit
+    # 00.006 - ack
+    # 00.001 - redis ack
+    # 00.370 - ===TOTAL===
+    # 01.292 - (===WORKER PROCESSING===)
+    #
+    # For this message:
+    # - The total time from when it entered the pubsub queue until the results
+    # were put in redis was 0.37 seconds. This measures the client latency.
+    # - The total time the worker spent waiting for message from pubsub to
+    # arrive and then processing it was 1.292 seconds. This measures how busy
+    # the worker process is.
+    #
+    # Legend for SQL actions:
+    # time   | Query  Query      Transaction ID
+    # elasped| type   CRC        (Redis key for the results of this query)
+    #---------------------------------------------------------------------------
+    # 00.038 - INSERT 1224460250 3063853833:9298b7b6-3d20-4f86-a380-c91613882493
+    threshes = {}
+    try:
+        # load json message into a dict for easy access
+        if loaded is None:
+            loaded = _load_message(msg, timers)
+        if loaded is None:
+            # ack message receipt
+            sub.acknowledge([ack_id, ])
+            return
+        uniq_trans_id, queries = loaded
+
+        cursor = con.cursor()
+        results = _run_queries(cursor, queries, uniq_trans_id, timers,
+                               threshes, _columnar(msg), shard)
+
+        # commit db transaction
+        timer_start(timers, '800 commit')
+        con.commit()
+        timer_stop(timers, '800 commit')
+
+        # ack message receipt
+        timer_start(timers, '801 ack')
+        sub.acknowledge([ack_id, ])
+        timer_stop(timers, '801 ack')
+
+        # put results in redis
+        timer_start(timers, '802 redis ack')
+        pipe = result_redis.pipeline()
+        _mark_written(pipe, msg, queries)
+        _queue_results(pipe, msg, uniq_trans_id, results, timers)
+        pipe.execute()
+        timer_stop(timers, '802 redis ack')
+
+        timer_stop(timers, '900 ===TOTAL===')
+        timer_stop(timers, '910 (===WORKER PROCESSING===)')
+
+        log_timers(timers, threshes)
+
+    except backend.OperationalError:
+        # Lost the database connection.  Don't ack, so the message is
+        # redelivered and retried on a fresh connection.
+        logger.error("Database connection failed processing message:")
+        logger.error(repr(msg.data))
+        raise
+    except Exception:  # pylint: disable=broad-except
+        logger.error("Unable to process message:")
+        logger.error(repr(msg.data))
+        logger.error(
+            "Removing message from subscription and continuing...")
+        # Don't let the statements that did run be committed with the next
+        # message.
+        con.rollback()
+        _invalidate_cache()
+        sub.acknowledge([ack_id, ])
+        # DEBUG
+        #raise
+
+
+def process_batch(con, sub, result_redis, batch, shard=0):  # pylint: disable=too-many-locals
+    """Run several transactions from the work queue and commit them together.
+
+    Each transaction runs inside its own SAVEPOINT, so one that fails is
+    rolled back on its own while the others go ahead.  Then the batch is
+    committed once, all its messages are acked in one call, and all the
+    results are stored through one Redis pipeline.  Timers for those shared
+    steps are the same in every transaction of the batch.
+
+    Args:
+        con: Database connection to run the transactions on.
+        sub: Subscription the messages were pulled from, used to ack them.
+        result_redis: Redis connection to store the results in.
+        batch: List of (ack_id, message, timers, loaded) tuples: messages
+            as returned by pull(), and loaded by _load_message if they
+            already have been (otherwise None).
+        shard: (optional) The shard con is connected to.
+
+    Raises:
+        backend.OperationalError: The database connection failed.  None of the
+            messages are acknowledged, so they will all be redelivered.
+    """
+    ack_ids = []
+    done = []  # (msg, uniq_trans_id, results, timers, threshes, queries)
+    cursor = con.cursor()
+    for num, (ack_id, msg, timers, loaded) in enumerate(batch):
+        threshes = {}
+        ack_ids.append(ack_id)
+        try:
+            if loaded is None:
+                loaded = _load_message(msg, timers)
+            if loaded is None:
+                continue
+            uniq_trans_id, queries = loaded
+            cursor.execute('SAVEPOINT trans%d' % num)
+            try:
+                results = _run_queries(cursor, queries, uniq_trans_id,
+                                       timers, threshes, _columnar(msg),
+                                       shard)
+            except backend.OperationalError:
+                raise
+            except Exception:  # pylint: disable=broad-except
+                cursor.execute('ROLLBACK TO SAVEPOINT trans%d' % num)
+                _invalidate_cache()
+                raise
+            cursor.execute('RELEASE SAVEPOINT trans%d' % num)
+            done.append((msg, uniq_trans_id, results, timers, threshes, queries))
+        except backend.OperationalError:
+            logger.error("Database connection failed processing batch of %d messages",
+                         len(batch))
+            raise
+        except Exception:  # pylint: disable=broad-except
+            logger.error("Unable to process message:")
+            logger.error(repr(msg.data))
+            logger.error(
+                "Removing message from subscription and continuing...")
+
+    # commit db transactions
+    shared = {}
+    timer_start(shared, '800 commit')
+    con.commit()
+    timer_stop(shared, '800 commit')
+
+    # ack message receipts
+    timer_start(shared, '801 ack')
+    sub.acknowledge(ack_ids)
+    timer_stop(shared, '801 ack')
+
+    # put results in redis
+    timer_start(shared, '802 redis ack')
+    pipe = result_redis.pipeline()
+    for msg, uniq_trans_id, results, timers, threshes, queries in done:
+        timers.update(shared)
+        _mark_written(pipe, msg, queries)
+        _queue_results(pipe, msg, uniq_trans_id, results, timers)
+    pipe.execute()
+    timer_stop(shared, '802 redis ack')
+
+    for msg, uniq_trans_id, results, timers, threshes, queries in done:  # pylint: disable=unused-variable
+        timers['802 redis ack'] = shared['802 redis ack']
+        timer_stop(timers, '900 ===TOTAL===')
+        timer_stop(timers, '910 (===WORKER PROCESSING===)')
+        log_timers(timers, threshes)
+
+
+def pull(subscription, max_messages=1):
+    """Pull messages, waiting if there is nothing to pull.
+
+    Returns:
+        List of (ack_id, message, timers) tuples, where timers is a timers
+        dictionary for the message with its pull wait and worker processing
+        timers already started.  Empty if the pull failed.
+    """
+    timers = {}
+    timer_start(timers, '900 ===TOTAL===')
+    timer_start(timers, '910 (===WORKER PROCESSING===)')
+    timer_start(timers, '020 (pull wait)')
+    recv = []
+    try:
+        recv = subscription.pull(return_immediately=False,
+                                 max_messages=max_messages)
+    except Exception, e: # pylint: disable=broad-except
+        recv = []
+        logger.error(str(repr(e)))
+    timer_stop(timers, '020 (pull wait)')
+    return [(ack_id, msg, dict(timers)) for ack_id, msg in recv]
+
+
+def _group(sub, result_redis, batch):  # pylint: disable=too-many-locals
+    """Split pulled messages by the shard they run on, and by whether they
+    can run on one of its replicas.
+
+    Messages whose shard can't be told (not routed by a player) are acked
+    and dropped when there is more than one shard.  When their shard has
+    replicas, messages are loaded here, to tell which are read-only.  Those
+    that fail to load are left for process_message or process_batch to
+    report.
+
+    Returns:
+        List of (shard, replica, messages) tuples, in the order of each
+        group's first message.  replica is True if the messages can run on a
+        replica.  messages are (ack_id, msg, timers, loaded) tuples (see
+        process_batch).
+    """
+    groups = []
+    by_key = {}
+    reads = []  # (index in items, players) of read-only messages
+    items = []  # (shard, (ack_id, msg, timers, loaded))
+    for ack_id, msg, timers in batch:
+        shard = 0
+        if shard_map.count > 1:
+            player_id = sharding.message_player(msg)
+            if player_id is None:
+                logger.error("Can't tell the shard of message %s, removing it from subscription",
+                             msg.attributes)
+                sub.acknowledge([ack_id, ])
+                continue
+            shard = shard_map.shard(player_id)
+        loaded = None
+        if db_replicas and db_replicas[shard]:
             try:
-                recv = sub.pull(return_immediately=False, max_messages=1)
-            except Exception, e: # pylint: disable=broad-except
-                recv = None
-                logger.error(str(repr(e)))
-            timer_stop('020 (pull wait)')
-
-            # Log how long the pull took.
-            if recv:
-
-                try:
-                    # load json message into a dict for easy access
-                    timer_start('050 json_load')
-                    ack_id = msg = None
-                    ack_id, msg = recv[0]
-                    uniq_trans_id = "%s:%s" % (msg.attributes['srv_id'],
-                                               msg.attributes['trans_id'])
-
-                    # This timer is done differently because it was started
-                    # in the originating process
-                    if 'insertion_time' in msg.attributes:
-                        timers['900 ===TOTAL==='] = float(msg.attributes[
-                            'insertion_time'])
-                        timers['010 q wait'] = time() - float(msg.attributes[
-                            'insertion_time'])
-                        if timers['010 q wait'] > cfg['db_con']['timeout']:
-                            # This message is so old, it's client has already considered it
-                            # discarded.  Just trash it and log an error.
-                            logger.error("%s ack, %d secs old",
-                                         uniq_trans_id, timers['010 q wait'])
-                            # ack message receipt
-                            sub.acknowledge([ack_id, ])
-                            continue
-                    logger.debug(msg.data)
-                    json_data = json.loads(msg.data)
-                    timer_stop('050 json_load')
-
-                    results = {'affected': 0}
-
-                    # Get query, and the key under which to return it
-                    num = 100
-                    for query, return_type in json_data['queries']:
-                        try:
-                            if not return_type in results:
-                                results[return_type] = []
-                            query_hash = "%s %s %s %s" % (
-                                str(num), query.split()[0],
-                                str(binascii.crc32(query) & 0xFFFFFFFF),
-                                uniq_trans_id)
-                            timer_start(query_hash)
-                            warning_threshes[query_hash] = warning_threshes[
-                                'sql']
-                            logger.debug("Executing '%s'", query)
-                            try:
-                                cursor.execute(query)
-                                logger.debug("Executed '%s'", query)
-                                for result in cursor.fetchall():
-                                    if result:
-                                        # Add to the message directly
-                                        results[return_type].append(result)
-                            except Exception:
-                                raise
-                            results['affected'] = results['affected'] + int(
-                                cursor.rowcount)
-                            logger.debug("query affected %d rows: '%s'",
-                                         cursor.rowcount, query)
-                            timer_stop(query_hash)
-                            num = num + 1
-                        except mysql.IntegrityError, err:
-                            logger.error("%s", repr(err))
-                            logger.error("%s", query)
-
-                    # commit db transaction
-                    timer_start('800 commit')
-                    con.commit()
-                    timer_stop('800 commit')
-
-                    # ack message receipt
-                    timer_start('801 ack')
+                loaded = _load_message(msg, timers)
+                if loaded is None:
+                    # Too old, its originator has given up on it.
                     sub.acknowledge([ack_id, ])
-                    timer_stop('801 ack')
-
-                    # put results in redis
-                    timer_start('802 redis ack')
-                    # put the timers in results, so the message originator can also access them
-                    results['timers'] = timers
-                    redis.setex(name=uniq_trans_id,
-                                value=json.dumps(results),
-                                time=30)
-                    timer_stop('802 redis ack')
-
-                    timer_stop('900 ===TOTAL===')
-                    timer_stop('910 (===WORKER PROCESSING===)')
-
-                    # log the timers in correct order
-                    for tmr in sorted(timers.keys()):
-                        tmr_msg = "%06.03f - %s" % (timers[tmr], tmr[4:])
-                        if not tmr in warning_threshes:
-                            warning_threshes[tmr] = warning_threshes['default']
-                        if timers[tmr] > warning_threshes[tmr]:
-                            logger.warning(tmr_msg)
-                        else:
-                            logger.info(tmr_msg)
-
-                except Exception:  # pylint: disable=broad-except
-                    logger.error("Unable to process message:")
-                    if recv[0][1]:
-                        logger.error(recv[0][1].data)
-                    logger.error(
-                        "Removing message from subscription and continuing...")
-                    if ack_id:
-                        sub.acknowledge([ack_id, ])
-                    # DEBUG
-                    #raise
-
-                    # outside of timer block: if we didn't get a message, print how long we waited
-            if not recv:
-                so_far = time() - start_time
-                if (so_far - prev_warn) > warning_threshes['default']:
-                    prev_warn = so_far
-                    logger.warning(
-                        "No msg received from %s:%s in %.03f seconds!",
-                        topic.name, sub.name, so_far)
-                sleep(time_to_sleep)
+                    continue
+                statements = group_statements(loaded[1])
+                if _read_only(statements):
+                    reads.append((len(items), _players(msg, statements)))
+            except Exception:  # pylint: disable=broad-except
+                loaded = None
+        items.append((shard, (ack_id, msg, timers, loaded)))
+
+    # Read-only messages go to a replica, unless one of their players wrote
+    # recently.
+    replica = set()
+    if reads:
+        pipe = result_redis.pipeline()
+        for i, players in reads:
+            for player_id in players:
+                pipe.get(_written_key(player_id))
+        marks = iter(pipe.execute())
+        for i, players in reads:
+            if not [mark for mark in [next(marks) for _ in players] if mark]:
+                replica.add(i)
+        with _replica_lock:
+            replica_stats['replica'] += len(replica)
+            replica_stats['stale'] += len(reads) - len(replica)
+
+    for i, (shard, item) in enumerate(items):
+        key = (shard, i in replica)
+        if key not in by_key:
+            by_key[key] = []
+            groups.append(key)
+        by_key[key].append(item)
+    return [(shard, on_replica, by_key[(shard, on_replica)])
+            for shard, on_replica in groups]
+
+
+def _process(pool, replica_pool, sub, result_redis, batch):  # pylint: disable=too-many-arguments
+    """Run pulled messages, one at a time or as a group commit per shard,
+    and per replica or primary."""
+    for shard, replica, group in _group(sub, result_redis, batch):
+        with (replica_pool if replica else pool).connection(shard) as con:
+            if len(group) == 1:
+                process_message(con, sub, result_redis, *group[0],
+                                shard=shard)
             else:
-                start_time = time()
-                prev_warn = 0
+                process_batch(con, sub, result_redis, group, shard)
+
+
+def _check_batch_size(batch_size):
+    """Raise a ValueError if the backend can't commit batch_size messages
+    together: group commit rolls back failed transactions to a savepoint."""
+    if batch_size > 1 and not backend.savepoints:
+        raise ValueError("The %s backend has no savepoints, so can't commit "
+                         "several messages together" % backend.dialect)
+
+
+def run(sub, result_redis, batch_size=1):
+    """Main process loop
+
+    Args:
+        sub: Subscription to pull messages from.
+        result_redis: Redis connection (or transport result store) to put
+            results in.
+        batch_size: Maximum number of messages to pull and commit together
+            (see process_batch).
+
+    Raises:
+        ValueError: batch_size is over 1, and the backend has no savepoints.
+    """
+    _check_batch_size(batch_size)
+    pool = make_pool(1)
+    replica_pool = make_replica_pool(1)
+
+    # Var init
+    time_to_sleep = 0.1
+    start_time = time()
+    prev_warn = 0
+    prev_report = start_time
+
+    # Loop & pull
+    logger.info(
+        "Ready to begin polling %s subscription '%s:%s' for messages",
+        cfg['db_api']['transport'], cfg['pubsub']['topic'], sub.name)
+    while True:
+        recv = pull(sub, max_messages=batch_size)
+        if recv:
+            try:
+                _process(pool, replica_pool, sub, result_redis, recv)
+            except backend.OperationalError, err:
+                logger.error("%s", repr(err))
+                _invalidate_cache()
+            if time() - prev_report > cfg['db_con']['stats_interval']:
+                prev_report = time()
+                if player_cache is not None:
+                    logger.info("player cache: %s", player_cache.report())
+                if replica_pool is not None:
+                    logger.info("read-only transactions: %s", replica_stats)
+
+        # outside of timer block: if we didn't get a message, print how long we waited
+        if not recv:
+            so_far = time() - start_time
+            if (so_far - prev_warn) > WARNING_THRESHES['default']:
+                prev_warn = so_far
+                logger.warning(
+                    "No msg received from %s:%s in %.03f seconds!",
+                    cfg['pubsub']['topic'], sub.name, so_far)
+            sleep(time_to_sleep)
+        else:
+            start_time = time()
+            prev_warn = 0
+
+
+def run_concurrent(concurrency, sub, result_redis, make_subscription,
+                   batch_size=1):
+    """Main process loop, running transactions on several connections at once.
+
+    A single puller thread pulls messages into a bounded queue, in batches of
+    up to 'batch_size' messages, and 'concurrency' executor threads take
+    batches off the queue and run them, each on its own connection from a
+    shared pool.  Executors ack messages through their own subscription
+    object, as the pubsub client isn't thread-safe.
+
+    Args:
+        concurrency: Number of executor threads.
+        sub: Subscription to pull messages from.
+        result_redis: Redis connection (or transport result store) to put
+            results in.  Must be thread-safe.
+        make_subscription: Function returning a new subscription object, for
+            use by an executor thread.
+        batch_size: Maximum number of messages an executor commits together
+            (see process_batch).
+
+    Raises:
+        ValueError: batch_size is over 1, and the backend has no savepoints.
+    """
+    _check_batch_size(batch_size)
+    pool = make_pool(concurrency)
+    replica_pool = make_replica_pool(concurrency)
+    # Keep the queue short: messages sitting in it count against their
+    # pubsub ack deadline.
+    work = Queue.Queue(maxsize=concurrency * 2)
+    # Seconds each executor has spent processing, and messages processed.
+    busy = [0.0] * concurrency
+    processed = [0] * concurrency
+
+    def _puller():
+        """Puller thread: feed messages into the work queue."""
+        while True:
+            recv = pull(sub, max_messages=concurrency * batch_size)
+            for i in range(0, len(recv), batch_size):
+                work.put(recv[i:i + batch_size])
+            if not recv:
+                sleep(0.1)
+
+    def _executor(i):
+        """Executor thread: run messages from the work queue."""
+        my_sub = make_subscription()
+        while True:
+            batch = work.get()
+            started = time()
+            try:
+                _process(pool, replica_pool, my_sub, result_redis, batch)
+            except backend.OperationalError, err:
+                logger.error("%s", repr(err))
+                _invalidate_cache()
+            busy[i] += time() - started
+            processed[i] += len(batch)
+
+    logger.info(
+        "Ready to begin polling %s subscription '%s:%s' with %d executors",
+        cfg['db_api']['transport'], cfg['pubsub']['topic'], sub.name,
+        concurrency)
+    threads = [threading.Thread(target=_puller, name='puller')]
+    threads.extend(threading.Thread(target=_executor, name='executor-%d' % i,
+                                    args=(i, ))
+                   for i in range(concurrency))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    # Report per-executor utilization over each interval.
+    interval = cfg['db_con']['stats_interval']
+    while True:
+        prev_busy = list(busy)
+        prev_processed = list(processed)
+        sleep(interval)
+        for i in range(concurrency):
+            logger.info("executor-%d: %5.1f%% busy, %d msgs",
+                        i, 100 * (busy[i] - prev_busy[i]) / interval,
+                        processed[i] - prev_processed[i])
+        logger.info("queue depth %d, connections opened %d, reconnects %d",
+                    work.qsize(), pool.created, pool.reconnects)
+        if player_cache is not None:
+            logger.info("player cache: %s", player_cache.report())
+        if replica_pool is not None:
+            logger.info("read-only transactions: %s, replica connections opened %d",
+                        replica_stats, replica_pool.created)
 
 
 if __name__ == "__main__":
@@ -313,7 +989,6 @@ if __name__ == "__main__":
     logname = "db_worker"
     logid = logname + '.' + worker_id
     ack_queues = {}
-    timers = {}
 
     # Parse input options
     parser = optparse.OptionParser()
@@ -339,6 +1014,24 @@ if __name__ == "__main__":
                       help='specify log file (default: %default)',
                       dest='log_file',
                       default='%s.log' % logname)
+    parser.add_option('-c',
+                      '--concurrency',
+                      help='number of transactions to run at once, each on its own db connection (default: %default)',
+                      dest='concurrency',
+                      default=1,
+                      type='int')
+    parser.add_option('-b',
+                      '--batch-size',
+                      help='number of transactions to pull and commit together (default: %default)',
+                      dest='batch_size',
+                      default=1,
+                      type='int')
+    parser.add_option('-p',
+                      '--partition',
+                      help='serve only this partition of the players, and cache their rows (needs db_api.route_partitions, default: serve all)',
+                      dest='partition',
+                      default=None,
+                      type='int')
     (options, args) = parser.parse_args()
 
     # Turn off mysql 'table already exists' warnings
@@ -369,12 +1062,7 @@ if __name__ == "__main__":
     logger.addHandler(file_handler)
     logger.info("Initializing for worker %s...", worker_id)
 
-    try:
-        import simplejson as json
-        logger.info("Using simplejson module")
-    except ImportError:
-        import json
-        logger.info("Falling back to json module")
+    logger.info("Using %s module", json.__name__)
 
     if options.debug:
         # Switch to DEBUG logging if specified
@@ -386,60 +1074,59 @@ if __name__ == "__main__":
     # Load mimus config.
     cfg = load_source('mimus_cfg', options.cfg_file).cfg
     logger.info("Loaded config %s", options.cfg_file)
-
-    # Connect to pubsub
-    client = pubsub.Client(project=cfg['gcp']['project'])
-
-    # Get the names of all tables in the db.  All python files in the 'schemas'
-    # directory (except for __init__.py) describe tables in the database.
-    logger.info("Loading database information")
-    CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
-    MODULE_FILES = [filename
-                    for filename in os.listdir(os.path.join(CURRENT_DIR, cfg[
-                        'db_api']['dir'], 'objects'))
-                    if filename.endswith('.py') and not filename.startswith('__')]
-    TABLE_NAMES = [os.path.splitext(filename)[0] for filename in MODULE_FILES]
+    shard_map = sharding.ShardMap.from_cfg(cfg)
+    if shard_map.count > 1:
+        logger.info("Players are sharded across %d databases by %s",
+                    shard_map.count, shard_map.method)
 
     #############################
-    # Timer utils
-    def timer_start(name):
-        """Start timer"""
-        global timers # pylint: disable=global-variable-not-assigned
-        timers[name] = time()
-
-    def timer_stop(name):
-        """Stop timer"""
-        global timers # pylint: disable=global-variable-not-assigned
-        timers[name] = time() - timers[name]
-
-    #############################
-    # CLOUD PUBSUB CONNECTION SETUP
-    # Get topic & subscription
+    # WORK QUEUE CONNECTION SETUP
+    # Get subscription
     logger.info("Initializing for worker %s...", worker_id)
-    topic = client.topic(cfg['pubsub']['topic'])
-    sub = topic.subscription(cfg['pubsub']['sub'])
-    if not topic.exists():
-        topic.create()
-    if not sub.exists():
-        sub.create()
-    logger.info("Connecting to pubsub subscription '%s:%s'...",
-                cfg['pubsub']['topic'], cfg['pubsub']['sub'])
-    # END CLOUD PUBSUB CONNECTION SETUP
+    transport = transports.load(cfg['db_api']['transport'])
+    sub_cfg = cfg
+    if options.batch_size > 1 and not backend.savepoints:
+        parser.error("--batch-size needs savepoints, which the %s backend doesn't have" %
+                     backend.dialect)
+    if options.partition is not None:
+        if not 0 <= options.partition < cfg['db_api']['route_partitions']:
+            parser.error('--partition must be below db_api.route_partitions (%d)' %
+                         cfg['db_api']['route_partitions'])
+        sub_cfg = routing.partition_cfg(cfg, options.partition)
+        if cfg['player_cache']['size']:
+            player_cache = PlayerCache(cfg['player_cache']['size'],
+                                       cfg['player_cache']['verify'])
+            logger.info("Caching up to %d players (verify: %s)",
+                        player_cache.size, player_cache.verify)
+    elif cfg['db_api']['route_partitions']:
+        logger.warning("db_api.route_partitions is set, but no --partition was given")
+    sub = transport.subscription(sub_cfg)
+    logger.info("Connecting to %s subscription '%s:%s'...",
+                cfg['db_api']['transport'], sub_cfg['pubsub']['topic'],
+                sub_cfg['pubsub']['sub'])
+    # END WORK QUEUE CONNECTION SETUP
     #############################
 
     #############################
     # REDIS CONNECTION SETUP
-    # Get topic & subscription
-    redis = StrictRedis(host=cfg['redis_con']['hostname'],
-                        port=cfg['redis_con']['port'], db=cfg['redis_con']['db'],
-                        password=cfg['redis_con']['password'])
-    logger.info("Connecting to redis instance at '%s:%d'",
-                cfg['redis_con']['hostname'], cfg['redis_con']['port'])
+    if hasattr(transport, 'results'):
+        redis = transport.results(cfg)
+        logger.info("Using %s transport result store",
+                    cfg['db_api']['transport'])
+    else:
+        redis = StrictRedis(host=cfg['redis_con']['hostname'],
+                            port=cfg['redis_con']['port'], db=cfg['redis_con']['db'],
+                            password=cfg['redis_con']['password'])
+        logger.info("Connecting to redis instance at '%s:%d'",
+                    cfg['redis_con']['hostname'], cfg['redis_con']['port'])
 
     # END REDIS CONNECTION SETUP
     #############################
 
-    if options.debug:
+    if options.debug and cfg['db_api']['transport'] == 'pubsub':
+        from gcloud import pubsub
+        client = pubsub.Client(project=cfg['gcp']['project'])
+        topic = client.topic(cfg['pubsub']['topic'])
         # Print topic names
         topics, next_page_token = client.list_topics()
         logger.debug([t.name for t in topics])
@@ -447,5 +1134,19 @@ if __name__ == "__main__":
         subs, next_page_token = topic.list_subscriptions()
         logger.debug([s.name for s in subs])
 
+    init_db()
+
+    # Loop & pull
+    if not options.verbose:
+        logger.info("Logging to file %s", options.log_file)
+        logger.removeHandler(verbose_handler)
+    else:
+        logger.info("Logging to screen instead of file")
+        logger.removeHandler(file_handler)
+
     # Start main loop
-    run()
+    if options.concurrency > 1:
+        run_concurrent(options.concurrency, sub, redis,
+                       lambda: transport.subscription(sub_cfg), options.batch_size)
+    else:
+        run(sub, redis, options.batch_size)
@@ -24,10 +24,98 @@ c['gcp']['project'] = os.getenv('GCP_PROJECT', 'joeholley-mimus01')
 # db api parameters (for choosing different db backends)
 c['db_api'] = {}
 c['db_api']['dir'] = 'db_api'
+# Work queue transport, one of the modules in db_api/transports:
+#  'pubsub' - Google Cloud Pub/Sub, with results passed back through Redis
+#  'local'  - in-memory queues, for running clients and db workers as threads
+#             of one process (see mimus_local.py)
+#  'redis_streams' - a Redis Stream on the results Redis instance, consumed
+#             by the db workers as a consumer group (requires Redis >= 6.2)
+#  'inline' - in-memory, with each batch run as it is published, in the
+#             publishing thread (see mimus_sim.py)
+c['db_api']['transport'] = os.getenv('DB_API_TRANSPORT', 'pubsub')
+# How to wait for transaction results:
+#  'push' - db worker pushes results onto a list the server blocks on (BLPOP)
+#  'poll' - db worker sets a key the server polls for with exponential backoff
+c['db_api']['ack_mode'] = os.getenv('DB_API_ACK_MODE', 'push')
+# Seconds the db worker's results stay in Redis if the server never reads them
+# (it times out, or exits).  The server deletes results as it reads them.
+c['db_api']['results_ttl'] = int(os.getenv('DB_API_RESULTS_TTL', '30'))
+# Encoding of batches and results between the server and the db workers:
+#  'json'   - JSON
+#  'binary' - compact binary format (see db_api/wire.py).  Several times
+#             smaller for large results, but more CPU than JSON for small
+#             ones (see benchmarks/bench_wire.py)
+c['db_api']['wire_format'] = os.getenv('DB_API_WIRE_FORMAT', 'json')
+# Have the db worker return rows as the column names and a list of row tuples,
+# instead of a dictionary per row.
+c['db_api']['columnar_results'] = os.getenv('DB_API_COLUMNAR_RESULTS', '1') == '1'
+# Send game actions (play a stage, level/evolve a card, add slots) to the db
+# worker as intents it expands into statements, instead of the statements
+# themselves (see db_api/intents.py).  Off by default: workers that predate
+# intents can't run them.
+c['db_api']['intents'] = os.getenv('DB_API_INTENTS', '0') == '1'
+# Apply the ids/row counts the db worker returns for card changes to the
+# session's cached cards, instead of re-reading the full cardlist after every
+# action.  The full cardlist is still read at login, and whenever the returned
+# counts don't match what the session expected.  Off by default, so the
+# baseline simulation reads the cardlist back after every action, as it always
+# has.
+c['db_api']['delta_responses'] = os.getenv('DB_API_DELTA_RESPONSES', '0') == '1'
+# Sessions in the same process reading player rows or cardlists within this
+# many seconds of each other share one 'WHERE id IN (...)' transaction, of up
+# to read_coalesce_max players (see db_api/coalesce.py).  Each read waits up to
+# the window for others to join it, so 0 (the default) turns it off; load
+# tests with many players per process can set it to e.g. 0.005.
+c['db_api']['read_coalesce_window'] = float(os.getenv('DB_API_READ_COALESCE_WINDOW', '0'))
+c['db_api']['read_coalesce_max'] = 500
+# Split the work queue into this many partitions, and route each player's
+# transactions to one of them by a consistent hash of the player id (see
+# db_api/routing.py).  Run one db worker per partition, with
+# 'db_worker.py --partition K'.  0 (the default) turns routing off.
+c['db_api']['route_partitions'] = int(os.getenv('DB_API_ROUTE_PARTITIONS', '0'))
+
+# Shard players across several databases by player id (see
+# db_api/sharding.py).  The connection parameters of each shard are in
+# db_config.py (DB_SHARD_HOSTS).
+c['db_shards'] = {}
+c['db_shards']['count'] = int(os.getenv('DB_SHARD_COUNT', '1'))
+# 'hash' (player id modulo count) or 'range' (see 'bounds')
+c['db_shards']['method'] = os.getenv('DB_SHARD_METHOD', 'hash')
+# For 'range': comma-separated player ids where each shard after the first
+# starts, e.g. '1431655765,2863311530' for 3 even shards.
+c['db_shards']['bounds'] = [int(bound) for bound in
+                            os.getenv('DB_SHARD_BOUNDS', '').split(',') if bound]
+# Step between the card ids each shard hands out: shard K hands out ids K+1,
+# K+1+id_step, K+1+2*id_step..., so they are unique across up to id_step
+# shards.  Set it to the most shards the deployment will ever have before any
+# card is created, and never change it: adding shards up to it keeps the ids
+# unique, but a new step would hand out ids the old one already has.  1 (the
+# default) allows a single shard.
+c['db_shards']['id_step'] = int(os.getenv('DB_SHARD_ID_STEP', '1'))
+
+# Read replicas of the databases, listed in db_config.py (DB_REPLICA_HOSTS).
+# Db workers run read-only transactions on them.
+c['db_replicas'] = {}
+# For this many seconds after a player's transaction writes, the player's
+# reads still go to the primary, so they see the write even if the replicas
+# lag behind.  Set it above the replicas' worst replication lag.
+c['db_replicas']['staleness'] = int(os.getenv('DB_REPLICA_STALENESS', '5'))
+
+# Db worker cache of player rows and cardlists, used by workers serving a
+# partition (see db_api/player_cache.py).
+c['player_cache'] = {}
+# Maximum number of players cached per worker.  0 turns the cache off.
+c['player_cache']['size'] = int(os.getenv('PLAYER_CACHE_SIZE', '10000'))
+# Also read cache hits from the database, and log any that don't match.
+c['player_cache']['verify'] = os.getenv('PLAYER_CACHE_VERIFY', '0') == '1'
 
 # db connection parameters
 c['db_con'] = {}
 c['db_con']['timeout'] = 30
+# Idle seconds after which a db worker pings a connection before using it
+c['db_con']['ping_interval'] = 10
+# Seconds between db worker executor utilization reports (--concurrency > 1)
+c['db_con']['stats_interval'] = 60
 
 # DB API Cloud Pub/Sub connection parameters
 c['pubsub'] = {}
@@ -43,6 +131,36 @@ redis_host, redis_port = os.getenv(
 c['redis_con']['hostname'] = redis_host
 c['redis_con']['port'] = int(redis_port)
 c['redis_con']['password'] = '9dc1b3ae-584c-434e-b899-da2c8ad093fb'
+# Size of the Redis connection pool shared by all sessions in a client process.
+# In 'push' ack mode each in-flight transaction holds a connection while it
+# waits for results, so this caps the number of concurrent transactions.
+c['redis_con']['max_connections'] = 64
+# Seconds a session waits for a free connection from that pool before giving
+# up with an error.
+c['redis_con']['pool_timeout'] = int(os.getenv('REDIS_POOL_TIMEOUT', '30'))
+
+# Client parameters
+c['client'] = {}
+# Stack size for each simulated player thread when running many players from
+# one process (mimus_client.py --players N).
+c['client']['thread_stack_size'] = 512 * 1024
+# How the client picks cards to level/evolve:
+#  'index' - on sorted indexes of the cards the session keeps up to date
+#            (card_index.py)
+#  'numpy' - on arrays of the cards' id/type/xp (card_view.py), falls back to
+#            'dict' if NumPy isn't installed
+#  'dict'  - directly on the session's dictionary of cards
+# 'index' keeps tied cards in a fixed order between decisions instead of
+# shuffling them, so it is opt-in; 'dict' and 'numpy' break ties at random.
+c['client']['card_engine'] = os.getenv('CLIENT_CARD_ENGINE', 'dict')
+
+# Redis Streams work queue parameters (db_api.transport = 'redis_streams').
+# The stream and consumer group are named after the pubsub topic and sub.
+c['redis_streams'] = {}
+c['redis_streams']['block_ms'] = 1000  # max time a pull waits for messages
+# Messages a worker hasn't acked after this long are claimed by other workers
+c['redis_streams']['claim_idle_ms'] = 10000
+c['redis_streams']['claim_interval'] = 5  # seconds between claim attempts
 
 # Player parameters
 c['player'] = {}
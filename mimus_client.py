@@ -33,11 +33,26 @@ import time
 import optparse
 import binascii
 import socket
+import threading
 
 # Custom modules
 from mimus_cfg import cfg
 from timer import Timer
 import mimus_server
+import db_api.connections as connections
+import db_api.coalesce as coalesce
+import db_api.enqueue as enqueue
+
+# Logging handlers are configured when run as a script.
+logger = logging.getLogger('mimus')
+
+try:
+    from card_view import CardView as NumpyCardView
+except ImportError:
+    NumpyCardView = None
+    if cfg['client']['card_engine'] == 'numpy':
+        logger.warning("NumPy not found, falling back to the dict card engine")
+
 
 def name_to_id(player_name):
     """convert player name to id"""
@@ -72,7 +87,7 @@ def evaluate_cards(cards):
     return card_attrs
 
 
-def try_server_call(partial_function):
+def try_server_call(partial_function, player_id):
     """
     Simple server call wrapper function.
     - Take a functools.partial object with the function to call and arguments populated.
@@ -83,8 +98,7 @@ def try_server_call(partial_function):
             results = partial_function()
         except Exception, err:
             logger.critical(
-                "User '%s' (id: %s) failed to get response from server.",
-                name, name_to_id(name))
+                "Player id %s failed to get response from server.", player_id)
             logger.critical("Function call: %s(%s)",
                             str(partial_function.func).split()[2], None)
             logger.critical("Error: %s", repr(err))
@@ -245,11 +259,47 @@ def get_evolving_args(cards, card_attrs):
 
     return False
 
-def run():
-    """Main function"""
 
-    # Request session on the server
-    session = mimus_server.Session(name_to_id(name))
+class DictCardView(object):
+    """Card decisions made directly on the session's dictionary of cards.
+
+    Same interface as card_view.CardView, the NumPy implementation.
+    """
+
+    def __init__(self, cards, xp_limit):  # pylint: disable=unused-argument
+        # xp_limit is read from cfg by attributes()
+        self.cards = cards
+        self.card_attrs = evaluate_cards(cards)
+
+    def leveling_args(self, level_cfg):  # pylint: disable=unused-argument
+        """See get_leveling_args."""
+        return get_leveling_args(self.cards, self.card_attrs)
+
+    def evolving_args(self, level_cfg):  # pylint: disable=unused-argument
+        """See get_evolving_args."""
+        return get_evolving_args(self.cards, self.card_attrs)
+
+
+def card_view(session):
+    """Return a view of the session's cards for the configured card engine."""
+    if cfg['client']['card_engine'] == 'index':
+        return session.card_index
+    if cfg['client']['card_engine'] == 'numpy' and NumpyCardView:
+        return NumpyCardView(session.cards, cfg['card']['xp_limit'])
+    return DictCardView(session.cards, cfg['card']['xp_limit'])
+
+
+def play(session):
+    """
+    Player decision loop for a single session.
+
+    This is a generator: each time the player takes an action it yields the
+    number of seconds the player still has to 'think' (animations, gameplay,
+    etc) before taking the next action.  The caller decides how that time is
+    spent - run() sleeps, run_players() lets other players run in the
+    meantime.  The generator returns when the player is out of stamina and
+    has no cards left to level or evolve.
+    """
 
     # Set player stamina. For simplicity, always simulate player starting
     # the session with full stamina.
@@ -274,10 +324,10 @@ def run():
             server_method = partial(session.play_stage)
             stamina = stamina - 1
         else:
-            card_attrs = evaluate_cards(session.cards)
+            cards = card_view(session)
 
             # Check to see if we can perform an action on a card.
-            leveling_args = get_leveling_args(session.cards, card_attrs)
+            leveling_args = cards.leveling_args(cfg['level'])
             if leveling_args:
                 # If there are more cards that can be leveled than evolved, favor leveling.
                 action = 'level'
@@ -285,7 +335,7 @@ def run():
                 server_method = partial(session.level_card, *leveling_args)
             else:
                 # See if we can evolve a card.
-                evolving_args = get_evolving_args(session.cards, card_attrs)
+                evolving_args = cards.evolving_args(cfg['level'])
                 if evolving_args:
                     action = 'evolve'
                     # Leverage functools.partial to set up the method we want to call.
@@ -298,14 +348,14 @@ def run():
         if action:
             logger.debug(" Attempting action: %s", action)
             with Timer() as server_results_timer:
-                results = try_server_call(server_method)
+                results = try_server_call(server_method, session.session_id)
             # Print results
             if not results:
                 result = "FAILED"
 
             logger.info("%10s action %6s (%d/%d stamina remaining)",
                         result, action, stamina, session.player['stamina'])
-            # Sleep for the proscribed time, minus how long we've already waited for
+            # Wait for the proscribed time, minus how long we've already waited for
             # the server to return results.
             # This is to simulate something client-side that takes time (animations, gameplay, etc)
             required_wait_time = randint(cfg[action]['min_time'],
@@ -317,12 +367,75 @@ def run():
             if additional_sleep_time > 0:
                 logger.debug("---(sleeping for %5.02f/%5.02f)---",
                              additional_sleep_time, required_wait_time)
-                time.sleep(additional_sleep_time)
+                yield additional_sleep_time
         else:
             # No action determined! Just sleep. (Shouldn't happen unless debugging)
-            time.sleep(1)
+            yield 1
     logger.info("Stamina exhausted.  Exiting.")
 
+
+def run(player_name):
+    """Play a single player's session to completion."""
+
+    # Request session on the server
+    session = mimus_server.Session(name_to_id(player_name))
+    for think_time in play(session):
+        time.sleep(think_time)
+    logger.debug("DB API connections: %s", connections.stats())
+    logger.debug("DB API ack latency: %s", enqueue.ack_latency_report())
+
+
+def run_players(player_names, ramp_up=0):
+    """
+    Play many players' sessions concurrently from this one process.
+
+    Each player gets its own lightweight thread (named after the player, so it
+    shows up in the logs) running the same decision loop as run().  Threads
+    spend nearly all of their time either sleeping through think time or
+    blocked on the DB API, so a single process can drive thousands of them.
+
+    Args:
+        player_names: List of player names to simulate.
+        ramp_up: Seconds over which to spread the player logins, so the
+            backend doesn't see every session start at the same instant.
+    """
+    # The default thread stack size is far larger than the decision loop
+    # needs, and dominates memory use with thousands of players.
+    threading.stack_size(cfg['client']['thread_stack_size'])
+
+    def _player(player_name, delay):
+        """Thread body: wait for our login slot, then play."""
+        time.sleep(delay)
+        try:
+            run(player_name)
+        except Exception, err:  # pylint: disable=broad-except
+            logger.critical("Player '%s' exited with error: %s",
+                            player_name, repr(err))
+
+    started = time.time()
+    threads = []
+    for i, player_name in enumerate(player_names):
+        delay = ramp_up * i / float(len(player_names))
+        t = threading.Thread(target=_player, name=player_name,
+                             args=(player_name, delay))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    logger.info("Started %d players", len(threads))
+
+    # Poll rather than join() so the main thread still responds to Ctrl-C.
+    while any(t.is_alive() for t in threads):
+        time.sleep(1)
+    logger.info("All players finished.")
+    elapsed = time.time() - started
+    logger.info("DB API connections: %s", connections.stats())
+    if coalesce.stats():
+        logger.info("DB API coalesced reads: %s", coalesce.stats())
+    for mode, latency in enqueue.ack_latency_report().iteritems():
+        logger.info("DB API %s ack latency: p50 %.03f p99 %.03f (%d transactions, %.1f/s)",
+                    mode, latency['p50'], latency['p99'], latency['total'],
+                    latency['total'] / elapsed)
+
 # Run main loop.
 if __name__ == "__main__":
 
@@ -346,18 +459,35 @@ if __name__ == "__main__":
                       dest='quiet',
                       default=False,
                       action='store_true')
+    parser.add_option('-n',
+                      '--players',
+                      help='number of players to simulate from this process, named <player_name>0..N-1 (default: %default)',
+                      dest='players',
+                      default=1,
+                      type='int')
+    parser.add_option('-r',
+                      '--ramp-up',
+                      help='seconds over which to spread player logins when simulating multiple players (default: %default)',
+                      dest='ramp_up',
+                      default=0,
+                      type='float')
     (options, args) = parser.parse_args()
     name = args[0]
 
     # Set up logging to stdout.
     logname = "mimus"
-    player_id = "%s.%s" % (name, name_to_id(name))
-    logid = "%s:%s" % (socket.gethostname(), player_id)
+    player_id = log_tag = "%s.%s" % (name, name_to_id(name))
+    logid = '%40s' % ("%s:%s" % (socket.gethostname(), log_tag))
+    quiet_tag = '%18s' % log_tag
+    if options.players > 1:
+        # Many players share this process; tag each line with the player's
+        # thread instead, padded when the record is formatted.
+        logid = '%s:%%(threadName)-25s' % socket.gethostname()
+        quiet_tag = '%(threadName)18s'
     logger = logging.getLogger(logname)
-    cl_format = ('%40s' % logid) + ' - %(name)-15s - %(message)s'
+    cl_format = logid + ' - %(name)-15s - %(message)s'
     stdout_format = logging.Formatter('%(asctime)s - %(levelname)8s ' + cl_format)
-    quiet_format = logging.Formatter(('%18s' % player_id) +
-                                     ' - %(name)-15s - %(message)s')
+    quiet_format = logging.Formatter(quiet_tag + ' - %(name)-15s - %(message)s')
     if options.quiet:
         stdout_format = quiet_format
     handler = logging.StreamHandler(sys.stdout)
@@ -395,4 +525,8 @@ if __name__ == "__main__":
             " Quiet(-ish) logging selected, only warning or above will be logged to stdout.")
         handler.setLevel(logging.WARNING)
 
-    run()
+    if options.players > 1:
+        run_players(['%s%d' % (name, i) for i in range(options.players)],
+                    options.ramp_up)
+    else:
+        run(name)
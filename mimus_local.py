@@ -0,0 +1,118 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Runs the whole client -> server -> DB API -> db worker pipeline as threads of
+# a single process, using the in-memory 'local' transport instead of Cloud
+# Pub/Sub and Redis.  Only the database is external.  Comparing the timers and
+# ack latencies from this against a cloud deployment separates the
+# framework's own overhead from network and cloud service latency.
+#
+# pylint: disable=invalid-name,line-too-long
+"""Single-process mimus load test over the local transport."""
+from __future__ import with_statement
+import logging
+import optparse
+import sys
+import threading
+import warnings
+
+# Custom modules
+from mimus_cfg import cfg
+
+
+def main():
+    """Start the db workers, then play all players to completion."""
+    parser = optparse.OptionParser(usage='%prog [options] <player_name>')
+    parser.add_option('-n',
+                      '--players',
+                      help='number of players to simulate, named <player_name>0..N-1 (default: %default)',
+                      dest='players',
+                      default=10,
+                      type='int')
+    parser.add_option('-r',
+                      '--ramp-up',
+                      help='seconds over which to spread player logins (default: %default)',
+                      dest='ramp_up',
+                      default=0,
+                      type='float')
+    parser.add_option('-c',
+                      '--concurrency',
+                      help='number of db worker executor threads (default: %default)',
+                      dest='concurrency',
+                      default=4,
+                      type='int')
+    parser.add_option('-b',
+                      '--batch-size',
+                      help='number of transactions each db worker executor commits together (default: %default)',
+                      dest='batch_size',
+                      default=1,
+                      type='int')
+    parser.add_option('-d',
+                      '--debug',
+                      help='turn on debug output (default:off)',
+                      dest='debug',
+                      default=False,
+                      action='store_true')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('player_name is required')
+    name = args[0]
+
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.DEBUG if options.debug else logging.INFO,
+        format='%(asctime)s - %(levelname)8s - %(threadName)18s - %(name)-15s - %(message)s')
+    # Turn off mysql 'table already exists' warnings
+    warnings.filterwarnings('ignore')
+
+    # Everything must use the in-memory transport, so select it before any
+    # connections are made.
+    cfg['db_api']['transport'] = 'local'
+    import db_api.transports.local as local
+    import db_worker
+    import mimus_client
+
+    if options.batch_size > 1 and not db_worker.backend.savepoints:
+        parser.error("--batch-size needs savepoints, which the %s backend doesn't have" %
+                     db_worker.backend.dialect)
+    db_worker.init_db()
+    # With routing on, run a worker per partition.  They all share this
+    # process' player cache, as they are the only workers.
+    worker_cfgs = [cfg]
+    if cfg['db_api']['route_partitions']:
+        import db_api.routing as routing
+        from db_api.player_cache import PlayerCache
+        worker_cfgs = [routing.partition_cfg(cfg, partition)
+                       for partition in range(cfg['db_api']['route_partitions'])]
+        if cfg['player_cache']['size']:
+            db_worker.player_cache = PlayerCache(cfg['player_cache']['size'],
+                                                 cfg['player_cache']['verify'])
+    for num, worker_cfg in enumerate(worker_cfgs):
+        worker = threading.Thread(
+            target=db_worker.run_concurrent, name='db_worker-%d' % num,
+            args=(options.concurrency, local.subscription(worker_cfg),
+                  local.results(cfg),
+                  lambda worker_cfg=worker_cfg: local.subscription(worker_cfg),
+                  options.batch_size))
+        worker.daemon = True
+        worker.start()
+
+    # Logs ack latencies when all players are done.
+    mimus_client.run_players(['%s%d' % (name, i) for i in range(options.players)],
+                             options.ramp_up)
+
+
+if __name__ == "__main__":
+    main()
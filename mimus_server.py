@@ -16,8 +16,6 @@
 """Server API."""
 from __future__ import with_statement
 from pprint import pformat
-from redis import StrictRedis
-from gcloud import pubsub
 import uuid
 import logging
 import random
@@ -30,6 +28,10 @@ logger = logging.getLogger(logname)
 import db_api.objects.card as card
 import db_api.objects.player as player
 import db_api.enqueue as enqueue
+import db_api.intents as intents
+import db_api.connections as connections
+import db_api.coalesce as coalesce
+from card_index import CardIndex
 from mimus_cfg import cfg
 
 
@@ -40,7 +42,9 @@ class Session(object):
     General strategy of each of the public methods:
       - Validate the client can take the requested action (if necessary)
       - Make a transaction (list of DB API queries) that should all run to
-        completion to update the database and get the latest results of the action
+        completion to update the database and get the latest results of the action.
+        With cfg['db_api']['intents'] on, game actions are sent as a single
+        intent the DB worker expands into those queries instead.
       - Generate a unique transaction ID.  Currently only used by the DB API to
         track completion of the transaction, but in the future could also be used
         by the server to look up past results or track reasons for transaction failure.
@@ -50,51 +54,57 @@ class Session(object):
       - Return result to the client.
 
     Attributes:
-       log: log file handle.
+       log: log file handle (shared by all sessions in this process).
        cfg: configuration dictionary (typically read from mimus_cfg.py)
        session_id: an alias for player_id.
-       workq: Google Cloud Pub/Sub topic to place db work into.
-       redis: Redis connection to read db results from.
+       workq: Google Cloud Pub/Sub topic to place db work into (shared by all
+           sessions in this process).
+       redis: Redis connection to read db results from (backed by a connection
+           pool shared by all sessions in this process).
        player: Local cache copy of the player row from the db.
-       cards: Local cache copy of the player's cards from the db.
+       cards: Local cache copy of the player's cards from the db.  With
+           cfg['db_api']['delta_responses'] on, this is read in full at login
+           and then kept up to date from the changes each action reports.
+       card_index: Sorted indexes of the cached cards, kept up to date with
+           them, for the client's card decisions.  None unless
+           cfg['client']['card_engine'] is 'index'.
+       coalescer: Process-wide coalescer for player and cardlist reads, or
+           None if read coalescing is turned off.
     """
 
     def __init__(self, player_id):
         """Initialize session object.
 
-        Sets up DB API connections to Redis and Pub/Sub for this session, and
-        does initial fetch of player and cards from the database.
+        Borrows the process-wide DB API connections to Redis and Pub/Sub for
+        this session, and does initial fetch of player and cards from the
+        database.
 
         Args:
             player_id: Hashed player name.
         """
         # Logging and configuration
-        self.log = open('backend_issues.log', 'a+')
         self.cfg = cfg
+        self.log = connections.get_log(self.cfg)
         self.session_id = player_id
 
-        # Connect to DB API Cloud Pub/Sub and Redis
+        # Borrow the shared DB API Cloud Pub/Sub and Redis connections
         logger.info("Connecting to DB API...")
-        client = pubsub.Client(project=self.cfg['gcp']['project'])
-        logger.info("Connecting: DB API pubsub topic '%s'",
-                    self.cfg['pubsub']['topic'])
-        self.workq = client.topic(self.cfg['pubsub']['topic'])
-        logger.info("Connecting: DB API Redis instance at '%s:%s'",
-            self.cfg['redis_con']['hostname'], self.cfg['redis_con']['port'])
-        self.redis = StrictRedis(host=self.cfg['redis_con']['hostname'],
-                                 port=self.cfg['redis_con']['port'],
-                                 db=self.cfg['redis_con']['db'],
-                                 password=self.cfg['redis_con']['password'])
+        self.workq = connections.get_workq(self.cfg)
+        self.redis = connections.get_redis(self.cfg)
+        self.coalescer = coalesce.get(self.cfg)
 
         # Initialize attributes to empty
         self.player = None
         self.cards = {}
+        self.card_index = None
+        if self.cfg['client']['card_engine'] == 'index':
+            self.card_index = CardIndex(self.cfg['card']['xp_limit'])
 
         # Attempt to get initial attribute values from DB
         self._get_player(player_id)
         self._get_cards()
 
-    def _execute_db_transaction(self, trans_id, transaction):
+    def _execute_db_transaction(self, trans_id, transaction, delta=None):
         """Runs a prepared transaction against the database.
 
         Attempts to update session object attributes (self.player, self.cards,
@@ -102,7 +112,14 @@ class Session(object):
 
         Args:
             trans_id: The transaction ID.
-            transaction: The list of queries that make up this transaction.
+            transaction: The list of queries that make up this transaction,
+                or its intent (see db_api/intents.py).
+            delta: (optional) Dictionary of the card changes the transaction
+                makes, for transactions that don't re-read the cardlist:
+                'consumed': list of ids of the cards it consumes,
+                'created': list of the types of the cards it creates,
+                'changed': list of ids of the cards it re-reads.
+                See _apply_card_delta.
 
         Returns:
             If the transaction succeeds: number of rows affected.
@@ -117,19 +134,103 @@ class Session(object):
                                      worker_q=self.workq,
                                      ack_redis=self.redis,
                                      srv_id=self.session_id,
-                                     log=self.log)
+                                     log=self.log,
+                                     ack_mode=self.cfg['db_api']['ack_mode'],
+                                     timeout=self.cfg['db_con']['timeout'],
+                                     wire_format=self.cfg['db_api']['wire_format'],
+                                     columnar=self.cfg['db_api']['columnar_results'])
+        return self._apply_results(data, delta)
+
+    def _read(self, kind, player_id):
+        """Runs a read of the player row or cardlist against the database,
+        together with other sessions' reads if read coalescing is on.
+
+        Args:
+            kind: 'player' or 'cardlist', see db_api.coalesce.READS.
+            player_id: Hashed player name.
+
+        Returns:
+            Same as _execute_db_transaction.
+        """
+        if self.coalescer:
+            return self._apply_results(self.coalescer.read(kind, player_id))
+        trans_id = str(uuid.uuid4())
+        transaction = coalesce.READS[kind][0]([player_id])
+        return self._execute_db_transaction(trans_id, transaction)
+
+    def _apply_results(self, data, delta=None):
+        """Updates session object attributes with transaction results.
+
+        Args:
+            data: The transaction results, or False if it failed.
+            delta: (optional) See _execute_db_transaction.
+
+        Returns:
+            Same as _execute_db_transaction.
+        """
         # Look through the results for updates to the session.cards or session.player
         if data:
-            if 'cardlist' in data and data['cardlist']:
-                self.cards = {card['id']: card for card in data['cardlist']}
-            if 'player' in data and data['player']:
-                self.player = data['player'][0]
+            cardlist = enqueue.result_rows(data, 'cardlist')
+            if cardlist:
+                self.cards = {card['id']: card for card in cardlist}
+                if self.card_index is not None:
+                    self.card_index.reset(self.cards)
+            elif delta is not None and not self._apply_card_delta(data, **delta):
+                logger.warning("Card changes for player %d didn't match the transaction, re-reading cardlist",
+                               self.session_id)
+                self._get_cards()
+            players = enqueue.result_rows(data, 'player')
+            if players:
+                self.player = players[0]
             return data['affected']
 
         # Explicitly return false if no data was returned from the database -
         # something went wrong.
         return False
 
+    def _apply_card_delta(self, data, consumed=(), created=(), changed=()):
+        """Apply the card changes a transaction reported to self.cards.
+
+        Relies on the ids of the cards created by one multi-row INSERT being
+        evenly spaced, 'id_step' apart (consecutive unless the worker
+        interleaves the ids of several shards), which MySQL guarantees for a
+        single-statement insert of a known number of rows with
+        innodb_autoinc_lock_mode 0 or 1.  Turn delta_responses off otherwise.
+
+        Args:
+            data: The transaction results.
+            consumed: Ids of the cards the transaction consumed.
+            created: Types of the cards the transaction created, in insert
+                order.
+            changed: Ids of the cards the transaction re-read.
+
+        Returns:
+            True if the changes were applied, False if the results don't
+            match the expected changes (self.cards is left untouched).
+        """
+        if sum(r['rowcount'] for r in data.get('consumed', [])) != len(set(consumed)):
+            return False
+        inserted = data.get('inserted', [])
+        if created and (len(inserted) != 1 or
+                        inserted[0]['rowcount'] != len(created)):
+            return False
+        changed_rows = enqueue.result_rows(data, 'cardchanges')
+        if sorted(row['id'] for row in changed_rows) != sorted(changed):
+            return False
+
+        new_rows = [card.new_row(self.player['id'], card_type,
+                                 inserted[0]['first_id'] +
+                                 offset * inserted[0].get('id_step', 1))
+                    for offset, card_type in enumerate(created)]
+        for card_id in consumed:
+            self.cards.pop(card_id, None)
+        for row in new_rows + changed_rows:
+            self.cards[row['id']] = row
+        if self.card_index is not None:
+            self.card_index.update(removed=consumed,
+                                   changed=new_rows + changed_rows)
+        return True
+
     def _get_player(self, player_id):
         """Build and execute DB API transaction to retrieve the player row.
 
@@ -153,12 +254,10 @@ class Session(object):
 
         # Var init
         self.player = None
-        trans_id = str(uuid.uuid4())
 
-        transaction = player.get(player_id)
         # Since a query that returns no rows will return a 0, explicitly check for
         # the False keyword value
-        if self._execute_db_transaction(trans_id, transaction) is not False:
+        if self._read('player', player_id) is not False:
             logger.debug("Printing player! %s", self.player)
             if self.player:
                 return True
@@ -167,15 +266,16 @@ class Session(object):
                 trans_id = str(uuid.uuid4())  # Generate a new transaction ID
                 transaction = player.create(player_id, cfg)
 
-                # Get queries to make the specified number of each kind of card,
+                # Get a query to make the specified number of each kind of card,
                 # defined in the config file.
                 initial_cards = self.cfg['player']['initial_cards']
+                card_types = []
                 for loot_type in initial_cards:
                     for i in range(initial_cards[loot_type]):  # pylint: disable=unused-variable
-                        card_type = random.randint(
+                        card_types.append(random.randint(
                             self.cfg['loot_tables'][loot_type]['min'],
-                            self.cfg['loot_tables'][loot_type]['max'])
-                        transaction.extend(card.create(player_id, card_type))
+                            self.cfg['loot_tables'][loot_type]['max']))
+                transaction.extend(card.create_many(player_id, card_types))
 
                 logger.info("Creating initial cards for player '%d'",
                             player_id)
@@ -202,9 +302,7 @@ class Session(object):
         Raises:
             RuntimeError: There was an issue retrieving the cards from the db.
         """
-        trans_id = str(uuid.uuid4())
-        transaction = card.get_all(self.player['id'])
-        results = self._execute_db_transaction(trans_id, transaction)
+        results = self._read('cardlist', self.player['id'])
         # Since a query that returns no rows will return a 0, explicitly check for
         # the False keyword value
         if results is False:
@@ -231,10 +329,22 @@ class Session(object):
             RuntimeError: There was an issue with the database transaction
                 required to level the card.
         """
-        transaction = card.combine(self.cards[dest_id], cards_to_consume)
-        transaction.extend(card.get_all(self.player['id']))
+        delta = None
+        if self.cfg['db_api']['delta_responses']:
+            delta = {'consumed': cards_to_consume, 'changed': [dest_id]}
+        if self.cfg['db_api']['intents']:
+            transaction = intents.level_card(self.player['id'],
+                                             self.cards[dest_id],
+                                             cards_to_consume,
+                                             cardlist=delta is None)
+        else:
+            transaction = card.combine(self.cards[dest_id], cards_to_consume)
+            if delta is not None:
+                transaction.extend(card.get([dest_id]))
+            else:
+                transaction.extend(card.get_all(self.player['id']))
         trans_id = str(uuid.uuid4())
-        results = self._execute_db_transaction(trans_id, transaction)
+        results = self._execute_db_transaction(trans_id, transaction, delta)
         # Since a database transaction that returns no rows will return a 0,
         # explicitly check for the False keyword value
         if results is False:
@@ -264,10 +374,22 @@ class Session(object):
             RuntimeError: There was an issue with the database transaction
                 required to evolve the card.
         """
-        transaction = card.evolve(self.cards[dest_id], cards_to_consume)
-        transaction.extend(card.get_all(self.player['id']))
+        delta = None
+        if self.cfg['db_api']['delta_responses']:
+            delta = {'consumed': cards_to_consume, 'changed': [dest_id]}
+        if self.cfg['db_api']['intents']:
+            transaction = intents.evolve_card(self.player['id'],
+                                              self.cards[dest_id],
+                                              cards_to_consume,
+                                              cardlist=delta is None)
+        else:
+            transaction = card.evolve(self.cards[dest_id], cards_to_consume)
+            if delta is not None:
+                transaction.extend(card.get([dest_id]))
+            else:
+                transaction.extend(card.get_all(self.player['id']))
         trans_id = str(uuid.uuid4())
-        results = self._execute_db_transaction(trans_id, transaction)
+        results = self._execute_db_transaction(trans_id, transaction, delta)
         # Since a query that returns no rows will return a 0, explicitly check for
         # the False keyword value
         if results is False:
@@ -303,12 +425,13 @@ class Session(object):
         num_rounds = 5  # rounds in this level
 
         transaction = []
+        drops = []
         # Test to see if the player failed the stage
         if random.random() <= self.cfg['stage']['failure_chance']:
 
             # Roll for card drops
             for i in range(num_rounds):
-                if (len(self.cards) + len(transaction)) < self.player['slots']:
+                if (len(self.cards) + len(drops)) < self.player['slots']:
                     #logger.debug(" Playing round %d" % i)
                     card_type = None
                     # Roll d100
@@ -318,8 +441,7 @@ class Session(object):
                         # random for now
                         card_type = random.randint(loot_table['min'],
                                                    loot_table['max'])
-                        transaction.extend(card.create(self.player['id'],
-                                                       card_type))
+                        drops.append(card_type)
                     loot_msg = " Round %2d: Rolled %.2f/%.2f for player %d, dropped card %s"
                     logger.info(loot_msg, i, roll, loot_table['drop_chance'],
                                             self.player['id'], str(card_type))
@@ -328,28 +450,41 @@ class Session(object):
                     logger.warning(full_msg, self.player['id'])
                     break
             logger.info(" Player completed stage - %2d loot cards acquired.",
-                        len(transaction))
+                        len(drops))
 
             # Assume player took a friend along, give them friend points
-            updated_player = self.player.copy()
-            updated_player['points'] = self.player['points'] + self.cfg[
-                'stage']['points_per_run']
-            # Test that query generation is successful. Necessary as query generation
-            # will fail if, for example, the player already has max friend points
-            update_player_query = player.update(updated_player)
-            if update_player_query:
-                transaction.extend(update_player_query)
+            points = self.player['points'] + self.cfg['stage']['points_per_run']
+            delta = None
+            if self.cfg['db_api']['delta_responses']:
+                delta = {'created': drops}
+
+            if self.cfg['db_api']['intents']:
+                transaction = intents.play_stage(self.player['id'], drops,
+                                                 points, cardlist=delta is None)
             else:
-                logger.error(
-                    "Unable to update player! (continuing without update!)")
+                # All the drops are created with a single multi-row insert.
+                transaction.extend(card.create_many(self.player['id'], drops))
+
+                updated_player = self.player.copy()
+                updated_player['points'] = points
+                # Test that query generation is successful. Necessary as query generation
+                # will fail if, for example, the player already has max friend points
+                update_player_query = player.update(updated_player)
+                if update_player_query:
+                    transaction.extend(update_player_query)
+                else:
+                    logger.error(
+                        "Unable to update player! (continuing without update!)")
 
-            # After updates, get the latest player/cardlist
-            transaction.extend(player.get(self.player['id']))
-            transaction.extend(card.get_all(self.player['id']))
+                # After updates, get the latest player/cardlist (or, with delta
+                # responses, just the ids of the dropped cards)
+                transaction.extend(player.get(self.player['id']))
+                if delta is None:
+                    transaction.extend(card.get_all(self.player['id']))
 
             # Run transaction
             trans_id = str(uuid.uuid4())
-            results = self._execute_db_transaction(trans_id, transaction)
+            results = self._execute_db_transaction(trans_id, transaction, delta)
 
             # Since a query that returns no rows will return a 0, explicitly check for
             # the False keyword value
@@ -387,15 +522,19 @@ class Session(object):
         # will fail if, for example, the player already has max slots
         updated_player = self.player
         updated_player['slots'] = self.player['slots'] + num_slots
-        update_player_query = player.update(updated_player)
-        if update_player_query:
-            transaction.extend(update_player_query)
+        if self.cfg['db_api']['intents']:
+            transaction = intents.add_slots(self.player['id'],
+                                            updated_player['slots'])
         else:
-            logger.error(
-                "Unable to update player! (continuing without update!)")
+            update_player_query = player.update(updated_player)
+            if update_player_query:
+                transaction.extend(update_player_query)
+            else:
+                logger.error(
+                    "Unable to update player! (continuing without update!)")
 
-        # Get player after updating slots
-        transaction.extend(player.get(self.player['id']))
+            # Get player after updating slots
+            transaction.extend(player.get(self.player['id']))
 
         # Run transaction
         trans_id = str(uuid.uuid4())
@@ -0,0 +1,289 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Time-compressed discrete-event simulation of many players.  The same client
+# decision loop (mimus_client.play) and server Session used by the load test
+# drive a db worker over the synchronous inline transport, but the think time
+# the client yields between actions is spent on a virtual clock: a priority
+# queue of (virtual time, player) events is processed in order, and the clock
+# jumps straight to the next event.  A one hour play session takes as long as
+# its database statements do.
+#
+# When a player's session ends (out of stamina and nothing left to level or
+# evolve), they log in again for a new session after --session-gap virtual
+# seconds.
+#
+# At the end it reports the statements run against the database per
+# simulated player-hour, and a snapshot of the players' economy.
+#
+# Everything runs in one thread, so this measures economy and DB write
+# patterns, not backend concurrency; use mimus_local.py or the full pipeline
+# for that.
+#
+# Usage: python mimus_sim.py [options] <player_name>
+#
+# pylint: disable=invalid-name,line-too-long
+"""Discrete-event mimus simulation on a virtual clock."""
+from __future__ import with_statement
+from collections import defaultdict
+from itertools import count
+import heapq
+import logging
+import optparse
+import random
+import sys
+import warnings
+
+from mimus_cfg import cfg
+from timer import Timer
+
+
+class Scheduler(object):
+    """Runs events in virtual time order.
+
+    Attributes:
+        now: The current virtual time, in seconds since the start of the
+            simulation.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self._events = []
+        # Tie-breaker, so events at the same time run in scheduling order and
+        # the actions themselves are never compared.
+        self._seq = count()
+
+    def schedule(self, delay, action):
+        """Run action() delay virtual seconds from now."""
+        heapq.heappush(self._events, (self.now + delay, next(self._seq), action))
+
+    def run(self, until):
+        """Run events in order until there are none left before 'until'.
+
+        Returns:
+            Number of events run.
+        """
+        events = 0
+        while self._events and self._events[0][0] <= until:
+            self.now, seq, action = heapq.heappop(self._events)  # pylint: disable=unused-variable
+            action()
+            events += 1
+        self.now = until
+        return events
+
+
+def _statement_key(query):
+    """Return 'VERB table' for a SQL statement."""
+    words = query.split()
+    table = '?'
+    for i, word in enumerate(words[:-1]):
+        if word.upper() in ('INTO', 'FROM', 'UPDATE'):
+            table = words[i + 1]
+            break
+    return '%s %s' % (words[0].upper(), table)
+
+
+class Simulation(object):
+    """Players on a virtual clock, backed by an inline db worker.
+
+    Attributes:
+        clock: The Scheduler driving the simulation.
+        statements: Number of statements run, keyed by 'VERB table'.
+        transactions: Number of transactions run.
+        sessions: Number of player sessions started.
+        actions: Number of player actions taken.
+        session_time: Total virtual seconds spent in finished sessions.
+        players: Latest Session of each player, keyed by player name.
+    """
+
+    def __init__(self, session_gap):
+        # Imported here so they pick up the inline transport selected by
+        # main().
+        import db_api.transports.inline as inline
+        import db_api.intents as intents
+        import db_api.sharding as sharding
+        import db_worker
+        import mimus_client
+        import mimus_server
+        self._client = mimus_client
+        self._server = mimus_server
+
+        self.clock = Scheduler()
+        self.session_gap = session_gap
+        self.statements = defaultdict(int)
+        self.transactions = 0
+        self.sessions = 0
+        self.actions = 0
+        self.session_time = 0.0
+        self.players = {}
+        self._session_start = {}  # player name -> start of current session
+
+        db_worker.init_db()
+        cons = [db_worker.connect(shard)
+                for shard in range(db_worker.shard_map.count)]
+        for shard, con in enumerate(cons):
+            db_worker.setup_connection(con, shard)
+        sub = inline.subscription(cfg)
+        result_store = inline.results(cfg)
+
+        def _run_batch():
+            """Run the batch that was just published."""
+            for ack_id, msg, timers in db_worker.pull(sub):
+                self.transactions += 1
+                queries = intents.load_queries(msg)
+                for statement in db_worker.group_statements(queries):
+                    self.statements[_statement_key(statement[1])] += 1
+                shard = db_worker.shard_map.shard(sharding.message_player(msg))
+                db_worker.process_message(cons[shard], sub, result_store,
+                                          ack_id, msg, timers, shard=shard)
+        inline.set_handler(_run_batch)
+
+    def login(self, player_name):
+        """Start a session for the player, and schedule its first action."""
+        session = self._server.Session(self._client.name_to_id(player_name))
+        self.players[player_name] = session
+        self.sessions += 1
+        self._session_start[player_name] = self.clock.now
+        self._step(player_name, self._client.play(session))
+
+    def _step(self, player_name, actions):
+        """Take the player's next action, then schedule the one after it for
+        when its think time has passed, or the player's next login if the
+        session is over."""
+        try:
+            think_time = next(actions)
+        except StopIteration:
+            self.session_time += self.clock.now - self._session_start.pop(player_name)
+            self.clock.schedule(self.session_gap,
+                                lambda: self.login(player_name))
+            return
+        self.actions += 1
+        self.clock.schedule(think_time,
+                            lambda: self._step(player_name, actions))
+
+    def player_hours(self):
+        """Return the virtual hours players have spent in sessions so far,
+        including the sessions still in progress."""
+        in_progress = sum(self.clock.now - started
+                          for started in self._session_start.itervalues())
+        return (self.session_time + in_progress) / 3600.0
+
+    def economy(self):
+        """Return a snapshot of the players' state.
+
+        Returns:
+            Dictionary of per-player averages: 'cards', 'points', 'slots' and
+            'card_type' (mean card type, rarer cards have higher types).
+        """
+        sessions = self.players.values()
+        cards = [c for session in sessions for c in session.cards.itervalues()]
+        num = float(len(sessions)) or 1
+        return {
+            'cards': len(cards) / num,
+            'points': sum(s.player['points'] for s in sessions) / num,
+            'slots': sum(s.player['slots'] for s in sessions) / num,
+            'card_type': sum(c['type'] for c in cards) / (float(len(cards)) or 1),
+        }
+
+
+def main():
+    """Simulate the players for the requested virtual duration."""
+    parser = optparse.OptionParser(usage='%prog [options] <player_name>')
+    parser.add_option('-n',
+                      '--players',
+                      help='number of players to simulate, named <player_name>0..N-1 (default: %default)',
+                      dest='players',
+                      default=100,
+                      type='int')
+    parser.add_option('-H',
+                      '--hours',
+                      help='virtual hours to simulate (default: %default)',
+                      dest='hours',
+                      default=1.0,
+                      type='float')
+    parser.add_option('-r',
+                      '--ramp-up',
+                      help='virtual seconds over which to spread the first player logins (default: %default)',
+                      dest='ramp_up',
+                      default=0,
+                      type='float')
+    parser.add_option('-g',
+                      '--session-gap',
+                      help='virtual seconds between a player\'s sessions (default: %default)',
+                      dest='session_gap',
+                      default=3600,
+                      type='float')
+    parser.add_option('-s',
+                      '--seed',
+                      help='random seed, for repeatable runs (default: unseeded)',
+                      dest='seed',
+                      default=None,
+                      type='int')
+    parser.add_option('-d',
+                      '--debug',
+                      help='log every action (default:off)',
+                      dest='debug',
+                      default=False,
+                      action='store_true')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('player_name is required')
+    name = args[0]
+
+    # Per-action logging would dominate the run time.
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.DEBUG if options.debug else logging.WARNING,
+        format='%(levelname)8s - %(name)-15s - %(message)s')
+    # Turn off mysql 'table already exists' warnings
+    warnings.filterwarnings('ignore')
+    random.seed(options.seed)
+    try:
+        import card_view
+        card_view.seed(options.seed)
+    except ImportError:
+        pass
+
+    # Everything must use the inline transport, so select it before any
+    # connections are made.
+    cfg['db_api']['transport'] = 'inline'
+    # Sessions run one at a time, so there is nothing to coalesce reads with.
+    cfg['db_api']['read_coalesce_window'] = 0
+    # There is only the one inline worker to route to.
+    cfg['db_api']['route_partitions'] = 0
+    sim = Simulation(options.session_gap)
+    for i in range(options.players):
+        sim.clock.schedule(options.ramp_up * i / float(options.players),
+                           lambda player_name='%s%d' % (name, i): sim.login(player_name))
+
+    with Timer() as t:
+        events = sim.clock.run(options.hours * 3600)
+
+    player_hours = sim.player_hours()
+    print "Simulated %.1f hours of %d players in %.1f seconds (%.0fx real time, %d events)" % (
+        options.hours, options.players, t.elapsed,
+        options.hours * 3600 / (t.elapsed or 1), events)
+    print "  %d sessions (%.1f player-hours in session), %d actions, %d transactions" % (
+        sim.sessions, player_hours, sim.actions, sim.transactions)
+    print "  Statements:                total   per player-hour"
+    for key in sorted(sim.statements):
+        print "    %-20s %10d %17.1f" % (key, sim.statements[key],
+                                         sim.statements[key] / (player_hours or 1))
+    print "  Economy (per player): %s" % ', '.join(
+        '%s %.1f' % item for item in sorted(sim.economy().iteritems()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Moves players between database shards (see db_api/sharding.py) so each
+# lives on the shard a new shard map gives it, e.g. after adding a shard or
+# moving a range bound.  Every shard listed in DB_SHARD_HOSTS is scanned in
+# player id order, --batch-size players at a time, and the players of each
+# batch that belong elsewhere are moved:
+#  - On the destination shard, any copy of the players left by an earlier,
+#    interrupted run is deleted, then their player rows and cards are
+#    inserted, and committed.
+#  - On the source shard, their player rows and cards are deleted, and
+#    committed.
+# So a run that is interrupted can simply be run again.  Moved cards get new
+# ids on the destination shard.  Consumed cards (owner 0) are history, and
+# stay where they are.
+#
+# Card ids stay unique across shards because shard K only hands out ids
+# congruent to K+1 modulo db_shards.id_step, which doesn't change when shards
+# are added.  So the new count can't be above the step, and before moving
+# anything every shard's card ids are checked against it (after a step
+# change, say): if any don't fit, nothing is moved.
+#
+# Players must not be playing, and the db workers must be stopped, while
+# players move.  Afterwards, set the new map in the db_shards config (and
+# DB_SHARD_HOSTS to its shards) and restart the workers and servers.
+#
+# Usage: python rebalance_shards.py --count 3 [--method range --bounds ...]
+#        [--batch-size N] [--dry-run]
+#
+# pylint: disable=invalid-name,line-too-long
+"""Move players between database shards to match a new shard map."""
+from __future__ import with_statement
+from collections import defaultdict
+import logging
+import optparse
+import sys
+import warnings
+
+# Custom modules
+from mimus_cfg import cfg
+from db_config import shards as db_shards
+import db_api.objects.card as card
+import db_api.objects.player as player
+import db_api.sharding as sharding
+import db_worker
+
+rebalancelogger = logging.getLogger('mimus.rebalance')
+
+
+def _select(cursor, table, column, ids):
+    """Return the rows of a table whose column is one of the ids."""
+    cursor.execute('SELECT %s FROM %s WHERE %s IN (%s)' %
+                   (', '.join(table['schema']), table['name'], column,
+                    ', '.join(['%s'] * len(ids))), ids)
+    return list(cursor.fetchall())
+
+
+def _delete(cursor, table, column, ids):
+    """Delete the rows of a table whose column is one of the ids."""
+    cursor.execute('DELETE FROM %s WHERE %s IN (%s)' %
+                   (table['name'], column, ', '.join(['%s'] * len(ids))), ids)
+
+
+def _insert(cursor, table, fields, rows):
+    """Insert rows of the given fields into a table."""
+    if rows:
+        cursor.executemany('INSERT INTO %s (%s) VALUES (%s)' %
+                           (table['name'], ', '.join(fields),
+                            ', '.join(['%s'] * len(fields))), rows)
+
+
+def move_players(src_con, dest_con, player_ids):
+    """Move players, with their cards, from one shard to another.
+
+    Args:
+        src_con: Connection to the shard the players are on.
+        dest_con: Connection to the shard to move them to.
+        player_ids: List of the ids of the players to move.
+
+    Returns:
+        Number of cards moved.
+    """
+    player_table = player.table_schema
+    card_table = card.table_schema
+    src = src_con.cursor()
+    players = _select(src, player_table, 'id', player_ids)
+    cards = _select(src, card_table, 'ownerid', player_ids)
+
+    # Copy them to the destination, replacing what an interrupted run left.
+    dest = dest_con.cursor()
+    _delete(dest, card_table, 'ownerid', player_ids)
+    _delete(dest, player_table, 'id', player_ids)
+    _insert(dest, player_table, list(player_table['schema']), players)
+    # The destination hands out new card ids.
+    _insert(dest, card_table, list(card_table['schema'])[1:],
+            [row[1:] for row in cards])
+    dest_con.commit()
+
+    _delete(src, card_table, 'ownerid', player_ids)
+    _delete(src, player_table, 'id', player_ids)
+    src_con.commit()
+    return len(cards)
+
+
+def misplaced_ids(cons, id_step):
+    """Count the cards of each shard whose ids another shard could hand out.
+
+    Args:
+        cons: List of connections to every shard, in shard order.
+        id_step: Step between the card ids of a shard (db_shards.id_step).
+
+    Returns:
+        Dictionary of the number of cards whose ids aren't congruent to
+        shard + 1 modulo id_step, keyed by shard, for the shards that have
+        any.
+    """
+    misplaced = {}
+    for shard, con in enumerate(cons):
+        cursor = con.cursor()
+        cursor.execute('SELECT COUNT(*) FROM card WHERE id %% %s != %s',
+                       [id_step, (shard + 1) % id_step])
+        cards = cursor.fetchone()[0]
+        con.commit()
+        if cards:
+            misplaced[shard] = cards
+    return misplaced
+
+
+def rebalance(cons, shard_map, batch_size, dry_run=False):
+    """Move every player that isn't on the shard the shard map gives it.
+
+    Args:
+        cons: List of connections to every shard, in shard order.
+        shard_map: The new ShardMap.
+        batch_size: Number of players to scan, and at most move, at a time.
+        dry_run: (optional) Only count the players to move.
+
+    Returns:
+        Dictionary of the number of players moved (or to move), keyed by
+        (source shard, destination shard).
+    """
+    moved = defaultdict(int)
+    for src_shard, src_con in enumerate(cons):
+        last_id = -1
+        while True:
+            cursor = src_con.cursor()
+            cursor.execute('SELECT id FROM player WHERE id > %s ORDER BY id LIMIT %s',
+                           [last_id, batch_size])
+            player_ids = [row[0] for row in cursor.fetchall()]
+            src_con.commit()
+            if not player_ids:
+                break
+            last_id = player_ids[-1]
+            by_dest = defaultdict(list)
+            for player_id in player_ids:
+                dest_shard = shard_map.shard(player_id)
+                if dest_shard != src_shard:
+                    by_dest[dest_shard].append(player_id)
+            for dest_shard, moving in sorted(by_dest.items()):
+                moved[(src_shard, dest_shard)] += len(moving)
+                if dry_run:
+                    continue
+                cards = move_players(src_con, cons[dest_shard], moving)
+                rebalancelogger.info("Moved %d players (%d cards) from shard %d to %d",
+                                     len(moving), cards, src_shard, dest_shard)
+    return dict(moved)
+
+
+def main():
+    """Move players between shards to match the shard map given."""
+    parser = optparse.OptionParser()
+    parser.add_option('-m', '--method', dest='method',
+                      default=cfg['db_shards']['method'],
+                      help="new shard method, 'hash' or 'range' (default: %default)")
+    parser.add_option('-c', '--count', dest='count',
+                      default=cfg['db_shards']['count'], type='int',
+                      help='new number of shards (default: %default)')
+    parser.add_option('--bounds', dest='bounds',
+                      default=','.join(str(bound) for bound in cfg['db_shards']['bounds']),
+                      help="new comma-separated range bounds (default: '%default')")
+    parser.add_option('-b', '--batch-size', dest='batch_size', default=100,
+                      type='int',
+                      help='players to scan and move at a time (default: %default)')
+    parser.add_option('-n', '--dry-run', dest='dry_run', default=False,
+                      action='store_true',
+                      help='only count the players to move')
+    (options, args) = parser.parse_args()  # pylint: disable=unused-variable
+
+    try:
+        shard_map = sharding.ShardMap(
+            options.method, options.count,
+            [int(bound) for bound in options.bounds.split(',') if bound])
+    except ValueError, err:
+        parser.error(str(err))
+    if shard_map.count > len(db_shards):
+        parser.error('DB_SHARD_HOSTS lists %d shards, fewer than --count' %
+                     len(db_shards))
+    if len(db_shards) > cfg['db_shards']['id_step']:
+        parser.error('db_shards.id_step (DB_SHARD_ID_STEP) is %d, fewer than the %d shards: they would hand out the same card ids' %
+                     (cfg['db_shards']['id_step'], len(db_shards)))
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
+                        format='%(asctime)s - %(levelname)8s - %(name)-15s - %(message)s')
+    # Turn off mysql 'table already exists' warnings
+    warnings.filterwarnings('ignore')
+    db_worker.logger = rebalancelogger
+
+    cons = []
+    for shard in range(len(db_shards)):
+        db_worker.init_shard(shard)
+        con = db_worker.connect(shard)
+        db_worker.setup_connection(con, shard)
+        cons.append(con)
+    if cfg['db_shards']['id_step'] > 1:
+        misplaced = misplaced_ids(cons, cfg['db_shards']['id_step'])
+        if misplaced:
+            for shard, cards in sorted(misplaced.items()):
+                rebalancelogger.error("Shard %d has %d cards with ids that don't fit db_shards.id_step %d",
+                                      shard, cards, cfg['db_shards']['id_step'])
+            sys.exit(1)
+    moved = rebalance(cons, shard_map, options.batch_size, options.dry_run)
+    for (src_shard, dest_shard), players in sorted(moved.items()):
+        print "shard %d -> %d: %d players%s" % (src_shard, dest_shard, players,
+                                               ' to move' if options.dry_run else ' moved')
+    print "%d players %s" % (sum(moved.values()),
+                             'to move' if options.dry_run else 'moved')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python2
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Reports how much of the results Redis instance is held by transaction
+# results, per srv_id.  The db worker stores each transaction's results under
+# '<srv_id>:<trans_id>' (a string key in 'poll' ack mode, a list in 'push'
+# mode), and the server deletes them as it reads them, so anything listed here
+# is either in flight or was never read (the server timed out or exited) and
+# will expire after db_api.results_ttl seconds.  Session srv_ids are player
+# ids; coalesced reads use 'coalesced'.  Trans_ids are UUIDs, which tells
+# results apart from other keys sharing the instance, like the redis_store
+# backend's 'mimus:<table>:next_id' counters.
+#
+# Sizes are from MEMORY USAGE (Redis 4.0 or later), which includes Redis' own
+# per-key overhead.  On older servers, only the stored results are counted.
+#
+# Usage: python results_memory.py [--top N]
+#
+# pylint: disable=invalid-name,line-too-long
+"""Report live transaction result keys and bytes per srv_id."""
+import optparse
+import re
+from collections import defaultdict
+from itertools import islice
+
+from redis import StrictRedis
+from redis.exceptions import ResponseError
+
+# Custom modules
+from mimus_cfg import cfg
+
+# Keys sized per pipeline round trip.
+SCAN_COUNT = 1000
+
+# '<srv_id>:<trans_id>', where trans_id is a UUID.
+_RESULT_KEY = re.compile(
+    r'^[^:]+:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+def _payload_bytes(result_redis, keys, types):
+    """Return the bytes of results stored under keys, without Redis' own
+    overhead, for servers without MEMORY USAGE."""
+    pipe = result_redis.pipeline(transaction=False)
+    for key, key_type in zip(keys, types):
+        if key_type == 'list':
+            pipe.lrange(key, 0, -1)
+        else:
+            pipe.strlen(key)
+    return [sum(len(value) for value in reply) if isinstance(reply, list)
+            else reply for reply in pipe.execute()]
+
+
+def result_memory(result_redis):
+    """Total up the live result keys and their size per srv_id.
+
+    Args:
+        result_redis: Redis connection the db workers store results in.
+
+    Returns:
+        Dictionary of srv_id to [keys, bytes].
+    """
+    usage = defaultdict(lambda: [0, 0])
+    memory_usage = True
+    scan = result_redis.scan_iter(match='*:*', count=SCAN_COUNT)
+    while True:
+        batch = list(islice(scan, SCAN_COUNT))
+        if not batch:
+            break
+        keys = [key for key in batch if _RESULT_KEY.match(key)]
+        if not keys:
+            continue
+        pipe = result_redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+        # Skip anything that isn't results, like a redis_streams work queue.
+        found = [(key, key_type) for key, key_type in zip(keys, pipe.execute())
+                 if key_type in ('string', 'list')]
+        if not found:
+            continue
+        keys, types = zip(*found)
+        sizes = None
+        if memory_usage:
+            pipe = result_redis.pipeline(transaction=False)
+            for key in keys:
+                pipe.execute_command('MEMORY', 'USAGE', key)
+            try:
+                sizes = pipe.execute()
+            except ResponseError:
+                memory_usage = False
+        if sizes is None:
+            sizes = _payload_bytes(result_redis, keys, types)
+        for key, size in zip(keys, sizes):
+            if not size:  # consumed or expired since the scan
+                continue
+            srv_id = key.split(':', 1)[0]
+            usage[srv_id][0] += 1
+            usage[srv_id][1] += size
+    return dict(usage)
+
+
+def main():
+    """Print the result keys and bytes per srv_id, largest first."""
+    parser = optparse.OptionParser()
+    parser.add_option('-t', '--top', dest='top', default=20, type='int',
+                      help='number of srv_ids to list (default: %default)')
+    (options, args) = parser.parse_args()  # pylint: disable=unused-variable
+
+    result_redis = StrictRedis(host=cfg['redis_con']['hostname'],
+                               port=cfg['redis_con']['port'],
+                               db=cfg['redis_con']['db'],
+                               password=cfg['redis_con']['password'])
+    usage = result_memory(result_redis)
+    print "%-38s  %8s  %12s" % ('srv_id', 'keys', 'bytes')
+    for srv_id, (keys, size) in sorted(usage.items(), key=lambda item: -item[1][1])[:options.top]:
+        print "%-38s  %8d  %12d" % (srv_id, keys, size)
+    print "%-38s  %8d  %12d" % ('total (%d srv_ids)' % len(usage),
+                                sum(keys for keys, size in usage.values()),
+                                sum(size for keys, size in usage.values()))
+
+
+if __name__ == "__main__":
+    main()